@@ -0,0 +1,198 @@
+'''
+Business: Балансы пользователя по валютам из таблицы balances (строка на пару пользователь + валюта) и их кэш в памяти экземпляра
+Args: SQL-выражение с id пользователя, словарь балансов {код валюты: сумма строкой}; BALANCE_CACHE_TTL, BALANCE_CACHE_SIZE, BALANCE_CACHE_VERIFY_AFTER
+Returns: подзапросы со всеми балансами одним jsonb и с их версией, поля ответа balance_<валюта>, закэшированные балансы с версией
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from db import on_request_end
+
+BALANCE_CACHE_TTL = float(os.environ.get('BALANCE_CACHE_TTL', '3'))
+BALANCE_CACHE_SIZE = int(os.environ.get('BALANCE_CACHE_SIZE', '50000'))
+BALANCE_CACHE_VERIFY_AFTER = float(os.environ.get('BALANCE_CACHE_VERIFY_AFTER', '1'))
+
+
+def user_balances_sql(user_ref: str) -> str:
+    '''Все валюты из справочника, у отсутствующей строки баланса сумма 0.00; суммы текстом, без float'''
+    return f"""(
+        SELECT jsonb_object_agg(c.code, COALESCE(b.amount, 0.00)::text)
+        FROM currencies c
+        LEFT JOIN balances b ON b.user_id = {user_ref} AND b.currency = c.code
+    )"""
+
+
+def balances_version_sql(user_ref: str) -> str:
+    '''
+    Версия балансов — {валюта: id последней записи пользователя в журнале ledger}: любое изменение баланса пишет туда строку.
+    По валюте, а не один max(id): id выдается при вставке, а не при коммите, и ставка в RUB с id N может закоммититься
+    позже пополнения USD с id N + 1. Внутри одной валюты запись журнала делается под блокировкой строки баланса,
+    так что там порядок id совпадает с порядком коммитов.
+    По одному шагу индекса (user_id, currency, id) на валюту, без просмотра всего журнала пользователя.
+    '''
+    return f"""(
+        SELECT jsonb_object_agg(c.code, COALESCE(l.id, 0))
+        FROM currencies c
+        CROSS JOIN LATERAL (SELECT max(id) AS id FROM ledger WHERE user_id = {user_ref} AND currency = c.code) l
+    )"""
+
+
+def version_tag(version: Dict[str, int]) -> str:
+    '''{'RUB': 12, 'USD': 15} -> '12.15' — для ETag, валюты в порядке кода'''
+    return '.'.join(str(version[code]) for code in sorted(version))
+
+
+def balance_fields(balances: Dict[str, str]) -> Dict[str, Any]:
+    '''
+    {'RUB': '10.00', 'USD': '0.00'} -> {'balance_rub': '10.00', 'balance_usd': '0.00', 'balances': {...}}.
+    Поля balance_rub/balance_usd остаются для текущих клиентов, новые валюты появляются в них сами.
+    '''
+    fields: Dict[str, Any] = {f'balance_{code.lower()}': amount for code, amount in balances.items()}
+    fields['balances'] = balances
+    return fields
+
+
+class CachedBalances:
+    __slots__ = ('balances', 'version', 'expires_at', 'verified_at')
+
+    def __init__(self, balances: Dict[str, str], version: Dict[str, int], expires_at: float, verified_at: float):
+        self.balances = balances
+        self.version = version
+        self.expires_at = expires_at
+        # Когда версия последний раз сверялась с журналом; после BALANCE_CACHE_VERIFY_AFTER запись сверяется заново
+        self.verified_at = verified_at
+
+    def needs_verify(self, now: float) -> bool:
+        return now - self.verified_at >= BALANCE_CACHE_VERIFY_AFTER
+
+
+class BalanceCache:
+    '''
+    Балансы по id пользователя с версией из журнала. Полная запись (чтение из БД, обмен) продлевает срок,
+    запись одной валюты после ставки или операции персонала меняет сумму и версию, но срок не продлевает:
+    другие валюты могли измениться на другом экземпляре, и дольше TTL такая запись не проживет.
+    Версии сравниваются по валюте: более старая сумма валюты не затирает более новую, пока запись не истекла.
+    '''
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: 'OrderedDict[int, CachedBalances]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Any) -> Optional[CachedBalances]:
+        user_id = int(user_id)
+        with self._lock:
+            entry = self._items.get(user_id)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self._items[user_id]
+                return None
+            self._items.move_to_end(user_id)
+            return entry
+
+    def put(self, user_id: Any, balances: Dict[str, str], version: Dict[str, int]) -> CachedBalances:
+        user_id = int(user_id)
+        now = time.monotonic()
+        balances, version = dict(balances), dict(version)
+        with self._lock:
+            entry = self._items.get(user_id)
+            if entry is not None and entry.expires_at > now:
+                for code, seen in entry.version.items():
+                    if seen > version.get(code, -1):
+                        balances[code], version[code] = entry.balances[code], seen
+            entry = self._items[user_id] = CachedBalances(balances, version, now + self.ttl, now)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+            return entry
+
+    def update(self, user_id: Any, currency: str, amount: Any, version: Optional[int]) -> None:
+        user_id = int(user_id)
+        with self._lock:
+            entry = self._items.get(user_id)
+            if entry is None or version is None or entry.version.get(currency, 0) >= version or entry.expires_at <= time.monotonic():
+                return
+            # Новый объект, а не правка старого: читатель мог уже взять старую запись и отдавать ее ответом
+            self._items[user_id] = CachedBalances(
+                dict(entry.balances, **{currency: str(amount)}),
+                dict(entry.version, **{currency: version}),
+                entry.expires_at,
+                entry.verified_at,
+            )
+
+    def verified(self, user_id: Any, entry: CachedBalances) -> None:
+        '''Версия записи совпала с журналом: следующая сверка не раньше чем через BALANCE_CACHE_VERIFY_AFTER, срок не продлевается'''
+        with self._lock:
+            if self._items.get(int(user_id)) is entry:
+                entry.verified_at = time.monotonic()
+
+    def discard(self, user_id: Any) -> None:
+        with self._lock:
+            self._items.pop(int(user_id), None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+balance_cache = BalanceCache(BALANCE_CACHE_TTL, BALANCE_CACHE_SIZE)
+_deferred = threading.local()
+
+
+def cached_balances(user_id: Any) -> Optional[CachedBalances]:
+    return balance_cache.get(user_id)
+
+
+def cache_balances(user_id: Any, balances: Dict[str, str], version: Dict[str, int]) -> CachedBalances:
+    return balance_cache.put(user_id, balances, version)
+
+
+def verify_balances(user_id: Any, entry: CachedBalances) -> None:
+    balance_cache.verified(user_id, entry)
+
+
+def _defer(action: Callable[[], Any]) -> None:
+    pending: Optional[List[Callable[[], Any]]] = getattr(_deferred, 'actions', None)
+    if pending is None:
+        pending = _deferred.actions = []
+    pending.append(action)
+
+
+def commit_writes() -> None:
+    '''Сразу после conn.commit(): применяет к кэшу записи, отложенные write_through и write_through_balances'''
+    pending = getattr(_deferred, 'actions', None)
+    _deferred.actions = None
+    for action in pending or ():
+        action()
+
+
+def discard_writes() -> None:
+    '''Транзакция откатилась или упала: ее суммы в кэш не попадают'''
+    _deferred.actions = None
+
+
+# Вызов, не дошедший до commit_writes (исключение, ранний return), не оставит свои суммы следующему вызову в этом потоке
+on_request_end(discard_writes)
+
+
+def write_through_balances(user_id: Any, balances: Dict[str, str], version: Dict[str, int]) -> None:
+    '''Все балансы после изменения в транзакции (обмен); в кэш — в commit_writes(), после коммита'''
+    _defer(lambda: balance_cache.put(user_id, balances, version))
+
+
+def write_through(user_id: Any, currency: str, amount: Any, version: Optional[int]) -> None:
+    '''
+    Новая сумма одной валюты после изменения в БД; version — id записи в журнале по этой валюте.
+    В кэш попадает в commit_writes(), после коммита: откатившаяся транзакция кэш не трогает.
+    Порядок записей в кэш задает версия валюты, а не порядок вызовов.
+    Обновляет только запись, которая уже есть в кэше этого процесса. В облаке функции games и staff
+    живут отдельно от wallet, и там вызов ничего не меняет: изменения с других экземпляров wallet замечает
+    сверкой версии (см. CachedBalances.needs_verify). Сразу это работает только там, где функции делят процесс
+    и кэш, — на dev-сервере (bench/server.py).
+    '''
+    _defer(lambda: balance_cache.update(user_id, currency, amount, version))
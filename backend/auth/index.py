@@ -1,113 +1,145 @@
 '''
 Business: Авторизация и регистрация пользователей казино
-Args: event с httpMethod, body (full_name, pin_code для регистрации/входа)
-Returns: HTTP response с токеном или ошибкой
+Args: event с httpMethod, headers (X-Auth-Token для выхода), body (action, full_name и pin_code для регистрации/входа, password для входа персонала)
+Returns: HTTP response с пользователем и подписанным токеном сессии или ошибкой
 '''
 
-import json
+import hmac
 import os
-from typing import Dict, Any
-from decimal import Decimal
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, Tuple
 
-def decimal_default(obj):
-    if isinstance(obj, Decimal):
-        return float(obj)
-    raise TypeError
+from db import get_db_connection, release_db_connection, dict_cursor
+from router import Router, Request, response, error
+from balances import balance_fields, user_balances_sql
+from tokens import authenticate, issue_token, tokens_enabled, verified_tokens
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+STAFF_PASSWORD = os.environ.get('STAFF_PASSWORD', '')
+STARTING_CURRENCY = 'RUB'
+STARTING_BALANCE = '1000.00'
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
+REGISTER_SQL = """
+    WITH new_user AS (
+        INSERT INTO users (full_name, pin_code) VALUES (%(full_name)s, %(pin_code)s)
+        ON CONFLICT (full_name) DO NOTHING
+        RETURNING id, full_name, is_staff
+    ), starting AS (
+        INSERT INTO balances (user_id, currency, amount)
+        SELECT id, %(currency)s, %(amount)s FROM new_user
+        RETURNING user_id, currency, amount
+    ), entry AS (
+        INSERT INTO ledger (user_id, currency, delta, balance_after, kind)
+        SELECT user_id, currency, amount, amount, 'signup' FROM starting
+    )
+    SELECT u.id, u.full_name, u.is_staff, (
+        SELECT jsonb_object_agg(c.code, COALESCE(s.amount, 0.00)::text)
+        FROM currencies c
+        LEFT JOIN starting s ON s.currency = c.code
+    ) AS balances
+    FROM new_user u
+"""
+
+def user_payload(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {'id': row['id'], 'full_name': row['full_name'], 'is_staff': row['is_staff'], **balance_fields(row['balances'])}
+
+def with_token(user: Dict[str, Any]) -> Dict[str, Any]:
+    if not tokens_enabled():
+        return {'user': user}
+    token, expires_at = issue_token(user['id'], user['is_staff'])
+    return {'user': user, 'token': token, 'expires_at': expires_at}
+
+
+def credentials(request: Request) -> Tuple[str, str]:
+    return request.body.get('full_name', '').strip(), request.body.get('pin_code', '').strip()
+
+
+def valid_credentials(full_name: str, pin_code: str) -> bool:
+    return bool(full_name) and len(pin_code) == 4
+
+
+router = Router(authenticated=False)
+handler = router.handler
+
+
+@router.route('POST', 'staff_login')
+def staff_login(request: Request) -> Dict[str, Any]:
+    password = str(request.body.get('password', ''))
+    if not STAFF_PASSWORD or not hmac.compare_digest(password.encode(), STAFF_PASSWORD.encode()):
+        return error(401, 'Неверный пароль')
+    
+    # Панель пускает только по подписанному токену: вход без него был бы успешным, но бесполезным
+    if not tokens_enabled():
+        return error(503, 'Токены отключены: задайте SESSION_SECRET')
+    
+    staff_user = {'id': 0, 'full_name': 'Персонал', 'is_staff': True, **balance_fields({'RUB': '0.00', 'USD': '0.00'})}
+    return response(200, {
+        'success': True,
+        **with_token(staff_user),
+        'message': 'Вход в панель персонала выполнен'
+    })
+
+
+@router.route('POST', 'logout')
+def logout(request: Request) -> Dict[str, Any]:
+    session = authenticate(request.headers)
+    
+    if session is None or session.jti is None:
+        return error(401, 'Не авторизован')
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    verified_tokens.revoke(cur, session)
+    conn.commit()
+    cur.close()
+    release_db_connection(conn)
+    
+    return response(200, {'success': True})
+
+
+@router.route('POST', 'register')
+def register(request: Request) -> Dict[str, Any]:
+    full_name, pin_code = credentials(request)
+    if not valid_credentials(full_name, pin_code):
+        return error(400, 'Введите ФИО и 4-значный PIN-код')
+    
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    cur.execute(REGISTER_SQL, {'full_name': full_name, 'pin_code': pin_code, 'currency': STARTING_CURRENCY, 'amount': STARTING_BALANCE})
+    user = cur.fetchone()
+    conn.commit()
+    cur.close()
+    release_db_connection(conn)
+    
+    if not user:
+        return error(400, 'Пользователь с таким ФИО уже существует')
+    
+    return response(200, {
+        'success': True,
+        **with_token(user_payload(user)),
+        'message': 'Регистрация успешна! Начальный баланс: 1000₽'
+    })
+
+
+@router.route('POST', 'login')
+def login(request: Request) -> Dict[str, Any]:
+    full_name, pin_code = credentials(request)
+    if not valid_credentials(full_name, pin_code):
+        return error(400, 'Введите ФИО и 4-значный PIN-код')
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    cur.execute(
+        f"SELECT id, full_name, is_staff, {user_balances_sql('users.id')} AS balances FROM users WHERE full_name = %s AND pin_code = %s",
+        (full_name, pin_code)
+    )
+    user = cur.fetchone()
+    cur.close()
+    release_db_connection(conn)
     
-    if method == 'POST':
-        body = json.loads(event.get('body', '{}'))
-        action = body.get('action')
-        full_name = body.get('full_name', '').strip()
-        pin_code = body.get('pin_code', '').strip()
-        
-        if not full_name or not pin_code or len(pin_code) != 4:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Введите ФИО и 4-значный PIN-код'})
-            }
-        
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        if action == 'register':
-            cur.execute("SELECT id FROM users WHERE full_name = %s", (full_name,))
-            if cur.fetchone():
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Пользователь с таким ФИО уже существует'})
-                }
-            
-            cur.execute(
-                "INSERT INTO users (full_name, pin_code, balance_rub) VALUES (%s, %s, 1000.00) RETURNING id, full_name, is_staff, balance_rub, balance_usd",
-                (full_name, pin_code)
-            )
-            conn.commit()
-            user = cur.fetchone()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'user': dict(user),
-                    'message': 'Регистрация успешна! Начальный баланс: 1000₽'
-                }, default=decimal_default)
-            }
-        
-        elif action == 'login':
-            cur.execute(
-                "SELECT id, full_name, is_staff, balance_rub, balance_usd FROM users WHERE full_name = %s AND pin_code = %s",
-                (full_name, pin_code)
-            )
-            user = cur.fetchone()
-            cur.close()
-            conn.close()
-            
-            if not user:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Неверное ФИО или PIN-код'})
-                }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'user': dict(user),
-                    'message': 'Вход выполнен успешно'
-                }, default=decimal_default)
-            }
+    if not user:
+        return error(401, 'Неверное ФИО или PIN-код')
     
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+    return response(200, {
+        'success': True,
+        **with_token(user_payload(user)),
+        'message': 'Вход выполнен успешно'
+    })
@@ -0,0 +1,129 @@
+'''
+Business: Общее ядро обработчиков функций: ответ на OPTIONS, разбор event, проверка сессии, таблица маршрутов (метод, action) и построитель ответов
+Args: event и context платформы; маршруты регистрируются в index.py декоратором router.route(метод, action, ...)
+Returns: handler(event, context) для index.py, ответы response/error/failure с заранее собранными заголовками
+'''
+
+import json
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from db import pooled
+from money import JSON_HEADERS, dumps
+from tokens import Session, authenticate
+
+CORS_HEADERS = MappingProxyType({
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, Idempotency-Key, If-None-Match',
+    'Access-Control-Max-Age': '86400',
+})
+
+Response = Dict[str, Any]
+Route = Callable[['Request'], Response]
+
+# Постоянные отказы самого роутера сериализуются один раз
+UNAUTHORIZED = dumps({'error': 'Не авторизован'})
+METHOD_NOT_ALLOWED = dumps({'error': 'Method not allowed'})
+
+
+def response(status: int, payload: Any = None, headers: Mapping[str, str] = JSON_HEADERS, body: Optional[str] = None) -> Response:
+    '''
+    Единственное место, где собирается ответ. payload сериализуется в JSON, готовое тело (CSV, сохраненный ответ) — в body.
+    Заголовки копируются: общие константы неизменяемы, а ответ потом дополняют (Server-Timing).
+    copy(), а не dict(): у MappingProxyType он копирует словарь целиком, без обхода по ключам.
+    '''
+    return {
+        'statusCode': status,
+        'headers': headers.copy(),
+        'body': body if body is not None else '' if payload is None else dumps(payload),
+    }
+
+
+def error(status: int, message: str) -> Response:
+    return response(status, {'error': message})
+
+
+def failure(status: int, message: str) -> Response:
+    '''Ошибка действия: клиенты POST-запросов смотрят на success'''
+    return response(status, {'success': False, 'error': message})
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Request:
+    __slots__ = ('event', 'method', 'headers', 'params', 'body', 'action', 'session')
+
+    def __init__(self, event: Dict[str, Any], method: str, headers: Dict[str, Any], session: Optional[Session]):
+        self.event = event
+        self.method = method
+        self.headers = headers
+        self.params: Dict[str, Any] = event.get('queryStringParameters') or {}
+        self.body: Dict[str, Any] = {}
+        if method == 'POST':
+            try:
+                self.body = json.loads(event.get('body') or '{}')
+            except ValueError:
+                raise BadRequest('Некорректный JSON')
+            if not isinstance(self.body, dict):
+                raise BadRequest('Некорректный JSON')
+        # action для POST — из тела, для GET — режим из mode
+        action = self.body.get('action') if method == 'POST' else self.params.get('mode')
+        self.action: Optional[str] = action if isinstance(action, str) else None
+        self.session = session
+
+    @property
+    def user_id(self) -> Any:
+        return self.session.user_id
+
+
+class Router:
+    '''
+    Маршрут ищется по (метод, action), затем по (метод, None) — маршрут по умолчанию для метода.
+    До маршрута не загружается драйвер БД: OPTIONS, 401, ответ guard и отказы валидации внутри маршрута
+    обходятся без psycopg2 и соединения. guard — общая проверка функции (лимиты, права), None — пропустить.
+    '''
+
+    def __init__(self, authenticated: bool = True, default_method: str = 'GET',
+                 guard: Optional[Callable[[Request], Optional[Response]]] = None):
+        self.authenticated = authenticated
+        self.default_method = default_method
+        self.guard = guard
+        self.routes: Dict[Tuple[str, Optional[str]], Route] = {}
+        self.handler = pooled(self.handle)
+
+    def route(self, method: str, *actions: Optional[str]) -> Callable[[Route], Route]:
+        def register(func: Route) -> Route:
+            for action in actions or (None,):
+                self.routes[(method, action)] = func
+            return func
+        return register
+
+    def handle(self, event: Dict[str, Any], context: Any) -> Response:
+        method = event.get('httpMethod', self.default_method)
+
+        if method == 'OPTIONS':
+            return response(200, headers=CORS_HEADERS)
+
+        # Сессия проверяется до разбора тела: для 401 тело не нужно
+        headers = event.get('headers') or {}
+        session = authenticate(headers) if self.authenticated else None
+        if self.authenticated and session is None:
+            return response(401, body=UNAUTHORIZED)
+
+        try:
+            request = Request(event, method, headers, session)
+        except BadRequest as e:
+            return error(400, str(e))
+
+        if self.guard is not None:
+            rejected = self.guard(request)
+            if rejected is not None:
+                return rejected
+
+        route = self.routes.get((method, request.action)) or self.routes.get((method, None))
+        if route is None:
+            return response(405, body=METHOD_NOT_ALLOWED)
+        return route(request)
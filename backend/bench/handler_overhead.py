@@ -0,0 +1,119 @@
+'''
+Business: Замер холодного старта и накладных расходов обработчика на вызовах, которым не нужна БД: OPTIONS, 401, ошибка валидации
+Args: python backend/bench/handler_overhead.py [--dsn postgresql://...] [--starts 10] [--calls 20000]; --dsn нужен, если обработчик открывает соединение до валидации
+Returns: медиана импорта index и первого OPTIONS в новом процессе, загружен ли psycopg2, мкс на вызов и открытые соединения по случаям
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+FUNCTIONS = ('auth', 'games', 'wallet', 'staff')
+
+# Подставляется токеном персонала, выписанным модулем tokens функции staff после загрузки обработчиков
+STAFF_TOKEN = 'staff'
+
+# (функция, название, метод, заголовки, тело) — ни один случай не должен доходить до запроса в БД
+CASES: List[Tuple[str, str, str, Dict[str, str], Any]] = [
+    ('auth', 'OPTIONS', 'OPTIONS', {}, None),
+    ('auth', 'register без PIN', 'POST', {}, {'action': 'register', 'full_name': 'Игрок'}),
+    ('games', 'OPTIONS', 'OPTIONS', {}, None),
+    ('games', '401', 'POST', {}, {'game_type': 'roulette', 'bet_amount': 10}),
+    ('games', 'ставка 0', 'POST', {'X-User-Id': '1'}, {'game_type': 'roulette', 'bet_amount': 0}),
+    ('wallet', 'OPTIONS', 'OPTIONS', {}, None),
+    ('wallet', '401', 'GET', {}, None),
+    ('wallet', 'обмен на 0', 'POST', {'X-User-Id': '1'}, {'action': 'exchange', 'amount': 0, 'from_currency': 'RUB', 'to_currency': 'USD'}),
+    ('staff', 'OPTIONS', 'OPTIONS', {}, None),
+    ('staff', '401', 'GET', {}, None),
+    ('staff', 'неверное решение', 'POST', {'X-Auth-Token': STAFF_TOKEN}, {'action': 'process_request', 'request_id': 1, 'decision': 'maybe'}),
+]
+
+COLD_START = '''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import index
+imported = time.perf_counter()
+index.handler({'httpMethod': 'OPTIONS', 'headers': {}, 'body': ''}, None)
+answered = time.perf_counter()
+print(json.dumps({'import': imported - started, 'first': answered - imported, 'psycopg2': 'psycopg2' in sys.modules}))
+'''
+
+
+def cold_start(fn: str, starts: int) -> Dict[str, Any]:
+    samples = []
+    for _ in range(starts):
+        out = subprocess.run(
+            [sys.executable, '-c', COLD_START, os.path.join(BACKEND, fn)],
+            capture_output=True, text=True, check=True, env=os.environ,
+        )
+        samples.append(json.loads(out.stdout))
+    return {
+        'import_ms': statistics.median(s['import'] for s in samples) * 1000,
+        'first_ms': statistics.median(s['first'] for s in samples) * 1000,
+        'psycopg2': samples[-1]['psycopg2'],
+    }
+
+
+def per_call(calls: int) -> List[Tuple[str, str, int, float, bool, int]]:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from load import load_handlers
+
+    handlers = load_handlers()
+    staff_tokens = sys.modules['bench_staff_tokens']
+    staff_token, _ = staff_tokens.issue_token(0, True)
+    # Настоящий токен персонала раз в SESSION_REVOCATION_REFRESH перечитывает список отзыва из БД;
+    # здесь меряется обработчик без БД, поэтому список считается только что загруженным
+    staff_tokens.verified_tokens._revoked_loaded_at = time.monotonic()
+    results = []
+    for fn, name, method, headers, body in CASES:
+        headers = {k: staff_token if v is STAFF_TOKEN else v for k, v in headers.items()}
+        event = {
+            'httpMethod': method,
+            'headers': headers,
+            'queryStringParameters': {},
+            'body': json.dumps(body) if body is not None else '',
+        }
+        handler = handlers[fn]
+        status = handler(dict(event), None)['statusCode']
+        started = time.perf_counter()
+        for _ in range(calls):
+            handler(dict(event), None)
+        elapsed = time.perf_counter() - started
+        db = sys.modules.get(f'bench_{fn}_db')
+        opened = db.pool_stats()['misses'] + db.pool_stats()['hits'] if db else 0
+        results.append((fn, name, status, elapsed / calls * 1e6, 'psycopg2' in sys.modules, opened))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL', 'postgresql://localhost/unused'))
+    parser.add_argument('--starts', type=int, default=10, help='новых процессов на функцию для холодного старта')
+    parser.add_argument('--calls', type=int, default=20000, help='вызовов на случай')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    os.environ.setdefault('REQUEST_TIMING', '0')
+    os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+
+    print(f'{"function":8s} {"import ms":>10s} {"1st OPTIONS ms":>15s}  psycopg2 loaded')
+    for fn in FUNCTIONS:
+        cold = cold_start(fn, args.starts)
+        print(f'{fn:8s} {cold["import_ms"]:10.2f} {cold["first_ms"]:15.3f}  {cold["psycopg2"]}')
+
+    print()
+    print(f'{"function":8s} {"case":20s} {"status":>6s} {"us/call":>9s}  {"psycopg2":8s} {"pool acquires":>13s}')
+    for fn, name, status, micros, loaded, opened in per_call(args.calls):
+        print(f'{fn:8s} {name:20s} {status:6d} {micros:9.2f}  {str(loaded):8s} {opened:13d}')
+
+
+if __name__ == '__main__':
+    main()
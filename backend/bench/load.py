@@ -0,0 +1,399 @@
+'''
+Business: Нагрузочный прогон всех функций: handler(event, context) вызываются напрямую на локальном Postgres
+Args: python backend/bench/load.py --dsn postgresql://... [--setup] [--workers 8] [--duration 20] [--mix default] [--out bench.json] [--compare old.json]
+Returns: пропускная способность, p50/p95/p99 и число обращений к БД на запрос по каждой операции; JSON для сравнения между коммитами
+'''
+
+import argparse
+import glob
+import importlib
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MIGRATIONS = os.path.join(BACKEND, '..', 'db_migrations')
+FUNCTIONS = ('auth', 'games', 'wallet', 'staff')
+
+PLAYER_PIN = '0000'
+STAFF_PASSWORD = 'bench-staff'
+
+MIXES: Dict[str, Dict[str, int]] = {
+    'default': {
+        'login': 5,
+        'balance': 30,
+        'roulette': 25,
+        'roulette_batch': 3,
+        'mines': 10,
+        'exchange': 10,
+        'deposit_request': 5,
+        'staff_queue': 10,
+        'staff_count': 2,
+    },
+    'games': {'roulette': 60, 'roulette_batch': 10, 'mines': 30},
+    'reads': {'balance': 70, 'staff_queue': 20, 'staff_count': 10},
+}
+
+_round_trips = threading.local()
+
+
+def _count_round_trip() -> None:
+    _round_trips.value = getattr(_round_trips, 'value', 0) + 1
+
+
+def install_round_trip_counter() -> None:
+    '''
+    Каждый execute, commit и rollback — отдельное обращение к серверу.
+    Соединения пулов создаются через psycopg2.connect, поэтому достаточно подменить фабрику соединения.
+    '''
+    import psycopg2
+    import psycopg2.extensions
+
+    cursor_types: Dict[type, type] = {}
+
+    class CountingCursorMixin:
+        def execute(self, *args: Any, **kwargs: Any) -> Any:
+            _count_round_trip()
+            return super().execute(*args, **kwargs)
+
+    class CountingConnection(psycopg2.extensions.connection):
+        def cursor(self, *args: Any, **kwargs: Any) -> Any:
+            base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+            if base not in cursor_types:
+                cursor_types[base] = type('Counting' + base.__name__, (CountingCursorMixin, base), {})
+            kwargs['cursor_factory'] = cursor_types[base]
+            return super().cursor(*args, **kwargs)
+
+        def commit(self) -> None:
+            _count_round_trip()
+            super().commit()
+
+        def rollback(self) -> None:
+            _count_round_trip()
+            super().rollback()
+
+    connect = psycopg2.connect
+
+    def counting_connect(*args: Any, **kwargs: Any) -> Any:
+        kwargs.setdefault('connection_factory', CountingConnection)
+        return connect(*args, **kwargs)
+
+    psycopg2.connect = counting_connect
+
+
+def load_handlers() -> Dict[str, Callable[..., Dict[str, Any]]]:
+    '''
+    В каждой функции свои db.py, money.py, tokens.py с одинаковыми именами модулей.
+    Функции импортируются по очереди, после каждой ее модули убираются из sys.modules под уникальные имена,
+    так что у каждой функции остается свой пул соединений, как при настоящем деплое.
+    '''
+    handlers = {}
+    for fn in FUNCTIONS:
+        path = os.path.abspath(os.path.join(BACKEND, fn))
+        sys.path.insert(0, path)
+        try:
+            handlers[fn] = importlib.import_module('index').handler
+        finally:
+            sys.path.remove(path)
+            for name, module in list(sys.modules.items()):
+                module_file = getattr(module, '__file__', None) or ''
+                if os.path.dirname(os.path.abspath(module_file)) == path:
+                    sys.modules[f'bench_{fn}_{name}'] = sys.modules.pop(name)
+    return handlers
+
+
+def setup_database(dsn: str, players: int, pending: int) -> None:
+    '''Пустая база: все миграции по порядку, игроки с балансом и очередь заявок'''
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    for migration in sorted(glob.glob(os.path.join(MIGRATIONS, 'V*.sql'))):
+        cur.execute(open(migration, encoding='utf-8').read())
+    cur.execute(
+        """
+        WITH players AS (
+            INSERT INTO users (full_name, pin_code)
+            SELECT 'Игрок ' || g, %s FROM generate_series(1, %s) g
+            RETURNING id
+        ), seeded AS (
+            INSERT INTO balances (user_id, currency, amount)
+            SELECT id, 'RUB', 1000000 FROM players
+            UNION ALL
+            SELECT id, 'USD', 10000 FROM players
+            RETURNING user_id, currency, amount
+        )
+        INSERT INTO ledger (user_id, currency, delta, balance_after, kind)
+        SELECT user_id, currency, amount, amount, 'opening' FROM seeded
+        """,
+        (PLAYER_PIN, players)
+    )
+    cur.execute(
+        """
+        INSERT INTO requests (user_id, type, amount, currency, created_at)
+        SELECT u.id, CASE WHEN g %% 3 = 0 THEN 'withdraw' ELSE 'deposit' END, 100 + g %% 5000,
+               CASE WHEN g %% 4 = 0 THEN 'USD' ELSE 'RUB' END, CURRENT_TIMESTAMP - g * INTERVAL '1 second'
+        FROM generate_series(1, %s) g
+        JOIN users u ON u.id = 1 + g %% %s
+        """,
+        (pending, players)
+    )
+    cur.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+class Client:
+    '''Один виртуальный игрок: входит, получает токен и дальше ходит с ним'''
+
+    def __init__(self, handlers: Dict[str, Callable[..., Dict[str, Any]]], rng: random.Random, players: int):
+        self.handlers = handlers
+        self.rng = rng
+        self.players = players
+        self.headers: Dict[str, str] = {}
+        self.staff_headers: Dict[str, str] = {}
+
+    def call(self, fn: str, method: str, body: Optional[Dict[str, Any]] = None,
+             headers: Optional[Dict[str, str]] = None, query: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        event = {
+            'httpMethod': method,
+            'headers': dict(headers or {}, **{'Content-Type': 'application/json'}),
+            'queryStringParameters': query or {},
+            'body': json.dumps(body) if body is not None else '',
+        }
+        response = self.handlers[fn](event, None)
+        if response['statusCode'] >= 500:
+            raise RuntimeError(f'{fn} {method}: {response["statusCode"]} {response["body"][:200]}')
+        return response
+
+    def login(self) -> Dict[str, Any]:
+        full_name = f'Игрок {self.rng.randint(1, self.players)}'
+        response = self.call('auth', 'POST', {'action': 'login', 'full_name': full_name, 'pin_code': PLAYER_PIN})
+        data = json.loads(response['body'])
+        if response['statusCode'] == 200:
+            self.headers = {'X-User-Id': str(data['user']['id'])}
+            if data.get('token'):
+                self.headers['X-Auth-Token'] = data['token']
+        return response
+
+    def staff_login(self) -> None:
+        response = self.call('auth', 'POST', {'action': 'staff_login', 'password': STAFF_PASSWORD})
+        data = json.loads(response['body'])
+        self.staff_headers = {'X-User-Id': '0'}
+        if data.get('token'):
+            self.staff_headers['X-Auth-Token'] = data['token']
+
+    def balance(self) -> Dict[str, Any]:
+        return self.call('wallet', 'GET', headers=self.headers)
+
+    def roulette(self) -> Dict[str, Any]:
+        return self.call('games', 'POST', {
+            'game_type': 'roulette',
+            'bet_amount': self.rng.choice((10, 50, 100)),
+        }, self.headers)
+
+    def roulette_batch(self) -> Dict[str, Any]:
+        return self.call('games', 'POST', {
+            'game_type': 'roulette',
+            'bet_amount': 10,
+            'rounds': 100,
+        }, self.headers)
+
+    def mines(self) -> Dict[str, Any]:
+        '''Полная партия: старт, несколько открытий, забрать выигрыш (если не подорвались)'''
+        response = self.call('games', 'POST', {
+            'game_type': 'mines', 'action': 'start', 'bet_amount': 10, 'mines_count': 3,
+        }, self.headers)
+        data = json.loads(response['body'])
+        session_id = data.get('session_id')
+        if not session_id:
+            return response
+        for cell in self.rng.sample(range(25), 3):
+            response = self.call('games', 'POST', {
+                'game_type': 'mines', 'action': 'reveal', 'session_id': session_id, 'cell': cell,
+            }, self.headers)
+            if json.loads(response['body']).get('finished'):
+                return response
+        return self.call('games', 'POST', {
+            'game_type': 'mines', 'action': 'cashout', 'session_id': session_id,
+        }, self.headers)
+
+    def exchange(self) -> Dict[str, Any]:
+        from_currency, to_currency = self.rng.choice((('RUB', 'USD'), ('USD', 'RUB')))
+        return self.call('wallet', 'POST', {
+            'action': 'exchange', 'amount': 10 if from_currency == 'USD' else 950,
+            'from_currency': from_currency, 'to_currency': to_currency,
+        }, self.headers)
+
+    def deposit_request(self) -> Dict[str, Any]:
+        return self.call('wallet', 'POST', {
+            'action': 'request', 'type': 'deposit', 'amount': 100, 'currency': 'RUB',
+        }, self.headers)
+
+    def staff_queue(self) -> Dict[str, Any]:
+        return self.call('staff', 'GET', headers=self.staff_headers, query={'limit': '50'})
+
+    def staff_count(self) -> Dict[str, Any]:
+        return self.call('staff', 'GET', headers=self.staff_headers, query={'mode': 'count'})
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples: List[float], trips: int, errors: int, elapsed: float) -> Dict[str, Any]:
+    samples = sorted(samples)
+    count = len(samples)
+    return {
+        'count': count,
+        'errors': errors,
+        'rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(samples) / count * 1000, 3) if count else 0.0,
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'db_round_trips': round(trips / count, 2) if count else 0.0,
+    }
+
+
+def run(handlers: Dict[str, Callable[..., Dict[str, Any]]], mix: Dict[str, int], workers: int,
+        duration: float, players: int, seed: int) -> Dict[str, Any]:
+    operations = list(mix)
+    weights = [mix[name] for name in operations]
+    results: Dict[str, Dict[str, Any]] = {name: {'samples': [], 'trips': 0, 'errors': 0} for name in operations}
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(workers + 1)
+    stop_at: List[float] = [0.0]
+
+    def worker(index: int) -> None:
+        client = Client(handlers, random.Random(seed + index), players)
+        client.login()
+        client.staff_login()
+        local = {name: {'samples': [], 'trips': 0, 'errors': 0} for name in operations}
+        start_barrier.wait()
+        while time.perf_counter() < stop_at[0]:
+            name = client.rng.choices(operations, weights)[0]
+            _round_trips.value = 0
+            started = time.perf_counter()
+            try:
+                getattr(client, name)()
+            except Exception as e:
+                local[name]['errors'] += 1
+                print(f'[{name}] {e}', file=sys.stderr)
+                continue
+            local[name]['samples'].append(time.perf_counter() - started)
+            local[name]['trips'] += _round_trips.value
+        with lock:
+            for name, stats in local.items():
+                results[name]['samples'].extend(stats['samples'])
+                results[name]['trips'] += stats['trips']
+                results[name]['errors'] += stats['errors']
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    stop_at[0] = time.perf_counter() + duration
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    operations_summary = {
+        name: summarize(stats['samples'], stats['trips'], stats['errors'], elapsed)
+        for name, stats in results.items()
+    }
+    total = summarize(
+        [s for stats in results.values() for s in stats['samples']],
+        sum(stats['trips'] for stats in results.values()),
+        sum(stats['errors'] for stats in results.values()),
+        elapsed,
+    )
+    return {'elapsed_s': round(elapsed, 3), 'total': total, 'operations': operations_summary}
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    header = f'{"operation":16s} {"count":>8s} {"err":>5s} {"rps":>9s} {"p50 ms":>9s} {"p95 ms":>9s} {"p99 ms":>9s} {"db rt":>7s}'
+    print(header)
+    rows = list(report['operations'].items()) + [('TOTAL', report['total'])]
+    for name, s in rows:
+        line = (f'{name:16s} {s["count"]:8d} {s["errors"]:5d} {s["rps"]:9.1f} '
+                f'{s["p50_ms"]:9.2f} {s["p95_ms"]:9.2f} {s["p99_ms"]:9.2f} {s["db_round_trips"]:7.2f}')
+        old = None
+        if baseline:
+            old = baseline['total'] if name == 'TOTAL' else baseline['operations'].get(name)
+        if old and old['rps'] and old['p95_ms']:
+            line += f'   rps {100 * (s["rps"] / old["rps"] - 1):+6.1f}%  p95 {100 * (s["p95_ms"] / old["p95_ms"] - 1):+6.1f}%'
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='отдельная база для прогона')
+    parser.add_argument('--setup', action='store_true', help='применить миграции и засеять пустую базу')
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--pending', type=int, default=5000, help='заявок в очереди при --setup')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0, help='секунд на прогон')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='default')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='куда сохранить JSON с результатами')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+    os.environ.setdefault('STAFF_PASSWORD', STAFF_PASSWORD)
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.workers))
+
+    if args.setup:
+        setup_database(args.dsn, args.players, args.pending)
+
+    install_round_trip_counter()
+    handlers = load_handlers()
+    report = run(handlers, MIXES[args.mix], args.workers, args.duration, args.players, args.seed)
+    report['meta'] = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'workers': args.workers,
+        'duration_s': args.duration,
+        'mix': args.mix,
+        'weights': MIXES[args.mix],
+        'players': args.players,
+        'seed': args.seed,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print(f'revision {report["meta"]["revision"]}, {args.workers} workers, {report["elapsed_s"]}s, mix {args.mix}')
+    print_report(report, baseline)
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+'''
+Business: Бенчмарк множителей мин: старая формула против предрасчитанной таблицы, плюс проверка RTP
+Args: python backend/bench/mines_multipliers.py [число итераций]
+Returns: время одного вычисления в наносекундах и отчет validate_rtp
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'games'))
+
+from multipliers import GRID_SIZE, MULTIPLIERS, multiplier_for, validate_rtp
+
+PAIRS = [(m, k) for m in range(1, GRID_SIZE) for k in range(0, GRID_SIZE - m + 1)]
+
+
+def legacy_formula(mines_count: int, opened_cells: int) -> float:
+    return 1 + (opened_cells * 0.3 * (mines_count / 10))
+
+
+def run_legacy() -> None:
+    for m, k in PAIRS:
+        legacy_formula(m, k)
+
+
+def run_table() -> None:
+    for m, k in PAIRS:
+        multiplier_for(m, k)
+
+
+def run_table_raw() -> None:
+    for m, k in PAIRS:
+        MULTIPLIERS[m * 26 + k]
+
+
+def main() -> None:
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for name, func in (('legacy float formula', run_legacy), ('table -> Decimal', run_table), ('table raw units', run_table_raw)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print(f'{name:22s} {best / (number * len(PAIRS)) * 1e9:8.1f} ns/lookup')
+
+    report = validate_rtp()
+    print(f"RTP target {report['target_rtp']:.4f}, min {report['min_rtp']:.6f}, max {report['max_rtp']:.6f} "
+          f"over {report['entries']} entries, violations: {len(report['violations'])}")
+    sys.exit(1 if report['violations'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+Business: Бенчмарк сериализации ответа staff GET: старый json.dumps(default=...) против money.dumps
+Args: python backend/bench/money_encode.py [число заявок]
+Returns: пропускная способность кодирования в строках/с и МБ/с
+'''
+
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'staff'))
+
+from money import dumps
+
+
+def decimal_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+
+def legacy_rows(count: int):
+    '''Строки как их отдавал RealDictCursor до перехода: Decimal и datetime'''
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    return [
+        {
+            'id': i,
+            'user_id': i % 997,
+            'type': 'deposit' if i % 3 else 'withdraw',
+            'amount': Decimal(f'{(i * 37) % 100000}.{i % 100:02d}'),
+            'currency': 'RUB' if i % 4 else 'USD',
+            'status': 'pending',
+            'processed_by': None,
+            'created_at': start + timedelta(seconds=i, microseconds=i % 1000000),
+            'processed_at': None,
+            'full_name': f'Клиент Номер {i % 997}',
+        }
+        for i in range(count)
+    ]
+
+
+def wire_rows(rows):
+    '''Те же строки в виде, в котором их теперь отдает драйвер: NUMERIC и TIMESTAMP текстом'''
+    return [dict(r, amount=str(r['amount']), created_at=str(r['created_at'])) for r in rows]
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    old = legacy_rows(count)
+    new = wire_rows(old)
+    size = len(dumps(new).encode())
+
+    cases = (
+        ('json.dumps default=str', lambda: json.dumps(old, default=str)),
+        ('json.dumps default=decimal_default+str', lambda: json.dumps(old, default=lambda o: decimal_default(o) if isinstance(o, Decimal) else str(o))),
+        ('money.dumps (text from driver)', lambda: dumps(new)),
+    )
+    print(f'{count} rows, ~{size / 1024:.0f} KiB per payload')
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=5, repeat=7)) / 5
+        print(f'{name:40s} {count / best:12,.0f} rows/s {size / best / 2**20:8.1f} MiB/s')
+
+
+if __name__ == '__main__':
+    main()
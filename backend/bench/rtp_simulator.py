@@ -0,0 +1,256 @@
+'''
+Business: Monte Carlo проверка RTP до выкладки новых выплат: рулетка и мины для всех mines_count, точек кэшаута и стратегий ставок
+Args: python backend/bench/rtp_simulator.py [--game all|roulette|mines] [--rounds 1000000] [--mines 1-24] [--cashout all|1,3,5] [--strategy flat,uniform,martingale] [--workers N] [--seed 1] [--out rtp.json]
+Returns: RTP, дисперсию выплаты на рубль ставки и маржу казино с 95% доверительными интервалами по каждой конфигурации; код 1, если симуляция расходится с расчетом или RTP выше 100%
+'''
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from fractions import Fraction
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'games'))
+
+from multipliers import (
+    GRID_SIZE, MULTIPLIERS, MULTIPLIER_PLACES, ROULETTE_MULTIPLIER, ROULETTE_WIN_PROBABILITY,
+    mines_payout, roulette_payout, survival_probability,
+)
+
+SCALE = 10 ** MULTIPLIER_PLACES
+ROW = GRID_SIZE + 1
+UNITS = np.array(MULTIPLIERS, dtype=np.int64)
+ROULETTE_UNITS = int(ROULETTE_MULTIPLIER * SCALE)
+
+STRATEGIES = ('flat', 'uniform', 'martingale')
+FLAT_BET_CENTS = 10000
+UNIFORM_BET_CENTS = (100, 100000)
+MARTINGALE_BASE_CENTS = 1000
+MARTINGALE_MAX_CENTS = 1024000
+MARTINGALE_PLAYER_ROUNDS = 100
+
+BLOCK_ROUNDS = 1_000_000
+TASK_ROUNDS = 20_000_000
+Z_95 = 1.959963984540054
+MISMATCH_SIGMAS = 4.0
+
+# n, сумма ставок, сумма выплат, их квадраты и произведение, сумма и квадрат выплаты на рубль ставки
+ACC_SIZE = 8
+
+
+class Config(NamedTuple):
+    game: str
+    mines_count: int
+    cashout: int
+    strategy: str
+
+    @property
+    def label(self) -> str:
+        if self.game == 'roulette':
+            return f'roulette {self.strategy}'
+        return f'mines m={self.mines_count} k={self.cashout} {self.strategy}'
+
+
+def check_payouts() -> None:
+    '''
+    Векторные выплаты в копейках обязаны совпадать с mines_payout/roulette_payout из игры:
+    bet * units // 10^4 — то же округление вниз до копейки, что и Decimal.quantize(ROUND_DOWN).
+    '''
+    bets = [1, 99, 100, 101, 12345, 99999, 100000]
+    for mines_count in range(1, GRID_SIZE):
+        for opened_cells in range(0, GRID_SIZE - mines_count + 1):
+            units = int(UNITS[mines_count * ROW + opened_cells])
+            for cents in bets:
+                expected = mines_payout(Decimal(cents).scaleb(-2), mines_count, opened_cells)
+                if Decimal(cents * units // SCALE).scaleb(-2) != expected:
+                    raise SystemExit(f'Выплата мин расходится с игрой: m={mines_count} k={opened_cells} bet={cents}')
+    for cents in bets:
+        if Decimal(cents * ROULETTE_UNITS // SCALE).scaleb(-2) != roulette_payout(Decimal(cents).scaleb(-2), True):
+            raise SystemExit(f'Выплата рулетки расходится с игрой: bet={cents}')
+
+
+def settle(rng: np.random.Generator, config: Config, bets: np.ndarray) -> np.ndarray:
+    '''Выплаты в копейках по ставкам в копейках для одного блока раундов'''
+    n = len(bets)
+    if config.game == 'roulette':
+        won = rng.random(n) < float(ROULETTE_WIN_PROBABILITY)
+        return np.where(won, bets * ROULETTE_UNITS // SCALE, 0)
+    # Число мин среди первых k открытых клеток случайного поля — гипергеометрическое: выжил, если их ноль
+    hits = rng.hypergeometric(config.mines_count, GRID_SIZE - config.mines_count, config.cashout, size=n)
+    return np.where(hits == 0, bets * UNITS[config.mines_count * ROW + config.cashout] // SCALE, 0)
+
+
+def accumulate(acc: np.ndarray, bets: np.ndarray, wins: np.ndarray) -> None:
+    b = bets.astype(np.float64)
+    w = wins.astype(np.float64)
+    ratio = w / b
+    acc += (len(b), b.sum(), w.sum(), (b * b).sum(), (w * w).sum(), (b * w).sum(), ratio.sum(), (ratio * ratio).sum())
+
+
+def simulate(task: Any) -> np.ndarray:
+    '''Один кусок конфигурации в отдельном процессе со своим потоком случайных чисел'''
+    config, rounds, seed = task
+    rng = np.random.default_rng(seed)
+    acc = np.zeros(ACC_SIZE)
+
+    if config.strategy == 'martingale':
+        # Ставка зависит от прошлого раунда, поэтому вектор идет по игрокам, а цикл — по их раундам
+        players = max(1, rounds // MARTINGALE_PLAYER_ROUNDS)
+        for start in range(0, players, BLOCK_ROUNDS // MARTINGALE_PLAYER_ROUNDS):
+            size = min(BLOCK_ROUNDS // MARTINGALE_PLAYER_ROUNDS, players - start)
+            bets = np.full(size, MARTINGALE_BASE_CENTS, dtype=np.int64)
+            for _ in range(MARTINGALE_PLAYER_ROUNDS):
+                wins = settle(rng, config, bets)
+                accumulate(acc, bets, wins)
+                bets = np.where(wins >= bets, MARTINGALE_BASE_CENTS, bets * 2)
+                bets[bets > MARTINGALE_MAX_CENTS] = MARTINGALE_BASE_CENTS
+        return acc
+
+    for start in range(0, rounds, BLOCK_ROUNDS):
+        size = min(BLOCK_ROUNDS, rounds - start)
+        if config.strategy == 'uniform':
+            bets = rng.integers(UNIFORM_BET_CENTS[0], UNIFORM_BET_CENTS[1], size=size, endpoint=True, dtype=np.int64)
+        else:
+            bets = np.full(size, FLAT_BET_CENTS, dtype=np.int64)
+        accumulate(acc, bets, settle(rng, config, bets))
+    return acc
+
+
+def theoretical_rtp(config: Config) -> Optional[Fraction]:
+    '''
+    Точный RTP с учетом округления выплаты до копейки. Для мартингейла распределение ставок
+    зависит от истории, и точного значения здесь нет — сверяется только интервал.
+    '''
+    if config.game == 'roulette':
+        return ROULETTE_WIN_PROBABILITY * Fraction(ROULETTE_UNITS, SCALE)
+    if config.strategy == 'martingale':
+        return None
+    probability = survival_probability(config.mines_count, config.cashout)
+    units = int(UNITS[config.mines_count * ROW + config.cashout])
+    if config.strategy == 'flat':
+        return probability * Fraction(FLAT_BET_CENTS * units // SCALE, FLAT_BET_CENTS)
+    bets = np.arange(UNIFORM_BET_CENTS[0], UNIFORM_BET_CENTS[1] + 1, dtype=np.int64)
+    return probability * Fraction(int((bets * units // SCALE).sum()), int(bets.sum()))
+
+
+def summarize(config: Config, acc: np.ndarray) -> Dict[str, Any]:
+    n, total_bet, total_win, bet2, win2, bet_win, ratio_sum, ratio2 = acc.tolist()
+    rtp = total_win / total_bet
+    # RTP — отношение сумм, его стандартная ошибка по дельта-методу: дисперсия w - rtp * b на раунд
+    residual = max(win2 - 2 * rtp * bet_win + rtp * rtp * bet2, 0.0) / n
+    std_error = math.sqrt(residual / n) / (total_bet / n)
+    variance = ratio2 / n - (ratio_sum / n) ** 2
+    theory = theoretical_rtp(config)
+
+    report: Dict[str, Any] = {
+        'game': config.game,
+        'mines_count': config.mines_count or None,
+        'cashout': config.cashout or None,
+        'strategy': config.strategy,
+        'rounds': int(n),
+        'rtp': rtp,
+        'rtp_ci95': [rtp - Z_95 * std_error, rtp + Z_95 * std_error],
+        'house_edge': 1 - rtp,
+        'house_edge_ci95': [1 - rtp - Z_95 * std_error, 1 - rtp + Z_95 * std_error],
+        'variance': variance,
+        'std_dev': math.sqrt(max(variance, 0.0)),
+        'theoretical_rtp': float(theory) if theory is not None else None,
+        'z_score': None,
+        'problems': [],
+    }
+    if theory is not None:
+        report['z_score'] = (rtp - float(theory)) / std_error if std_error else 0.0
+        if abs(report['z_score']) > MISMATCH_SIGMAS:
+            report['problems'].append('simulation_mismatch')
+        if theory > 1:
+            report['problems'].append('rtp_above_100')
+    elif report['rtp_ci95'][0] > 1:
+        report['problems'].append('rtp_above_100')
+    return report
+
+
+def parse_range(value: str, low: int, high: int) -> List[int]:
+    result = set()
+    for part in value.split(','):
+        if '-' in part:
+            start, end = part.split('-', 1)
+            result.update(range(int(start), int(end) + 1))
+        else:
+            result.add(int(part))
+    return sorted(x for x in result if low <= x <= high)
+
+
+def build_configs(args: argparse.Namespace) -> List[Config]:
+    strategies = [s for s in args.strategy.split(',') if s]
+    unknown = set(strategies) - set(STRATEGIES)
+    if unknown:
+        raise SystemExit(f'Неизвестные стратегии: {", ".join(sorted(unknown))}')
+
+    configs = []
+    if args.game in ('all', 'roulette'):
+        configs += [Config('roulette', 0, 0, strategy) for strategy in strategies]
+    if args.game in ('all', 'mines'):
+        for mines_count in parse_range(args.mines, 1, GRID_SIZE - 1):
+            safe_cells = GRID_SIZE - mines_count
+            cashouts = range(1, safe_cells + 1) if args.cashout == 'all' else parse_range(args.cashout, 1, safe_cells)
+            configs += [Config('mines', mines_count, k, strategy) for k in cashouts for strategy in strategies]
+    return configs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Monte Carlo RTP игр казино')
+    parser.add_argument('--game', choices=('all', 'roulette', 'mines'), default='all')
+    parser.add_argument('--rounds', type=int, default=1_000_000, help='раундов на конфигурацию')
+    parser.add_argument('--mines', default=f'1-{GRID_SIZE - 1}')
+    parser.add_argument('--cashout', default='all', help='после скольких открытых клеток забирать выигрыш')
+    parser.add_argument('--strategy', default='flat')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    check_payouts()
+    configs = build_configs(args)
+    tasks = []
+    for config in configs:
+        for start in range(0, args.rounds, TASK_ROUNDS):
+            tasks.append((config, min(TASK_ROUNDS, args.rounds - start)))
+    seeds = np.random.SeedSequence(args.seed).spawn(len(tasks))
+
+    started = time.perf_counter()
+    totals = {config: np.zeros(ACC_SIZE) for config in configs}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        work = [(config, rounds, seed) for (config, rounds), seed in zip(tasks, seeds)]
+        for (config, _), acc in zip(tasks, pool.map(simulate, work)):
+            totals[config] += acc
+    elapsed = time.perf_counter() - started
+
+    reports = [summarize(config, totals[config]) for config in configs]
+    rounds = sum(r['rounds'] for r in reports)
+    print(f'{len(configs)} configurations, {rounds} rounds in {elapsed:.1f}s '
+          f'({rounds / elapsed / 1e6:.1f}M rounds/s, {args.workers} workers)')
+    print(f"{'configuration':34s} {'rtp':>9s} {'95% ci':>21s} {'edge':>8s} {'theory':>9s} {'z':>6s} {'variance':>12s}")
+    for config, report in zip(configs, reports):
+        theory = f"{report['theoretical_rtp']:.6f}" if report['theoretical_rtp'] is not None else 'n/a'
+        z_score = f"{report['z_score']:.2f}" if report['z_score'] is not None else ''
+        low, high = report['rtp_ci95']
+        print(f"{config.label:34s} {report['rtp']:9.6f} [{low:9.6f},{high:9.6f}] {report['house_edge']:8.4%} "
+              f"{theory:>9s} {z_score:>6s} {report['variance']:12.4f} {' '.join(report['problems'])}")
+
+    problems = [r for r in reports if r['problems']]
+    print(f'problems: {len(problems)}')
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'seed': args.seed, 'elapsed': elapsed, 'configs': reports}, f, indent=2)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
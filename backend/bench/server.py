@@ -0,0 +1,278 @@
+'''
+Business: Локальный сервер для всех четырех функций в одном процессе: /auth, /games, /wallet, /staff
+Args: python backend/bench/server.py --dsn postgresql://... [--host 127.0.0.1] [--port 8000] [--threads 16] [--access-log] [--setup]; или uvicorn --app-dir backend/bench server:app с DATABASE_URL в окружении
+Returns: HTTP-ответы обработчиков; запрос превращается в event облачной функции, обработчик выполняется в пуле потоков
+'''
+
+import argparse
+import asyncio
+import base64
+import itertools
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from load import FUNCTIONS, STAFF_PASSWORD, load_handlers, setup_database
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+KEEP_ALIVE_TIMEOUT = 30.0
+
+
+class Headers(dict):
+    '''
+    Заголовки как в event платформы (X-User-Id, Content-Type), но поиск без учета регистра:
+    обработчики читают и headers['X-Auth-Token'], и headers.get('x-auth-token').
+    '''
+
+    def __init__(self, pairs: List[Tuple[str, str]]):
+        super().__init__()
+        self._keys: Dict[str, str] = {}
+        for name, value in pairs:
+            key = '-'.join(part.capitalize() for part in name.split('-'))
+            self._keys[name.lower()] = key
+            super().__setitem__(key, value)
+
+    def _key(self, name: Any) -> Any:
+        return self._keys.get(name.lower(), name) if isinstance(name, str) else name
+
+    def __getitem__(self, name: Any) -> Any:
+        return super().__getitem__(self._key(name))
+
+    def __contains__(self, name: Any) -> bool:
+        return super().__contains__(self._key(name))
+
+    def get(self, name: Any, default: Any = None) -> Any:
+        return super().get(self._key(name), default)
+
+
+class Context:
+    '''То немногое из context платформы, что может понадобиться обработчику'''
+
+    def __init__(self, function_name: str):
+        self.request_id = uuid.uuid4().hex
+        self.function_name = function_name
+        self.function_version = 'local'
+        self.memory_limit_in_mb = 0
+
+
+class DevServer:
+    def __init__(self, threads: int, access_log: bool = False):
+        self.access_log = access_log
+        self.handlers = load_handlers()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='handler')
+        share_connection_pool(threads)
+        share_balance_cache()
+        self._requests = itertools.count(1)
+
+    def event(self, method: str, path: str, query: str, headers: Headers, body: bytes) -> Dict[str, Any]:
+        try:
+            text, encoded = body.decode('utf-8'), False
+        except UnicodeDecodeError:
+            text, encoded = base64.b64encode(body).decode(), True
+        return {
+            'httpMethod': method,
+            'path': path,
+            'headers': headers,
+            'queryStringParameters': dict(parse_qsl(query, keep_blank_values=True)),
+            'body': text,
+            'isBase64Encoded': encoded,
+            'requestContext': {
+                'requestId': uuid.uuid4().hex,
+                'requestTimeEpoch': int(time.time() * 1000),
+                'httpMethod': method,
+            },
+        }
+
+    async def dispatch(self, method: str, target: str, headers: Headers, body: bytes) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        url = urlsplit(target)
+        function = url.path.strip('/').split('/', 1)[0]
+        handler = self.handlers.get(function)
+        if handler is None:
+            return 404, [('Content-Type', 'text/plain; charset=utf-8')], f'Нет функции {function!r}, есть: {", ".join(FUNCTIONS)}'.encode()
+
+        event = self.event(method, url.path, url.query, headers, body)
+        loop = asyncio.get_running_loop()
+        try:
+            response = await loop.run_in_executor(self.executor, handler, event, Context(function))
+        except Exception as e:
+            print(f'[{function}] {type(e).__name__}: {e}', file=sys.stderr)
+            return 502, [('Content-Type', 'text/plain; charset=utf-8')], f'{type(e).__name__}: {e}'.encode()
+
+        payload = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            data = base64.b64decode(payload)
+        else:
+            data = payload.encode('utf-8') if isinstance(payload, str) else bytes(payload)
+        response_headers = [(str(k), str(v)) for k, v in (response.get('headers') or {}).items()]
+        return int(response.get('statusCode', 200)), response_headers, data
+
+    async def asgi(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self.executor.shutdown(wait=False)
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        target = scope['path'] + ('?' + scope['query_string'].decode('latin-1') if scope.get('query_string') else '')
+        headers = Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']])
+        status, response_headers, data = await self.dispatch(scope['method'], target, headers, body)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in response_headers],
+        })
+        await send({'type': 'http.response.body', 'body': data})
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        '''HTTP/1.1 с keep-alive; тело запроса только с Content-Length — так шлют и браузер, и curl'''
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self.write(writer, 431, [], b'', close=True)
+                    return
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    await self.write(writer, 400, [], b'', close=True)
+                    return
+                pairs = [tuple(part.strip() for part in line.split(':', 1)) for line in lines[1:] if ':' in line]
+                headers = Headers(pairs)
+
+                if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+                    await self.write(writer, 411, [], b'', close=True)
+                    return
+                try:
+                    length = int(headers.get('Content-Length') or 0)
+                except ValueError:
+                    await self.write(writer, 400, [], b'', close=True)
+                    return
+                if length > MAX_BODY_BYTES:
+                    await self.write(writer, 413, [], b'', close=True)
+                    return
+                body = await reader.readexactly(length) if length else b''
+
+                close = headers.get('Connection', '').lower() == 'close' or version == 'HTTP/1.0'
+                started = time.perf_counter()
+                status, response_headers, data = await self.dispatch(method, target, headers, body)
+                await self.write(writer, status, response_headers, data, close)
+                if self.access_log:
+                    print(f'{next(self._requests):6d} {method:7s} {target} {status} {(time.perf_counter() - started) * 1000:.1f}ms')
+                if close:
+                    return
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def write(writer: asyncio.StreamWriter, status: int, headers: List[Tuple[str, str]], data: bytes, close: bool) -> None:
+        try:
+            reason = HTTPStatus(status).phrase
+        except ValueError:
+            reason = ''
+        lines = [f'HTTP/1.1 {status} {reason}']
+        lines += [f'{k}: {v}' for k, v in headers if k.lower() not in ('content-length', 'connection')]
+        lines.append(f'Content-Length: {len(data)}')
+        lines.append('Connection: close' if close else 'Connection: keep-alive')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data)
+        await writer.drain()
+
+
+def share_connection_pool(size: int) -> None:
+    '''
+    Каждая функция импортирована со своим db.py, и у каждой был бы свой пул.
+    Здесь всем db-модулям подставляется один пул на size соединений — по одному на поток обработчиков.
+    '''
+    modules = [sys.modules[f'bench_{fn}_db'] for fn in FUNCTIONS if f'bench_{fn}_db' in sys.modules]
+    if not modules:
+        return
+    pool = modules[0].ConnectionPool(
+        os.environ['DATABASE_URL'], size, modules[0].POOL_ACQUIRE_TIMEOUT, modules[0].POOL_PING_AFTER,
+    )
+    for module in modules:
+        # Соединения открывает пул первого модуля, остальные сами драйвер не загрузят
+        module.load_driver()
+        module._pool = pool
+
+
+def share_balance_cache() -> None:
+    '''
+    Так же один кэш балансов на все функции: ставка в games и операция персонала в staff
+    сразу видны в балансе, который отдает wallet. В облаке функции живут отдельно и сходятся по TTL и ETag.
+    '''
+    modules = [sys.modules[f'bench_{fn}_balances'] for fn in FUNCTIONS if f'bench_{fn}_balances' in sys.modules]
+    for module in modules[1:]:
+        module.balance_cache = modules[0].balance_cache
+
+
+_server: Optional[DevServer] = None
+
+
+async def app(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    '''ASGI-вход: DATABASE_URL и DEV_SERVER_THREADS берутся из окружения при первом запросе'''
+    global _server
+    if _server is None:
+        _server = DevServer(int(os.environ.get('DEV_SERVER_THREADS', '16')))
+    await _server.asgi(scope, receive, send)
+
+
+async def serve(host: str, port: int, threads: int, access_log: bool) -> None:
+    server = DevServer(threads, access_log)
+    listener = await asyncio.start_server(server.serve_connection, host, port, limit=MAX_HEADER_BYTES)
+    for fn in FUNCTIONS:
+        print(f'{fn:7s} http://{host}:{port}/{fn}')
+    async with listener:
+        await listener.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--threads', type=int, default=16, help='потоков для обработчиков и соединений в общем пуле')
+    parser.add_argument('--access-log', action='store_true', help='строка в stdout на каждый запрос')
+    parser.add_argument('--setup', action='store_true', help='применить миграции и засеять пустую базу, как load.py')
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--pending', type=int, default=5000)
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ.setdefault('SESSION_SECRET', 'dev-secret')
+    os.environ.setdefault('STAFF_PASSWORD', STAFF_PASSWORD)
+
+    if args.setup:
+        setup_database(args.dsn, args.players, args.pending)
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.threads, args.access_log))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
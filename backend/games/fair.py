@@ -0,0 +1,197 @@
+'''
+Business: Доказуемо честные исходы игр: серверный сид публикуется заранее хэшем, исход — HMAC-SHA256(server_seed, client_seed:nonce:block)
+Args: курсор БД и id игрока для сидов; server_seed, client_seed и nonce для расчета исхода; python fair.py для проверки вне сервера
+Returns: пару сидов с зарезервированными nonce, исходы рулетки пачкой, маску мин и раскрытый сид при смене пары
+'''
+
+import argparse
+import hashlib
+import hmac
+import secrets
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+from multipliers import GRID_SIZE, ROULETTE_WIN_PROBABILITY
+from settlement import NO_USER
+
+SERVER_SEED_BYTES = 32
+CLIENT_SEED_BYTES = 8
+MAX_CLIENT_SEED_LENGTH = 64
+_WORDS = struct.Struct('>8I')
+_UINT32 = 2 ** 32
+ROULETTE_WIN_THRESHOLD = int(ROULETTE_WIN_PROBABILITY * _UINT32)
+
+ROTATED = 'rotated'
+ACTIVE_GAME = 'active_game'
+
+# nonce сдвигается сразу на всю пачку раундов; пара создается при первой игре.
+# Ставки одного игрока сериализуются блокировкой строки сида, так что nonce не повторяется
+RESERVE_SQL = """
+    WITH bumped AS (
+        UPDATE fair_seeds
+        SET nonce = nonce + %(rounds)s
+        WHERE user_id = %(user_id)s AND revealed_at IS NULL
+        RETURNING id, server_seed, server_seed_hash, client_seed, nonce - %(rounds)s AS first_nonce
+    ), created AS (
+        INSERT INTO fair_seeds (user_id, server_seed, server_seed_hash, client_seed, nonce)
+        SELECT %(user_id)s, %(server_seed)s, %(server_seed_hash)s, %(client_seed)s, %(rounds)s
+        WHERE NOT EXISTS (SELECT 1 FROM bumped) AND EXISTS (SELECT 1 FROM users WHERE id = %(user_id)s)
+        ON CONFLICT (user_id) WHERE revealed_at IS NULL DO NOTHING
+        RETURNING id, server_seed, server_seed_hash, client_seed, 0::bigint AS first_nonce
+    )
+    SELECT * FROM bumped
+    UNION ALL
+    SELECT * FROM created
+"""
+
+
+class SeedPair:
+    __slots__ = ('id', 'server_seed', 'server_seed_hash', 'client_seed', 'first_nonce')
+
+    def __init__(self, seed_id: int, server_seed: str, server_seed_hash: str, client_seed: str, first_nonce: int):
+        self.id = seed_id
+        self.server_seed = server_seed
+        self.server_seed_hash = server_seed_hash
+        self.client_seed = client_seed
+        self.first_nonce = first_nonce
+
+    def details(self, nonce: int) -> Dict[str, Any]:
+        '''Что пишется в details раунда: самого server_seed там нет, он раскрывается только при смене пары'''
+        return {'seed_id': self.id, 'server_seed_hash': self.server_seed_hash, 'client_seed': self.client_seed, 'nonce': nonce}
+
+
+def new_server_seed() -> str:
+    return secrets.token_hex(SERVER_SEED_BYTES)
+
+
+def new_client_seed() -> str:
+    return secrets.token_hex(CLIENT_SEED_BYTES)
+
+
+def hash_seed(server_seed: str) -> str:
+    return hashlib.sha256(server_seed.encode()).hexdigest()
+
+
+def check_client_seed(client_seed: Any) -> str:
+    if not isinstance(client_seed, str) or not 0 < len(client_seed) <= MAX_CLIENT_SEED_LENGTH \
+            or not client_seed.isascii() or not client_seed.isprintable():
+        raise ValueError('Некорректный client seed')
+    return client_seed
+
+
+def _keyed(server_seed: str) -> Any:
+    '''Ключ HMAC готовится один раз, дальше на каждый блок только copy() и update()'''
+    return hmac.new(server_seed.encode(), digestmod=hashlib.sha256)
+
+
+def stream(server_seed: str, client_seed: str, nonce: int, count: int) -> List[int]:
+    '''count 32-битных слов исхода раунда: блок 0, 1, ... по 8 слов из каждого HMAC'''
+    key = _keyed(server_seed)
+    words: List[int] = []
+    block = 0
+    while len(words) < count:
+        mac = key.copy()
+        mac.update(f'{client_seed}:{nonce}:{block}'.encode())
+        words.extend(_WORDS.unpack(mac.digest()))
+        block += 1
+    return words[:count]
+
+
+def roulette_outcomes(server_seed: str, client_seed: str, first_nonce: int, rounds: int) -> List[bool]:
+    '''Пачка раундов подряд: по одному HMAC на nonce, выигрыш — первое слово меньше порога вероятности'''
+    key = _keyed(server_seed)
+    outcomes = []
+    for nonce in range(first_nonce, first_nonce + rounds):
+        mac = key.copy()
+        mac.update(f'{client_seed}:{nonce}:0'.encode())
+        outcomes.append(_WORDS.unpack(mac.digest())[0] < ROULETTE_WIN_THRESHOLD)
+    return outcomes
+
+
+def mines_mask(server_seed: str, client_seed: str, nonce: int, mines_count: int) -> int:
+    '''Тасование Фишера-Йетса по словам потока: i-я мина — слово * оставшиеся клетки / 2^32'''
+    cells = list(range(GRID_SIZE))
+    mask = 0
+    for word in stream(server_seed, client_seed, nonce, mines_count):
+        mask |= 1 << cells.pop(word * len(cells) // _UINT32)
+    return mask
+
+
+def reserve(cur, user_id: Any, rounds: int) -> Optional[SeedPair]:
+    '''
+    Резервирует rounds подряд идущих nonce текущей пары игрока (создает пару, если ее нет).
+    С rounds = 0 просто показывает текущую пару — так игрок видит хэш сида до первой ставки.
+    None — игрока нет. Вызывается в той же транзакции, что и расчет ставки.
+    '''
+    for _ in range(2):
+        server_seed = new_server_seed()
+        cur.execute(RESERVE_SQL, {
+            'user_id': user_id,
+            'rounds': rounds,
+            'server_seed': server_seed,
+            'server_seed_hash': hash_seed(server_seed),
+            'client_seed': new_client_seed(),
+        })
+        row = cur.fetchone()
+        if row:
+            return SeedPair(row['id'], row['server_seed'], row['server_seed_hash'], row['client_seed'], row['first_nonce'])
+        # Пусто, если пару параллельно создал соседний запрос (ON CONFLICT) — второй проход ее найдет
+    return None
+
+
+def rotate(cur, user_id: Any, client_seed: Optional[str]) -> Tuple[str, Optional[Dict[str, Any]], Dict[str, Any]]:
+    '''
+    Раскрывает текущий server_seed и открывает новую пару с nonce 0.
+    Пока у игрока есть незавершенная игра в мины, сид не раскрывается: по нему можно вычислить поле.
+    Блокировка строки сида ждет ставки, уже зарезервировавшие nonce, а проверка мин идет следующим
+    запросом — с новым снимком, где видны и только что начатые игры. Коммит остается за вызывающим кодом.
+    '''
+    cur.execute(
+        "SELECT id, server_seed, server_seed_hash, client_seed, nonce FROM fair_seeds WHERE user_id = %s AND revealed_at IS NULL FOR UPDATE",
+        (user_id,)
+    )
+    previous = cur.fetchone()
+
+    cur.execute("SELECT EXISTS (SELECT 1 FROM mines_sessions WHERE user_id = %s AND status = 'active') AS active", (user_id,))
+    if cur.fetchone()['active']:
+        return ACTIVE_GAME, None, {}
+
+    if previous:
+        cur.execute("UPDATE fair_seeds SET revealed_at = CURRENT_TIMESTAMP WHERE id = %s", (previous['id'],))
+
+    server_seed = new_server_seed()
+    cur.execute(
+        """
+        INSERT INTO fair_seeds (user_id, server_seed, server_seed_hash, client_seed)
+        SELECT id, %s, %s, %s FROM users WHERE id = %s
+        RETURNING id, server_seed_hash, client_seed, nonce
+        """,
+        (server_seed, hash_seed(server_seed), client_seed or new_client_seed(), user_id)
+    )
+    created = cur.fetchone()
+    if not created:
+        return NO_USER, None, {}
+    return ROTATED, dict(previous) if previous else None, dict(created)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Проверка исхода раунда по раскрытому server seed')
+    parser.add_argument('server_seed')
+    parser.add_argument('client_seed')
+    parser.add_argument('nonce', type=int)
+    parser.add_argument('--game', choices=('roulette', 'mines'), default='roulette')
+    parser.add_argument('--mines-count', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=1, help='для рулетки: сколько nonce подряд начиная с nonce')
+    args = parser.parse_args()
+
+    print(f'server_seed_hash {hash_seed(args.server_seed)}')
+    if args.game == 'roulette':
+        for offset, won in enumerate(roulette_outcomes(args.server_seed, args.client_seed, args.nonce, args.rounds)):
+            print(f'nonce {args.nonce + offset}: {"win" if won else "loss"}')
+    else:
+        mask = mines_mask(args.server_seed, args.client_seed, args.nonce, args.mines_count)
+        print(f'mines_mask {mask}, mines {[i for i in range(GRID_SIZE) if mask >> i & 1]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+'''
+Business: История игр игрока: keyset-пагинация по (created_at, id) и выгрузка в CSV/NDJSON серверным курсором
+Args: id игрока и параметры запроса (limit, cursor, game_type, format) — разбираются до соединения с БД; соединение или курсор БД; HISTORY_EXPORT_MAX_ROWS из окружения
+Returns: страница истории с курсором следующей страницы или части выгрузки, отдаваемые по мере чтения
+'''
+
+import base64
+import csv
+import io
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+GAME_TYPES = ('roulette', 'mines')
+EXPORT_FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+EXPORT_CHUNK_ROWS = 2000
+# Ответ функции собирается целиком и ограничен по размеру (единицы МБ): строка выгрузки — 220–320 байт,
+# так что 5000 строк — около 1.5 МБ. Остальное клиент забирает следующими вызовами с cursor из X-Next-Cursor
+EXPORT_MAX_ROWS = int(os.environ.get('HISTORY_EXPORT_MAX_ROWS', '5000'))
+EXPORT_COLUMNS = ('id', 'game_type', 'bet_amount', 'result', 'win_amount', 'details', 'created_at')
+
+# NDJSON-строку собирает сама БД: details уходит как есть, без разбора JSONB в Python и обратно
+EXPORT_SELECT = {
+    'csv': 'id, game_type, bet_amount, result, win_amount, details::text AS details, created_at',
+    'ndjson': """id, created_at, json_build_object(
+            'id', id, 'game_type', game_type, 'bet_amount', bet_amount::text, 'result', result,
+            'win_amount', win_amount::text, 'details', details, 'created_at', created_at
+        )::text AS line""",
+}
+
+
+def encode_cursor(created_at: str, game_id: int) -> str:
+    return base64.urlsafe_b64encode(f'{created_at}|{game_id}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        created_at, game_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        # Время проверяется здесь: иначе мусор в курсоре дошел бы до ::timestamp в SQL и ответил бы 500
+        datetime.fromisoformat(created_at)
+        return created_at, int(game_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Некорректный курсор')
+
+
+def _filters(user_id: int, params: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+    '''Условия идут в порядке индекса idx_game_history_user_time (user_id, created_at DESC, id DESC)'''
+    clauses = ['user_id = %(user_id)s']
+    args: Dict[str, Any] = {'user_id': user_id}
+
+    game_type = params.get('game_type')
+    if game_type:
+        if game_type not in GAME_TYPES:
+            raise ValueError('Неизвестная игра')
+        clauses.append('game_type = %(game_type)s')
+        args['game_type'] = game_type
+
+    if params.get('cursor'):
+        args['cursor_created_at'], args['cursor_id'] = decode_cursor(params['cursor'])
+        # Отдельное условие на created_at отсекает дневные секции новее курсора: по row-сравнению Postgres их не отбрасывает
+        clauses.append('created_at <= %(cursor_created_at)s::timestamp')
+        clauses.append('(created_at, id) < (%(cursor_created_at)s::timestamp, %(cursor_id)s)')
+
+    return clauses, args
+
+
+def page_query(user_id: int, params: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+    '''Фильтры, курсор и limit страницы; ValueError — 400'''
+    clauses, args = _filters(user_id, params)
+
+    try:
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('Некорректный limit')
+    args['limit'] = max(1, min(limit, MAX_PAGE_SIZE))
+    return clauses, args
+
+
+def fetch_history_page(cur, query: Tuple[List[str], Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    '''query — из page_query'''
+    clauses, args = query
+    cur.execute(f"""
+        SELECT id, game_type, bet_amount, result, win_amount, details, created_at
+        FROM game_history
+        WHERE {' AND '.join(clauses)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s + 1
+    """, args)
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > args['limit']:
+        rows = rows[:args['limit']]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return rows, next_cursor
+
+
+class HistoryExport:
+    '''
+    Выгрузка истории частями: именованный (серверный) курсор отдает по EXPORT_CHUNK_ROWS строк,
+    каждая пачка сразу превращается в кусок текста, так что в памяти не бывает больше одной пачки строк.
+    За один вызов выгружается не больше max_rows строк — столько, сколько помещается в один ответ функции;
+    если осталось еще, после обхода заполняется next_cursor — с ним (параметр cursor) клиент запрашивает продолжение.
+    Параметры проверяются в конструкторе (ValueError — 400), соединение нужно только для stream().
+    '''
+
+    def __init__(self, user_id: int, params: Dict[str, Any], max_rows: int = EXPORT_MAX_ROWS):
+        self.format = params.get('format') or 'csv'
+        if self.format not in EXPORT_FORMATS:
+            raise ValueError('Неизвестный формат выгрузки')
+        self.content_type = EXPORT_FORMATS[self.format]
+        self.clauses, self.args = _filters(user_id, params)
+        self.args['limit'] = max_rows
+        self.rows = 0
+        self.next_cursor: Optional[str] = None
+
+    def stream(self, conn) -> Iterator[str]:
+        cur = conn.cursor(name='game_history_export')
+        cur.itersize = EXPORT_CHUNK_ROWS
+        try:
+            cur.execute(f"""
+                SELECT {EXPORT_SELECT[self.format]}
+                FROM game_history
+                WHERE {' AND '.join(self.clauses)}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %(limit)s + 1
+            """, self.args)
+
+            if self.format == 'csv':
+                yield ','.join(EXPORT_COLUMNS) + '\r\n'
+
+            created_at_index = 1 if self.format == 'ndjson' else EXPORT_COLUMNS.index('created_at')
+            last = None
+            while True:
+                chunk = cur.fetchmany(EXPORT_CHUNK_ROWS)
+                if not chunk:
+                    break
+                remaining = self.args['limit'] - self.rows
+                more = len(chunk) > remaining
+                chunk = chunk[:remaining]
+                if chunk:
+                    last = chunk[-1]
+                    self.rows += len(chunk)
+                    yield self._render(chunk)
+                if more:
+                    self.next_cursor = encode_cursor(last[created_at_index], last[0])
+                    break
+        finally:
+            cur.close()
+
+    def _render(self, chunk: List[Tuple[Any, ...]]) -> str:
+        if self.format == 'ndjson':
+            return ''.join(row[-1] + '\n' for row in chunk)
+        out = io.StringIO()
+        csv.writer(out).writerows(chunk)
+        return out.getvalue()
@@ -1,154 +1,371 @@
 '''
 Business: Игры казино (рулетка и мины)
-Args: event с httpMethod, headers (X-User-Id), body (game_type, bet_amount, mines_count для мин, cells для мин)
-Returns: HTTP response с результатом игры
+Args: event с httpMethod, headers (X-Auth-Token или X-User-Id, Idempotency-Key для POST), queryStringParameters для истории (limit, cursor, game_type, mode=export, format csv/ndjson; выгрузка — до HISTORY_EXPORT_MAX_ROWS строк за вызов, продолжение — с cursor из X-Next-Cursor) или mode=fairness, body (game_type, bet_amount, rounds или bets для пачки спинов рулетки, action start/reveal/cashout, mines_count, session_id и cell для мин; action rotate_seed и client_seed для смены пары сидов)
+Returns: HTTP response с результатом игры и данными для его проверки (повтор с тем же Idempotency-Key — исходный ответ), страницей истории игр, выгрузкой истории или парой сидов
 '''
 
-import json
-import os
-import random
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from decimal import Decimal
-import psycopg2
-from psycopg2.extras import RealDictCursor
-
-def decimal_default(obj):
-    if isinstance(obj, Decimal):
-        return float(obj)
-    raise TypeError
-
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'POST')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    headers = event.get('headers', {})
-    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
-    
-    if not user_id:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Не авторизован'})
-        }
-    
-    if method == 'POST':
-        body = json.loads(event.get('body', '{}'))
-        game_type = body.get('game_type')
-        bet_amount = float(body.get('bet_amount', 0))
+
+from db import get_db_connection, release_db_connection, dict_cursor
+from money import money_str, to_money
+from router import Router, Request, response, error, failure
+from settlement import settle_rounds, NO_USER, INSUFFICIENT_FUNDS, MAX_BATCH_ROUNDS
+from multipliers import roulette_payout
+from mines import GRID_SIZE, sessions, start_session, load_session, settle_session, cells_of
+from history import HistoryExport, fetch_history_page, page_query
+from ratelimit import rate_limited, too_many_requests
+from fair import ACTIVE_GAME, check_client_seed, reserve, roulette_outcomes, rotate
+from idempotency import begin, claim, lookup, save, remember
+from balances import commit_writes
+
+ZERO = Decimal(0)
+# mines_sessions.id — BIGSERIAL: больший id в запросе к БД дал бы ошибку out of range
+MAX_SESSION_ID = 2 ** 63 - 1
+
+def play_mines(user_id: int, body: Dict[str, Any], request: Any) -> Dict[str, Any]:
+    action = body.get('action', 'start')
+    
+    if action == 'start':
+        try:
+            bet_amount = to_money(body.get('bet_amount', 0))
+        except ValueError:
+            bet_amount = ZERO
+        try:
+            mines_count = int(body.get('mines_count', 3))
+        except (TypeError, ValueError):
+            return failure(400, 'Некорректное количество мин')
         
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if bet_amount <= 0:
+            return failure(400, 'Некорректная ставка')
         
-        cur.execute("SELECT balance_rub FROM users WHERE id = %s", (user_id,))
-        user = cur.fetchone()
+        if not 1 <= mines_count < GRID_SIZE:
+            return failure(400, 'Некорректное количество мин')
         
-        if not user:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': False, 'error': 'Пользователь не найден'})
-            }
+        conn = get_db_connection()
+        cur = dict_cursor(conn)
+        reply = claim(cur, request)
+        if reply is None:
+            status, new_balance, session = start_session(cur, user_id, bet_amount, mines_count)
+            reply = mines_started(status, new_balance, session)
+            save(cur, request, reply)
+        conn.commit()
+        commit_writes()
+        cur.close()
+        release_db_connection(conn)
+        remember(request, reply)
+        return reply
+    
+    if action not in ('reveal', 'cashout'):
+        return failure(400, 'Неизвестное действие')
+    
+    try:
+        session_id = int(body.get('session_id', 0))
+    except (TypeError, ValueError):
+        return failure(400, 'Некорректная игра')
+    
+    try:
+        cell = int(body.get('cell', -1))
+        revealed = body.get('revealed', [])
+        if not isinstance(revealed, list):
+            raise TypeError(revealed)
+        revealed = [int(c) for c in revealed]
+    except (TypeError, ValueError):
+        return failure(400, 'Некорректная клетка')
+    exploded = False
+    
+    if not 0 < session_id <= MAX_SESSION_ID:
+        return failure(404, 'Игра не найдена')
+    
+    if action == 'reveal' and not 0 <= cell < GRID_SIZE:
+        return failure(400, 'Некорректная клетка')
+    
+    session = sessions.get(session_id)
+    if session is None or session.user_id != user_id:
+        conn = get_db_connection()
+        cur = dict_cursor(conn)
+        replay = lookup(cur, request)
+        session = load_session(cur, session_id, user_id) if replay is None else None
+        cur.close()
+        release_db_connection(conn)
         
-        if float(user['balance_rub']) < bet_amount:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': False, 'error': 'Недостаточно средств'})
-            }
+        if replay is not None:
+            return replay
         
-        if game_type == 'roulette':
-            win = random.choice([True, False])
-            win_amount = bet_amount * 2 if win else 0
-            result = 'win' if win else 'loss'
-            
-            balance_change = win_amount - bet_amount
-            cur.execute(
-                "UPDATE users SET balance_rub = balance_rub + %s WHERE id = %s RETURNING balance_rub",
-                (balance_change, user_id)
-            )
-            conn.commit()
-            new_balance = cur.fetchone()['balance_rub']
-            
-            cur.execute(
-                "INSERT INTO game_history (user_id, game_type, bet_amount, result, win_amount) VALUES (%s, %s, %s, %s, %s)",
-                (user_id, game_type, bet_amount, result, win_amount)
-            )
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'result': result,
-                    'win_amount': win_amount,
-                    'balance': float(new_balance),
-                    'message': f'Вы {"выиграли" if win else "проиграли"}!'
-                })
-            }
+        if session is None:
+            return failure(404, 'Игра не найдена')
         
-        elif game_type == 'mines':
-            mines_count = int(body.get('mines_count', 3))
-            opened_cells = int(body.get('opened_cells', 0))
-            
-            grid_size = 25
-            mines_positions = set(random.sample(range(grid_size), mines_count))
-            
-            multiplier = 1 + (opened_cells * 0.3 * (mines_count / 10))
-            win_amount = bet_amount * multiplier
-            
-            cur.execute(
-                "UPDATE users SET balance_rub = balance_rub - %s WHERE id = %s RETURNING balance_rub",
-                (bet_amount, user_id)
-            )
-            conn.commit()
-            new_balance = cur.fetchone()['balance_rub']
-            
-            cur.execute(
-                "INSERT INTO game_history (user_id, game_type, bet_amount, result, win_amount, details) VALUES (%s, %s, %s, %s, %s, %s)",
-                (user_id, game_type, bet_amount, 'win', 0, json.dumps({'mines_count': mines_count, 'mines': list(mines_positions)}))
-            )
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'mines': list(mines_positions),
-                    'multiplier': round(multiplier, 2),
-                    'potential_win': round(win_amount, 2),
-                    'balance': float(new_balance)
-                })
-            }
+        # Открытые клетки живут только в кэше экземпляра, где шла игра, поэтому клиент присылает их заново.
+        # Приписать себе лишние клетки невыгодно: каждая из них открывается по-настоящему и может оказаться миной.
+        exploded = any(session.reveal(c) for c in revealed if 0 <= c < GRID_SIZE)
+    
+    if action == 'reveal' and not exploded:
+        if session.revealed >> cell & 1:
+            return failure(400, 'Клетка уже открыта')
         
-        cur.close()
-        conn.close()
+        exploded = session.reveal(cell)
+        
+        if not exploded and not session.cleared:
+            # Открытие клетки без расчета в БД не пишется, его повтор отвечается из памяти экземпляра
+            reply = response(200, {
+                'success': True,
+                'cell': cell,
+                'mine': False,
+                'opened_cells': session.opened_cells,
+                'multiplier': str(session.multiplier),
+                'potential_win': money_str(session.payout)
+            })
+            remember(request, reply)
+            return reply
+    
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    reply = claim(cur, request)
+    if reply is None:
+        settled, new_balance, win_amount = settle_session(cur, session, won=not exploded)
+        reply = mines_settled(settled, new_balance, win_amount, session, cell if action == 'reveal' else None, exploded)
+        save(cur, request, reply)
+    conn.commit()
+    commit_writes()
+    cur.close()
+    release_db_connection(conn)
+    remember(request, reply)
+    return reply
+
+
+def mines_started(status: str, new_balance: Any, session: Any) -> Dict[str, Any]:
+    if status == NO_USER:
+        return failure(400, 'Пользователь не найден')
+    
+    if status == INSUFFICIENT_FUNDS:
+        return failure(400, 'Недостаточно средств')
+    
+    return response(200, {
+        'success': True,
+        'session_id': session.id,
+        'mines_count': session.mines_count,
+        'multiplier': str(session.multiplier),
+        'balance': new_balance
+    })
+
+
+def mines_settled(settled: bool, new_balance: Any, win_amount: Any, session: Any, cell: Any, exploded: bool) -> Dict[str, Any]:
+    if not settled:
+        return failure(409, 'Игра уже завершена')
+    
+    return response(200, {
+        'success': True,
+        'cell': cell,
+        'mine': exploded,
+        'finished': True,
+        'mines': cells_of(session.mines),
+        'opened_cells': session.opened_cells,
+        'multiplier': str(session.multiplier),
+        'win_amount': money_str(win_amount),
+        'balance': new_balance
+    })
+
+
+def play_roulette(cur, user_id: int, bets: List[Decimal], batch: bool) -> Dict[str, Any]:
+    seed = reserve(cur, user_id, len(bets))
+    
+    if seed is None:
+        status, new_balance = NO_USER, None
+    else:
+        outcomes = roulette_outcomes(seed.server_seed, seed.client_seed, seed.first_nonce, len(bets))
+        rounds = [
+            (bet, roulette_payout(bet, won), 'win' if won else 'loss', seed.details(seed.first_nonce + i))
+            for i, (bet, won) in enumerate(zip(bets, outcomes))
+        ]
+        status, new_balance = settle_rounds(cur, user_id, 'roulette', rounds)
+    
+    if status == NO_USER:
+        return failure(400, 'Пользователь не найден')
+    
+    if status == INSUFFICIENT_FUNDS:
+        return failure(400, 'Недостаточно средств')
+    
+    if batch:
+        return response(200, {
+            'success': True,
+            'rounds': [
+                {'bet_amount': money_str(bet), 'result': result, 'win_amount': money_str(win), 'nonce': details['nonce']}
+                for bet, win, result, details in rounds
+            ],
+            'total_bet': money_str(sum(r[0] for r in rounds)),
+            'total_win': money_str(sum(r[1] for r in rounds)),
+            'balance': new_balance,
+            'fair': seed.details(seed.first_nonce)
+        })
+    
+    bet, win_amount, result, _ = rounds[0]
+    return response(200, {
+        'success': True,
+        'result': result,
+        'win_amount': money_str(win_amount),
+        'balance': new_balance,
+        'fair': seed.details(seed.first_nonce),
+        'message': f'Вы {"выиграли" if result == "win" else "проиграли"}!'
+    })
+
+
+def seed_rotated(status: str, previous: Any, current: Any) -> Dict[str, Any]:
+    if status == ACTIVE_GAME:
+        return failure(409, 'Сначала завершите игру в мины')
+    
+    if status == NO_USER:
+        return failure(400, 'Пользователь не найден')
+    
+    return response(200, {'success': True, 'previous': previous, 'current': current})
+
+def limit(request: Request) -> Optional[Dict[str, Any]]:
+    if request.method == 'GET':
+        action = 'read'
+    else:
+        game_type = request.body.get('game_type')
+        action = game_type if game_type in ('roulette', 'mines') else 'write'
+    retry_after = rate_limited(request.user_id, action)
+    return too_many_requests(retry_after) if retry_after is not None else None
+
+
+router = Router(default_method='POST', guard=limit)
+handler = router.handler
+
+
+@router.route('GET', 'fairness')
+def fairness(request: Request) -> Dict[str, Any]:
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    seed = reserve(cur, request.user_id, 0)
+    conn.commit()
+    cur.close()
+    release_db_connection(conn)
+    
+    if seed is None:
+        return error(400, 'Пользователь не найден')
+    
+    return response(200, {
+        'server_seed_hash': seed.server_seed_hash,
+        'client_seed': seed.client_seed,
+        'nonce': seed.first_nonce
+    })
+
+
+@router.route('GET', 'export')
+def export_history(request: Request) -> Dict[str, Any]:
+    try:
+        export = HistoryExport(request.user_id, request.params)
+    except ValueError as e:
+        return error(400, str(e))
+    
+    conn = get_db_connection()
+    body = ''.join(export.stream(conn))
+    conn.commit()
+    
+    headers = {
+        'Content-Type': export.content_type,
+        'Content-Disposition': f'attachment; filename="game_history.{export.format}"',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'X-Next-Cursor, X-Export-Rows',
+        'X-Export-Rows': str(export.rows)
+    }
+    if export.next_cursor:
+        headers['X-Next-Cursor'] = export.next_cursor
+    release_db_connection(conn)
+    
+    return response(200, headers=headers, body=body)
+
+
+@router.route('GET')
+def history(request: Request) -> Dict[str, Any]:
+    # Параметры разбираются до соединения: отказ валидации не загружает драйвер и не берет соединение из пула
+    try:
+        query = page_query(request.user_id, request.params)
+    except ValueError as e:
+        return error(400, str(e))
+    
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    games, next_cursor = fetch_history_page(cur, query)
+    cur.close()
+    release_db_connection(conn)
+    
+    return response(200, {'items': [dict(g) for g in games], 'next_cursor': next_cursor})
+
+
+@router.route('POST', 'rotate_seed')
+def rotate_seed(request: Request) -> Dict[str, Any]:
+    idempotent, reply = begin(request.headers, request.user_id, 'games', request.body)
+    if reply is not None:
+        return reply
+    
+    client_seed = request.body.get('client_seed')
+    if client_seed is not None:
+        try:
+            check_client_seed(client_seed)
+        except ValueError as e:
+            return failure(400, str(e))
+    
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    reply = claim(cur, idempotent)
+    if reply is None:
+        status, previous, current = rotate(cur, request.user_id, client_seed)
+        reply = seed_rotated(status, previous, current)
+        save(cur, idempotent, reply)
+    conn.commit()
+    commit_writes()
+    cur.close()
+    release_db_connection(conn)
+    remember(idempotent, reply)
+    return reply
+
+
+@router.route('POST')
+def play(request: Request) -> Dict[str, Any]:
+    body = request.body
+    user_id = request.user_id
+    game_type = body.get('game_type')
+    batch = 'rounds' in body or 'bets' in body
+    
+    idempotent, reply = begin(request.headers, user_id, 'games', body)
+    if reply is not None:
+        return reply
+    
+    if game_type == 'mines':
+        return play_mines(user_id, body, idempotent)
+    
+    if game_type != 'roulette':
+        return failure(400, 'Неизвестная игра')
+    
+    # Число раундов проверяется до того, как собирается список ставок: rounds = 10**9 не должен занять память
+    try:
+        rounds = len(body['bets']) if 'bets' in body else int(body.get('rounds', 1))
+    except (TypeError, ValueError):
+        return failure(400, 'Некорректная ставка')
+    
+    if not 1 <= rounds <= MAX_BATCH_ROUNDS:
+        return failure(400, f'Количество раундов: от 1 до {MAX_BATCH_ROUNDS}')
+    
+    try:
+        if 'bets' in body:
+            bets = [to_money(b) for b in body['bets']]
+        else:
+            bets = [to_money(body.get('bet_amount', 0))] * rounds
+    except (TypeError, ValueError):
+        return failure(400, 'Некорректная ставка')
+    
+    if min(bets) <= 0:
+        return failure(400, 'Некорректная ставка')
     
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    reply = claim(cur, idempotent)
+    if reply is None:
+        reply = play_roulette(cur, user_id, bets, batch)
+        save(cur, idempotent, reply)
+    conn.commit()
+    cur.close()
+    release_db_connection(conn)
+    remember(idempotent, reply)
+    return reply
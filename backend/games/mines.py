@@ -0,0 +1,219 @@
+'''
+Business: Сессии игры в мины: поле живет в кэше процесса, в БД пишется только старт и расчет
+Args: курсор, id игрока, id сессии, ставка и количество мин
+Returns: сессии с битовыми масками мин и открытых клеток, результаты расчета
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, List, Optional, Tuple
+
+from multipliers import GRID_SIZE, mines_payout, multiplier_for
+from fair import mines_mask, reserve
+from settlement import GAME_CURRENCY, SETTLED, NO_USER, INSUFFICIENT_FUNDS
+from balances import write_through
+
+SESSION_TTL = float(os.environ.get('MINES_SESSION_TTL', '900'))
+MAX_CACHED_SESSIONS = int(os.environ.get('MINES_MAX_CACHED_SESSIONS', '10000'))
+
+
+def cells_of(mask: int) -> List[int]:
+    return [i for i in range(GRID_SIZE) if mask >> i & 1]
+
+
+class MinesSession:
+    __slots__ = ('id', 'user_id', 'bet', 'mines_count', 'mines', 'revealed', 'expires_at')
+
+    def __init__(self, session_id: int, user_id: int, bet: Any, mines_count: int, mines: int, revealed: int = 0):
+        self.id = session_id
+        self.user_id = user_id
+        self.bet = bet
+        self.mines_count = mines_count
+        self.mines = mines
+        self.revealed = revealed
+        self.expires_at = 0.0
+
+    @property
+    def opened_cells(self) -> int:
+        return self.revealed.bit_count()
+
+    @property
+    def cleared(self) -> bool:
+        return self.opened_cells == GRID_SIZE - self.mines_count
+
+    @property
+    def multiplier(self) -> Decimal:
+        return multiplier_for(self.mines_count, self.opened_cells)
+
+    @property
+    def payout(self) -> Decimal:
+        return mines_payout(self.bet, self.mines_count, self.opened_cells)
+
+    def reveal(self, cell: int) -> bool:
+        '''Открывает клетку, возвращает True при попадании на мину'''
+        bit = 1 << cell
+        if self.mines & bit:
+            return True
+        self.revealed |= bit
+        return False
+
+
+class SessionCache:
+    '''LRU по последнему обращению: в начале словаря всегда сессия, которая истечет первой'''
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: 'OrderedDict[int, MinesSession]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: int) -> Optional[MinesSession]:
+        now = time.monotonic()
+        with self._lock:
+            session = self._items.get(session_id)
+            if session is None:
+                return None
+            if session.expires_at <= now:
+                del self._items[session_id]
+                return None
+            session.expires_at = now + self.ttl
+            self._items.move_to_end(session_id)
+            return session
+
+    def put(self, session: MinesSession) -> None:
+        now = time.monotonic()
+        with self._lock:
+            session.expires_at = now + self.ttl
+            self._items[session.id] = session
+            self._items.move_to_end(session.id)
+            while self._items:
+                oldest = next(iter(self._items.values()))
+                if len(self._items) <= self.max_size and oldest.expires_at > now:
+                    break
+                self._items.popitem(last=False)
+
+    def discard(self, session_id: int) -> None:
+        with self._lock:
+            self._items.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+sessions = SessionCache(SESSION_TTL, MAX_CACHED_SESSIONS)
+
+START_SQL = """
+    WITH debit AS (
+        UPDATE balances
+        SET amount = amount - %(bet)s
+        WHERE user_id = %(user_id)s AND currency = %(currency)s AND amount >= %(bet)s
+        RETURNING user_id, amount
+    ), session AS (
+        INSERT INTO mines_sessions (user_id, bet_amount, mines_count, mines_mask, seed_id, nonce)
+        SELECT user_id, %(bet)s, %(mines_count)s, %(mines)s, %(seed_id)s, %(nonce)s FROM debit
+        RETURNING id, bet_amount
+    ), entry AS (
+        INSERT INTO ledger (user_id, currency, delta, balance_after, kind, reference_id)
+        SELECT debit.user_id, %(currency)s, -%(bet)s, debit.amount, 'mines_bet', session.id
+        FROM debit, session
+        RETURNING id
+    )
+    SELECT
+        EXISTS (SELECT 1 FROM users WHERE id = %(user_id)s) AS user_exists,
+        (SELECT amount FROM debit) AS balance,
+        (SELECT id FROM session) AS session_id,
+        (SELECT bet_amount FROM session) AS bet_amount,
+        (SELECT id FROM entry) AS ledger_id
+"""
+
+SETTLE_SQL = """
+    WITH session AS (
+        UPDATE mines_sessions
+        SET status = %(status)s, revealed_mask = %(revealed)s, win_amount = %(win)s, settled_at = CURRENT_TIMESTAMP
+        WHERE id = %(session_id)s AND status = 'active'
+        RETURNING id, user_id, bet_amount, mines_count, mines_mask, seed_id, nonce
+    ), credit AS (
+        UPDATE balances
+        SET amount = balances.amount + %(win)s
+        FROM session
+        WHERE balances.user_id = session.user_id AND balances.currency = %(currency)s
+        RETURNING balances.user_id, balances.amount
+    ), entry AS (
+        INSERT INTO ledger (user_id, currency, delta, balance_after, kind, reference_id)
+        SELECT credit.user_id, %(currency)s, %(win)s, credit.amount, 'mines_win', %(session_id)s
+        FROM credit
+        WHERE %(win)s > 0
+        RETURNING id
+    ), history AS (
+        INSERT INTO game_history (user_id, game_type, bet_amount, result, win_amount, details)
+        SELECT session.user_id, 'mines', bet_amount, %(result)s, %(win)s,
+            jsonb_build_object('session_id', session.id, 'mines_count', mines_count, 'mines_mask', mines_mask, 'revealed_mask', %(revealed)s,
+                'seed_id', seed_id, 'server_seed_hash', f.server_seed_hash, 'client_seed', f.client_seed, 'nonce', session.nonce)
+        FROM session
+        LEFT JOIN fair_seeds f ON f.id = session.seed_id
+        RETURNING id
+    )
+    SELECT (SELECT amount FROM credit) AS balance, (SELECT count(*) FROM history) AS settled, (SELECT id FROM entry) AS ledger_id
+"""
+
+
+def start_session(cur, user_id: Any, bet: Any, mines_count: int) -> Tuple[str, Any, Optional[MinesSession]]:
+    seed = reserve(cur, user_id, 1)
+    if seed is None:
+        return NO_USER, None, None
+    mines = mines_mask(seed.server_seed, seed.client_seed, seed.first_nonce, mines_count)
+    cur.execute(START_SQL, {
+        'user_id': user_id,
+        'currency': GAME_CURRENCY,
+        'bet': bet,
+        'mines_count': mines_count,
+        'mines': mines,
+        'seed_id': seed.id,
+        'nonce': seed.first_nonce,
+    })
+    row = cur.fetchone()
+    if not row['user_exists']:
+        return NO_USER, None, None
+    if row['session_id'] is None:
+        return INSUFFICIENT_FUNDS, None, None
+    write_through(user_id, GAME_CURRENCY, row['balance'], row['ledger_id'])
+    session = MinesSession(row['session_id'], int(user_id), Decimal(row['bet_amount']), mines_count, mines)
+    sessions.put(session)
+    return SETTLED, row['balance'], session
+
+
+def load_session(cur, session_id: int, user_id: Any) -> Optional[MinesSession]:
+    '''Восстанавливает активную сессию из БД, если она не найдена в кэше этого экземпляра функции'''
+    cur.execute(
+        "SELECT id, user_id, bet_amount, mines_count, mines_mask FROM mines_sessions WHERE id = %s AND user_id = %s AND status = 'active'",
+        (session_id, user_id)
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    session = MinesSession(row['id'], row['user_id'], Decimal(row['bet_amount']), row['mines_count'], row['mines_mask'])
+    sessions.put(session)
+    return session
+
+
+def settle_session(cur, session: MinesSession, won: bool) -> Tuple[bool, Any, Any]:
+    '''
+    Условие status = 'active' делает расчет однократным: повторный cashout,
+    в том числе с другого экземпляра функции, ничего не зачислит.
+    '''
+    win = session.payout if won else Decimal(0)
+    cur.execute(SETTLE_SQL, {
+        'session_id': session.id,
+        'status': 'won' if won else 'lost',
+        'result': 'win' if won else 'loss',
+        'revealed': session.revealed,
+        'win': win,
+        'currency': GAME_CURRENCY,
+    })
+    row = cur.fetchone()
+    sessions.discard(session.id)
+    write_through(session.user_id, GAME_CURRENCY, row['balance'], row['ledger_id'])
+    return bool(row['settled']), row['balance'], win
@@ -0,0 +1,92 @@
+'''
+Business: Выплаты игр: таблица честных множителей мин по комбинаторике поля 5x5 с учетом маржи казино и выигрыш рулетки
+Args: MINES_HOUSE_EDGE из окружения (доля, по умолчанию 0.03)
+Returns: точные множители Decimal для любой пары (mines_count, opened_cells), выплаты по ставке и проверку RTP
+'''
+
+import os
+from array import array
+from decimal import Decimal, ROUND_DOWN
+from fractions import Fraction
+from math import comb
+from typing import Dict
+
+GRID_SIZE = 25
+HOUSE_EDGE = Fraction(os.environ.get('MINES_HOUSE_EDGE', '0.03'))
+MULTIPLIER_PLACES = 4
+CENT = Decimal('0.01')
+
+ROULETTE_WIN_PROBABILITY = Fraction(1, 2)
+ROULETTE_MULTIPLIER = Decimal(2)
+
+_SCALE = 10 ** MULTIPLIER_PLACES
+_ROW = GRID_SIZE + 1
+
+
+def survival_probability(mines_count: int, opened_cells: int) -> Fraction:
+    '''Вероятность открыть opened_cells клеток подряд и ни разу не попасть на мину'''
+    return Fraction(comb(GRID_SIZE - mines_count, opened_cells), comb(GRID_SIZE, opened_cells))
+
+
+def _build_table(house_edge: Fraction) -> array:
+    '''
+    Плоский массив: индекс mines_count * 26 + opened_cells, значение — множитель в единицах 10^-4.
+    Множитель округляется вниз, чтобы округление никогда не работало против казино.
+    Для opened_cells = 0 множитель равен 1: ставка возвращается, игры не было.
+    '''
+    table = array('q', [0]) * (_ROW * GRID_SIZE)
+    for mines_count in range(1, GRID_SIZE):
+        table[mines_count * _ROW] = _SCALE
+        for opened_cells in range(1, GRID_SIZE - mines_count + 1):
+            fair = (1 - house_edge) / survival_probability(mines_count, opened_cells)
+            table[mines_count * _ROW + opened_cells] = fair * _SCALE // 1
+    return table
+
+
+MULTIPLIERS = _build_table(HOUSE_EDGE)
+_DECIMAL_MULTIPLIERS = tuple(Decimal(units).scaleb(-MULTIPLIER_PLACES) if units else None for units in MULTIPLIERS)
+
+
+def multiplier_for(mines_count: int, opened_cells: int) -> Decimal:
+    multiplier = None
+    if 0 < mines_count < GRID_SIZE and 0 <= opened_cells < _ROW:
+        multiplier = _DECIMAL_MULTIPLIERS[mines_count * _ROW + opened_cells]
+    if multiplier is None:
+        raise ValueError(f'Нет множителя для mines_count={mines_count}, opened_cells={opened_cells}')
+    return multiplier
+
+
+def mines_payout(bet: Decimal, mines_count: int, opened_cells: int) -> Decimal:
+    '''Выплата при кэшауте: копейки сверх множителя отбрасываются вниз'''
+    return (bet * multiplier_for(mines_count, opened_cells)).quantize(CENT, rounding=ROUND_DOWN)
+
+
+def roulette_payout(bet: Decimal, won: bool) -> Decimal:
+    return bet * ROULETTE_MULTIPLIER if won else Decimal(0)
+
+
+def validate_rtp(table: array = MULTIPLIERS, house_edge: Fraction = HOUSE_EDGE) -> Dict[str, object]:
+    '''
+    RTP каждой клетки таблицы = вероятность дожить * множитель.
+    Он не может превышать 1 - маржа и может отставать от нее только на шаг округления множителя.
+    '''
+    target = 1 - house_edge
+    worst_low = worst_high = None
+    violations = []
+    for mines_count in range(1, GRID_SIZE):
+        for opened_cells in range(1, GRID_SIZE - mines_count + 1):
+            probability = survival_probability(mines_count, opened_cells)
+            rtp = probability * Fraction(table[mines_count * _ROW + opened_cells], _SCALE)
+            if worst_low is None or rtp < worst_low:
+                worst_low = rtp
+            if worst_high is None or rtp > worst_high:
+                worst_high = rtp
+            if rtp > target or target - rtp > probability / _SCALE:
+                violations.append((mines_count, opened_cells, float(rtp)))
+    return {
+        'target_rtp': float(target),
+        'min_rtp': float(worst_low),
+        'max_rtp': float(worst_high),
+        'entries': sum(GRID_SIZE - m for m in range(1, GRID_SIZE)),
+        'violations': violations,
+    }
@@ -0,0 +1,79 @@
+'''
+Business: Расчет ставок одним SQL-запросом: проверка баланса, списание/зачисление и запись в историю
+Args: курсор, id игрока, ставки и их исходы (одна ставка или пачка раундов)
+Returns: статус расчета и новый баланс
+'''
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from balances import write_through
+
+SETTLED = 'settled'
+NO_USER = 'no_user'
+INSUFFICIENT_FUNDS = 'insufficient_funds'
+
+MAX_BATCH_ROUNDS = 1000
+GAME_CURRENCY = 'RUB'
+
+SETTLE_SQL = """
+    WITH debit AS (
+        UPDATE balances
+        SET amount = amount - %(stake)s + %(payout)s
+        WHERE user_id = %(user_id)s AND currency = %(currency)s AND amount >= %(stake)s
+        RETURNING user_id, amount
+    ), history AS (
+        INSERT INTO game_history (user_id, game_type, bet_amount, result, win_amount, details)
+        SELECT debit.user_id, %(game_type)s, r.bet, r.result, r.win, r.details
+        FROM debit, unnest(%(bets)s::numeric[], %(results)s::varchar[], %(wins)s::numeric[], %(details)s::jsonb[])
+            AS r(bet, result, win, details)
+        RETURNING id
+    ), entry AS (
+        INSERT INTO ledger (user_id, currency, delta, balance_after, kind, reference_id)
+        SELECT user_id, %(currency)s, %(payout)s - %(stake)s, amount, 'game', (SELECT min(id) FROM history)
+        FROM debit
+        RETURNING id
+    )
+    SELECT
+        EXISTS (SELECT 1 FROM users WHERE id = %(user_id)s) AS user_exists,
+        (SELECT amount FROM debit) AS balance,
+        (SELECT count(*) FROM history) AS rounds,
+        (SELECT id FROM entry) AS ledger_id
+"""
+
+
+def settle_rounds(
+    cur,
+    user_id: Any,
+    game_type: str,
+    rounds: List[Tuple[Any, Any, str, Optional[Dict[str, Any]]]],
+) -> Tuple[str, Any]:
+    '''
+    rounds — список (ставка, выигрыш, результат, details).
+    Баланс меняется один раз на сумму выигрышей минус сумму ставок, строки истории пишутся одним INSERT,
+    в журнал ledger — одна строка на весь расчет со ссылкой на первую строку истории.
+    Условный UPDATE не даст уйти в минус при параллельных ставках:
+    строка баланса блокируется, и условие amount >= stake перепроверяется после ожидания блокировки.
+    Коммит остается за вызывающим кодом.
+    '''
+    bets = [r[0] for r in rounds]
+    wins = [r[1] for r in rounds]
+    cur.execute(SETTLE_SQL, {
+        'user_id': user_id,
+        'currency': GAME_CURRENCY,
+        'game_type': game_type,
+        'stake': sum(bets),
+        'payout': sum(wins),
+        'bets': bets,
+        'results': [r[2] for r in rounds],
+        'wins': wins,
+        'details': [json.dumps(r[3]) if r[3] is not None else None for r in rounds],
+    })
+    row = cur.fetchone()
+    if not row['user_exists']:
+        return NO_USER, None
+    if row['balance'] is None:
+        return INSUFFICIENT_FUNDS, None
+    write_through(user_id, GAME_CURRENCY, row['balance'], row['ledger_id'])
+    return SETTLED, row['balance']
+
@@ -0,0 +1,168 @@
+'''
+Business: Подписанные токены сессии: выдача при входе и проверка в каждой функции без запроса к БД
+Args: SESSION_SECRET, SESSION_TTL, SESSION_CACHE_SIZE, SESSION_REVOCATION_REFRESH, AUTH_ALLOW_USER_ID_HEADER из окружения
+Returns: токен с id пользователя, флагом персонала и сроком действия; проверенную сессию по заголовкам запроса
+'''
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from db import get_db_connection, release_db_connection
+
+SESSION_SECRET = os.environ.get('SESSION_SECRET', '').encode()
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '43200'))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '4096'))
+REVOCATION_REFRESH = float(os.environ.get('SESSION_REVOCATION_REFRESH', '30'))
+ALLOW_USER_ID_HEADER = os.environ.get('AUTH_ALLOW_USER_ID_HEADER', '1') == '1'
+
+TOKEN_VERSION = 'v1'
+
+
+class Session:
+    __slots__ = ('user_id', 'is_staff', 'expires_at', 'jti')
+
+    def __init__(self, user_id: int, is_staff: Optional[bool], expires_at: int, jti: Optional[str]):
+        self.user_id = user_id
+        self.is_staff = is_staff
+        self.expires_at = expires_at
+        self.jti = jti
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64(hmac.new(SESSION_SECRET, payload.encode(), hashlib.sha256).digest())
+
+
+def tokens_enabled() -> bool:
+    return bool(SESSION_SECRET)
+
+
+def issue_token(user_id: int, is_staff: bool) -> Tuple[str, int]:
+    '''Токен вида v1.<payload>.<hmac>, payload = "user_id:is_staff:expires_at:jti" в base64url'''
+    if not SESSION_SECRET:
+        raise RuntimeError('SESSION_SECRET не задан')
+    expires_at = int(time.time()) + SESSION_TTL
+    payload = _b64(f'{user_id}:{int(bool(is_staff))}:{expires_at}:{secrets.token_hex(8)}'.encode())
+    return f'{TOKEN_VERSION}.{payload}.{_sign(payload)}', expires_at
+
+
+def _decode(token: str) -> Optional[Session]:
+    version, _, rest = token.partition('.')
+    payload, _, signature = rest.partition('.')
+    if version != TOKEN_VERSION or not payload or not signature:
+        return None
+    # Байты, а не str: compare_digest на строках с не-ASCII символами бросает TypeError
+    if not hmac.compare_digest(signature.encode(), _sign(payload).encode()):
+        return None
+    try:
+        user_id, is_staff, expires_at, jti = _unb64(payload).decode().split(':')
+        return Session(int(user_id), is_staff == '1', int(expires_at), jti)
+    except ValueError:
+        return None
+
+
+class VerifiedTokens:
+    '''
+    LRU уже проверенных токенов: повторный запрос с тем же токеном не пересчитывает HMAC.
+    Список отозванных jti перечитывается из БД не чаще раза в REVOCATION_REFRESH секунд.
+    '''
+
+    def __init__(self, max_size: int, refresh_every: float):
+        self.max_size = max_size
+        self.refresh_every = refresh_every
+        self._items: 'OrderedDict[str, Session]' = OrderedDict()
+        self._revoked: Set[str] = set()
+        self._revoked_loaded_at = float('-inf')
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'rejected': 0, 'refreshes': 0}
+
+    def _refresh_revoked(self) -> None:
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT jti FROM revoked_tokens WHERE expires_at > CURRENT_TIMESTAMP")
+            revoked = {row[0] for row in cur.fetchall()}
+            conn.commit()
+            cur.close()
+        finally:
+            release_db_connection(conn)
+        with self._lock:
+            self._revoked = revoked
+            self._revoked_loaded_at = time.monotonic()
+            self.stats['refreshes'] += 1
+
+    def verify(self, token: str) -> Optional[Session]:
+        if not SESSION_SECRET:
+            return None
+
+        now = time.time()
+        with self._lock:
+            session = self._items.get(token)
+            if session is not None:
+                self._items.move_to_end(token)
+                self.stats['hits'] += 1
+        if session is None:
+            session = _decode(token)
+            with self._lock:
+                self.stats['misses'] += 1
+                if session is not None:
+                    self._items[token] = session
+                    if len(self._items) > self.max_size:
+                        self._items.popitem(last=False)
+
+        if session is not None and session.expires_at > now:
+            # Список отзыва — только для подписанного и живого токена: поддельный не открывает соединение с БД
+            if time.monotonic() - self._revoked_loaded_at >= self.refresh_every:
+                self._refresh_revoked()
+            if session.jti not in self._revoked:
+                return session
+
+        with self._lock:
+            self.stats['rejected'] += 1
+        return None
+
+    def revoke(self, cur: Any, session: Session) -> None:
+        '''Запись в revoked_tokens; в этом процессе токен перестает работать сразу, в остальных — после обновления списка'''
+        cur.execute(
+            "INSERT INTO revoked_tokens (jti, expires_at) VALUES (%s, to_timestamp(%s)::timestamp) ON CONFLICT (jti) DO NOTHING",
+            (session.jti, session.expires_at)
+        )
+        with self._lock:
+            self._revoked.add(session.jti)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+verified_tokens = VerifiedTokens(SESSION_CACHE_SIZE, REVOCATION_REFRESH)
+
+
+def authenticate(headers: Dict[str, Any]) -> Optional[Session]:
+    '''
+    Сначала X-Auth-Token. Пока фронтенд переходит на токены, принимается и старый X-User-Id
+    (AUTH_ALLOW_USER_ID_HEADER=1): у такой сессии is_staff = None, в панель персонала она не пускает.
+    '''
+    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+    if token:
+        return verified_tokens.verify(token)
+    if not ALLOW_USER_ID_HEADER:
+        return None
+    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+    try:
+        return Session(int(user_id), None, 0, None) if user_id else None
+    except ValueError:
+        return None
@@ -0,0 +1,176 @@
+'''
+Business: Обслуживание истории игр: дневные секции game_history наперед, отсоединение старых и дневные сводки
+Args: курсор БД, дата «сегодня», HISTORY_PARTITION_DAYS_AHEAD, HISTORY_RETENTION_DAYS, HISTORY_ROLLUP_LAG из окружения
+Returns: созданные и отсоединенные секции, число новых строк истории, попавших в сводки
+'''
+
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import List, Tuple
+
+PARTITION_DAYS_AHEAD = int(os.environ.get('HISTORY_PARTITION_DAYS_AHEAD', '14'))
+RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', '90'))
+ROLLUP_LAG = float(os.environ.get('HISTORY_ROLLUP_LAG', '60'))
+DETACH_LOCK_TIMEOUT = '2s'
+
+PARTITION_PREFIX = 'game_history_p'
+UPPER_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+PARTITIONS_SQL = """
+    SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'game_history'::regclass
+    ORDER BY c.relname
+"""
+
+ROLLUP_SQL = """
+    WITH prev AS (
+        SELECT COALESCE(max(upto_id), 0) AS upto,
+            COALESCE(max(cutoff) - make_interval(secs => %(lag)s), '-infinity'::timestamp) AS since
+        FROM game_stats_runs
+    ), cutoff AS (
+        SELECT (CURRENT_TIMESTAMP - make_interval(secs => %(lag)s))::timestamp AS at
+    ), horizon AS (
+        SELECT COALESCE(max(id), (SELECT upto FROM prev)) AS upto
+        FROM game_history
+        WHERE id > (SELECT upto FROM prev)
+          AND created_at >= (SELECT since FROM prev)
+          AND created_at < (SELECT at FROM cutoff)
+    ), fresh AS (
+        SELECT created_at::date AS day, user_id, game_type,
+            count(*) AS rounds,
+            count(*) FILTER (WHERE result = 'win') AS wins,
+            sum(bet_amount) AS total_bet,
+            sum(win_amount) AS total_win
+        FROM game_history
+        WHERE id > (SELECT upto FROM prev)
+          AND id <= (SELECT upto FROM horizon)
+          AND created_at >= (SELECT since FROM prev)
+        GROUP BY 1, 2, 3
+    ), per_user AS (
+        INSERT INTO game_stats_user_daily AS s (day, user_id, game_type, rounds, wins, total_bet, total_win)
+        SELECT day, user_id, game_type, rounds, wins, total_bet, total_win FROM fresh
+        ON CONFLICT (day, user_id, game_type) DO UPDATE SET
+            rounds = s.rounds + EXCLUDED.rounds,
+            wins = s.wins + EXCLUDED.wins,
+            total_bet = s.total_bet + EXCLUDED.total_bet,
+            total_win = s.total_win + EXCLUDED.total_win
+        RETURNING day, game_type, (xmax = 0) AS first_round
+    ), new_players AS (
+        SELECT day, game_type, count(*) FILTER (WHERE first_round) AS players
+        FROM per_user
+        GROUP BY day, game_type
+    ), per_game AS (
+        INSERT INTO game_stats_daily AS s (day, game_type, players, rounds, wins, total_bet, total_win)
+        SELECT f.day, f.game_type, COALESCE(max(p.players), 0), sum(f.rounds), sum(f.wins), sum(f.total_bet), sum(f.total_win)
+        FROM fresh f
+        LEFT JOIN new_players p ON p.day = f.day AND p.game_type = f.game_type
+        GROUP BY f.day, f.game_type
+        ON CONFLICT (day, game_type) DO UPDATE SET
+            players = s.players + EXCLUDED.players,
+            rounds = s.rounds + EXCLUDED.rounds,
+            wins = s.wins + EXCLUDED.wins,
+            total_bet = s.total_bet + EXCLUDED.total_bet,
+            total_win = s.total_win + EXCLUDED.total_win
+    ), totals AS (
+        INSERT INTO game_totals AS s (game_type, rounds, wins, total_bet, total_win)
+        SELECT game_type, sum(rounds), sum(wins), sum(total_bet), sum(total_win)
+        FROM fresh
+        GROUP BY game_type
+        ON CONFLICT (game_type) DO UPDATE SET
+            rounds = s.rounds + EXCLUDED.rounds,
+            wins = s.wins + EXCLUDED.wins,
+            total_bet = s.total_bet + EXCLUDED.total_bet,
+            total_win = s.total_win + EXCLUDED.total_win
+    ), run AS (
+        INSERT INTO game_stats_runs (upto_id, cutoff, rounds)
+        SELECT upto, (SELECT at FROM cutoff), (SELECT COALESCE(sum(rounds), 0) FROM fresh) FROM horizon
+        WHERE upto > (SELECT upto FROM prev)
+    )
+    SELECT (SELECT upto FROM horizon) AS upto_id, (SELECT COALESCE(sum(rounds), 0) FROM fresh) AS rounds
+"""
+
+
+def db_today(cur) -> date:
+    '''Дата по часам базы: по ним же проставляется created_at и режутся секции'''
+    cur.execute("SELECT CURRENT_DATE AS today")
+    return cur.fetchone()['today']
+
+
+def partition_name(day: date) -> str:
+    return f'{PARTITION_PREFIX}{day:%Y%m%d}'
+
+
+def list_partitions(cur) -> List[Tuple[str, str]]:
+    cur.execute(PARTITIONS_SQL)
+    return [(row['name'], row['bound']) for row in cur.fetchall()]
+
+
+def ensure_partitions(cur, today: date, days_ahead: int = PARTITION_DAYS_AHEAD) -> List[str]:
+    '''
+    Создает недостающие дневные секции с today по today + days_ahead.
+    Строки, успевшие упасть в секцию по умолчанию за эти дни, переносятся в новую секцию до ATTACH,
+    иначе Postgres не даст ее присоединить. ATTACH не блокирует вставки в game_history.
+    '''
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('game_history_partitions'))")
+    existing = {name for name, _ in list_partitions(cur)}
+    created = []
+
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        name = partition_name(day)
+        if name in existing:
+            continue
+
+        bounds = {'start': day, 'end': day + timedelta(days=1)}
+        cur.execute(f"CREATE TABLE {name} (LIKE game_history INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cur.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM game_history_default
+                WHERE created_at >= %(start)s AND created_at < %(end)s
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+            """,
+            bounds
+        )
+        cur.execute(f"ALTER TABLE game_history ATTACH PARTITION {name} FOR VALUES FROM (%(start)s) TO (%(end)s)", bounds)
+        created.append(name)
+
+    return created
+
+
+def detach_old_partitions(cur, today: date, retention_days: int = RETENTION_DAYS) -> List[str]:
+    '''
+    Отсоединяет секции, целиком лежащие раньше today - retention_days (включая архивную).
+    Отсоединенная таблица остается в базе под тем же именем — выгрузить или удалить ее можно отдельно.
+    DETACH ждет эксклюзивную блокировку game_history не дольше DETACH_LOCK_TIMEOUT, а не стоит за долгими запросами.
+    '''
+    cutoff = datetime.combine(today - timedelta(days=retention_days), datetime.min.time())
+    detached = []
+
+    for name, bound in list_partitions(cur):
+        match = UPPER_BOUND_RE.search(bound)
+        if not match or datetime.fromisoformat(match.group(1)) > cutoff:
+            continue
+
+        cur.execute(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'")
+        cur.execute(f"ALTER TABLE game_history DETACH PARTITION {name}")
+        detached.append(name)
+
+    return detached
+
+
+def refresh_rollups(cur) -> Tuple[int, int]:
+    '''
+    Добавляет в game_stats_user_daily, game_stats_daily и итоги game_totals строки истории после прошлого прогона.
+    Как и снимки журнала, не берет строки моложе ROLLUP_LAG секунд; чтение сужено по created_at,
+    так что затрагиваются только свежие секции. Коммит остается за вызывающим кодом.
+    '''
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('game_stats_rollup'))")
+    cur.execute(ROLLUP_SQL, {'lag': ROLLUP_LAG})
+    row = cur.fetchone()
+    return row['upto_id'], row['rounds']
@@ -1,224 +1,298 @@
 '''
 Business: Панель персонала для управления заявками и балансами
-Args: event с httpMethod, headers (X-User-Id), body (action, request_id, user_id, amount)
-Returns: HTTP response с заявками или результатом операции
+Args: event с httpMethod, headers (X-Auth-Token персонала), queryStringParameters (limit, cursor, currency, type, mode=count или mode=stats), body (action, request_id, decision, decisions, user_id, amount, rate)
+Returns: HTTP response с заявками, сводкой для панели или результатом операции
 '''
 
-import json
-import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
-
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+from typing import Dict, Any, Optional
+from decimal import Decimal, InvalidOperation
+
+from db import get_db_connection, release_db_connection, dict_cursor
+from money import to_money
+from router import Router, Request, response, error, failure
+from pending import count_pending, count_query, fetch_pending_page, page_query
+from ledger import reconcile, take_snapshots
+from history import db_today, detach_old_partitions, ensure_partitions, refresh_rollups
+from balances import commit_writes, write_through
+from stats import dashboard_stats, refresh_stale_totals
+from processing import DECISIONS, INSUFFICIENT_FUNDS, MAX_BATCH_REQUESTS, SKIPPED, process_requests
+
+RATE_PLACES = Decimal('0.000001')
+MAX_RATE = Decimal('1000000000000')
+
+MANAGE_BALANCE_SQL = """
+    WITH currency AS (
+        SELECT code, symbol FROM currencies WHERE code = %(currency)s
+    ), changed AS ({change_sql}), entry AS (
+        INSERT INTO ledger (user_id, currency, delta, balance_after, kind, reference_id)
+        SELECT %(user_id)s, (SELECT code FROM currency), %(delta)s, amount, 'adjustment', %(staff_id)s FROM changed
+        RETURNING id
+    )
+    SELECT (SELECT amount FROM changed) AS balance, (SELECT symbol FROM currency) AS symbol, (SELECT id FROM entry) AS ledger_id
+"""
+
+CREDIT_SQL = """
+    INSERT INTO balances (user_id, currency, amount)
+    SELECT %(user_id)s, code, %(amount)s FROM currency
+    ON CONFLICT (user_id, currency) DO UPDATE SET amount = balances.amount + EXCLUDED.amount
+    RETURNING amount
+"""
+
+DEBIT_SQL = """
+    UPDATE balances SET amount = amount - %(amount)s
+    WHERE user_id = %(user_id)s AND currency = (SELECT code FROM currency) AND amount >= %(amount)s
+    RETURNING amount
+"""
+
+
+def staff_only(request: Request) -> Optional[Dict[str, Any]]:
+    '''
+    Права персонала — только из подписанного токена (staff_login или вход сотрудника).
+    Сессия по X-User-Id не проверена ничем, кроме заголовка, поэтому в панель ее не пускаем, в том числе служебный id 0.
+    '''
+    if request.session.is_staff is not True:
+        return error(403, 'Доступ запрещен')
+    return None
+
+
+router = Router(guard=staff_only)
+handler = router.handler
+
+
+def staff_id(request: Request) -> Optional[int]:
+    return request.user_id or None
+
+
+@router.route('GET', None, 'count')
+def pending(request: Request) -> Dict[str, Any]:
+    # Параметры разбираются до соединения: отказ валидации не загружает драйвер и не берет соединение из пула
+    try:
+        query = count_query(request.params) if request.action == 'count' else page_query(request.params)
+    except ValueError as e:
+        return error(400, str(e))
     
-    headers = event.get('headers', {})
-    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
     
-    if not user_id:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Не авторизован'})
-        }
+    if request.action == 'count':
+        payload = {'count': count_pending(cur, query)}
+    else:
+        requests, next_cursor = fetch_pending_page(cur, query)
+        payload = {'items': [dict(r) for r in requests], 'next_cursor': next_cursor}
+    
+    cur.close()
+    release_db_connection(conn)
+    
+    return response(200, payload)
+
+
+@router.route('GET', 'stats')
+def stats(request: Request) -> Dict[str, Any]:
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    if refresh_stale_totals(cur):
+        conn.commit()
+    payload = dashboard_stats(cur)
+    cur.close()
+    release_db_connection(conn)
+    
+    return response(200, payload)
+
+
+@router.route('POST', 'process_request')
+def process_request(request: Request) -> Dict[str, Any]:
+    request_id = request.body.get('request_id')
+    decision = request.body.get('decision')
+    
+    if decision not in DECISIONS or not isinstance(request_id, int):
+        return failure(400, 'Некорректное решение по заявке')
+    
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    result = process_requests(cur, {request_id: decision}, staff_id(request))[request_id]
+    conn.commit()
+    commit_writes()
+    cur.close()
+    release_db_connection(conn)
+    
+    if result == SKIPPED:
+        return error(404, 'Заявка не найдена или уже обработана')
+    
+    if result == INSUFFICIENT_FUNDS:
+        return failure(400, 'Недостаточно средств для вывода')
+    
+    return response(200, {
+        'success': True,
+        'message': f'Заявка {"одобрена" if result == "approved" else "отклонена"}'
+    })
+
+
+@router.route('POST', 'process_requests')
+def process_batch(request: Request) -> Dict[str, Any]:
+    items = request.body.get('decisions')
+    
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_REQUESTS:
+        return failure(400, f'Передайте от 1 до {MAX_BATCH_REQUESTS} заявок')
+    
+    decisions = {}
+    for item in items:
+        request_id = item.get('request_id') if isinstance(item, dict) else None
+        if not isinstance(request_id, int) or request_id in decisions:
+            return failure(400, 'Некорректный или повторяющийся request_id')
+        decisions[request_id] = item.get('decision')
+    
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    results = process_requests(cur, decisions, staff_id(request))
+    conn.commit()
+    commit_writes()
+    cur.close()
+    release_db_connection(conn)
+    
+    summary = {}
+    for result in results.values():
+        summary[result] = summary.get(result, 0) + 1
+    
+    return response(200, {
+        'success': True,
+        'results': [{'request_id': request_id, 'result': results[request_id]} for request_id in decisions],
+        'summary': summary
+    })
+
+
+@router.route('POST', 'ledger_snapshot')
+def ledger_snapshot(request: Request) -> Dict[str, Any]:
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    upto_ledger_id, snapshots = take_snapshots(cur)
+    conn.commit()
+    cur.close()
+    release_db_connection(conn)
+    
+    return response(200, {'success': True, 'upto_ledger_id': upto_ledger_id, 'snapshots': snapshots})
+
+
+@router.route('POST', 'maintain_history')
+def maintain_history(request: Request) -> Dict[str, Any]:
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    upto_id, rounds = refresh_rollups(cur)
+    conn.commit()
+    today = db_today(cur)
+    created = ensure_partitions(cur, today)
+    conn.commit()
+    detached = detach_old_partitions(cur, today)
+    conn.commit()
+    cur.close()
+    release_db_connection(conn)
+    
+    return response(200, {
+        'success': True,
+        'rollup': {'upto_id': upto_id, 'rounds': rounds},
+        'created_partitions': created,
+        'detached_partitions': detached
+    })
+
+
+@router.route('POST', 'reconcile')
+def reconcile_ledger(request: Request) -> Dict[str, Any]:
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    mismatches = reconcile(cur)
+    cur.close()
+    release_db_connection(conn)
+    
+    return response(200, {'success': True, 'consistent': not mismatches, 'mismatches': mismatches})
+
+
+@router.route('POST', 'set_rate')
+def set_rate(request: Request) -> Dict[str, Any]:
+    try:
+        rate = Decimal(str(request.body.get('rate', '')))
+    except InvalidOperation:
+        rate = Decimal(0)
+    
+    if not rate.is_finite() or rate <= 0 or rate >= MAX_RATE:
+        return failure(400, 'Некорректный курс')
     
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    if int(user_id) != 0:
-        cur.execute("SELECT is_staff FROM users WHERE id = %s", (user_id,))
-        staff_check = cur.fetchone()
-        
-        if not staff_check or not staff_check['is_staff']:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Доступ запрещен'})
-            }
-    
-    if method == 'GET':
-        cur.execute("""
-            SELECT r.*, u.full_name 
-            FROM requests r 
-            JOIN users u ON r.user_id = u.id 
-            WHERE r.status = 'pending' 
-            ORDER BY r.created_at DESC
-        """)
-        requests = cur.fetchall()
+    cur = dict_cursor(conn)
+    cur.execute(
+        "INSERT INTO exchange_rates (base_currency, quote_currency, rate, created_by) VALUES ('USD', 'RUB', %s, %s) RETURNING id, rate",
+        (rate.quantize(RATE_PLACES), staff_id(request))
+    )
+    new_rate = cur.fetchone()
+    conn.commit()
+    cur.close()
+    release_db_connection(conn)
+    
+    return response(200, {
+        'success': True,
+        'rate': new_rate['rate'],
+        'version': new_rate['id'],
+        'message': f'Курс 1 USD = {new_rate["rate"]} RUB сохранен, кошельки перейдут на него после обновления кэша курсов'
+    })
+
+
+@router.route('POST', 'manage_balance')
+def manage_balance(request: Request) -> Dict[str, Any]:
+    body = request.body
+    full_name = body.get('full_name', '').strip()
+    operation = body.get('operation')
+    currency = body.get('currency', 'RUB')
+    
+    try:
+        amount = to_money(body.get('amount', 0))
+    except ValueError:
+        amount = Decimal(0)
+    
+    if amount <= 0:
+        return failure(400, 'Некорректная сумма')
+    
+    if not full_name:
+        return failure(400, 'Укажите ФИО клиента')
+    
+    if operation not in ('add', 'subtract'):
+        return failure(400, 'Неизвестная операция')
+    
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    cur.execute("SELECT id, full_name FROM users WHERE LOWER(full_name) = LOWER(%s)", (full_name,))
+    user = cur.fetchone()
+    
+    if not user:
         cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps([dict(r) for r in requests], default=str)
+        release_db_connection(conn)
+        return failure(404, f'Клиент "{full_name}" не найден')
+    
+    cur.execute(
+        MANAGE_BALANCE_SQL.format(change_sql=CREDIT_SQL if operation == 'add' else DEBIT_SQL),
+        {
+            'user_id': user['id'],
+            'currency': currency,
+            'amount': amount,
+            'delta': amount if operation == 'add' else -amount,
+            'staff_id': staff_id(request),
         }
+    )
+    result = cur.fetchone()
+    if result['balance'] is not None:
+        write_through(user['id'], currency, result['balance'], result['ledger_id'])
+    conn.commit()
+    commit_writes()
+    cur.close()
+    release_db_connection(conn)
     
-    if method == 'POST':
-        body = json.loads(event.get('body', '{}'))
-        action = body.get('action')
-        
-        if action == 'process_request':
-            request_id = body.get('request_id')
-            decision = body.get('decision')
-            
-            cur.execute("SELECT * FROM requests WHERE id = %s", (request_id,))
-            request = cur.fetchone()
-            
-            if not request:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Заявка не найдена'})
-                }
-            
-            currency_field = 'balance_rub' if request['currency'] == 'RUB' else 'balance_usd'
-            
-            if decision == 'approved':
-                if request['type'] == 'withdraw':
-                    cur.execute(f"SELECT {currency_field} FROM users WHERE id = %s", (request['user_id'],))
-                    current_balance = cur.fetchone()
-                    if not current_balance or float(current_balance[currency_field]) < float(request['amount']):
-                        if int(user_id) == 0:
-                            cur.execute(
-                                "UPDATE requests SET status = 'rejected', processed_at = %s WHERE id = %s",
-                                (datetime.now(), request_id)
-                            )
-                        else:
-                            cur.execute(
-                                "UPDATE requests SET status = 'rejected', processed_by = %s, processed_at = %s WHERE id = %s",
-                                (user_id, datetime.now(), request_id)
-                            )
-                        conn.commit()
-                        cur.close()
-                        conn.close()
-                        return {
-                            'statusCode': 400,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({
-                                'success': False,
-                                'error': 'Недостаточно средств для вывода'
-                            })
-                        }
-                
-                if request['type'] == 'deposit':
-                    cur.execute(
-                        f"UPDATE users SET {currency_field} = {currency_field} + %s WHERE id = %s",
-                        (request['amount'], request['user_id'])
-                    )
-                elif request['type'] == 'withdraw':
-                    cur.execute(
-                        f"UPDATE users SET {currency_field} = {currency_field} - %s WHERE id = %s",
-                        (request['amount'], request['user_id'])
-                    )
-                conn.commit()
-            
-            if int(user_id) == 0:
-                cur.execute(
-                    "UPDATE requests SET status = %s, processed_at = %s WHERE id = %s",
-                    (decision, datetime.now(), request_id)
-                )
-            else:
-                cur.execute(
-                    "UPDATE requests SET status = %s, processed_by = %s, processed_at = %s WHERE id = %s",
-                    (decision, user_id, datetime.now(), request_id)
-                )
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'message': f'Заявка {"одобрена" if decision == "approved" else "отклонена"}'
-                })
-            }
-        
-        elif action == 'manage_balance':
-            full_name = body.get('full_name', '').strip()
-            amount = float(body.get('amount', 0))
-            operation = body.get('operation')
-            currency = body.get('currency', 'RUB')
-            
-            if not full_name:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': False, 'error': 'Укажите ФИО клиента'})
-                }
-            
-            cur.execute("SELECT id, full_name FROM users WHERE LOWER(full_name) = LOWER(%s)", (full_name,))
-            user = cur.fetchone()
-            
-            if not user:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': False, 'error': f'Клиент "{full_name}" не найден'})
-                }
-            
-            balance_field = 'balance_rub' if currency == 'RUB' else 'balance_usd'
-            
-            if operation == 'add':
-                cur.execute(
-                    f"UPDATE users SET {balance_field} = {balance_field} + %s WHERE id = %s RETURNING {balance_field}",
-                    (amount, user['id'])
-                )
-            elif operation == 'subtract':
-                cur.execute(
-                    f"UPDATE users SET {balance_field} = {balance_field} - %s WHERE id = %s RETURNING {balance_field}",
-                    (amount, user['id'])
-                )
-            
-            conn.commit()
-            new_balance = cur.fetchone()
-            cur.close()
-            conn.close()
-            
-            currency_symbol = '₽' if currency == 'RUB' else '$'
-            operation_text = 'зачислено' if operation == 'add' else 'списано'
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'balance': float(new_balance[balance_field]) if new_balance else 0,
-                    'message': f'{user["full_name"]}: {operation_text} {amount}{currency_symbol}'
-                })
-            }
+    if result['symbol'] is None:
+        return failure(400, 'Неизвестная валюта')
     
-    cur.close()
-    conn.close()
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+    if result['balance'] is None:
+        return failure(400, 'Недостаточно средств на балансе клиента')
+    
+    operation_text = 'зачислено' if operation == 'add' else 'списано'
+    
+    return response(200, {
+        'success': True,
+        'balance': result['balance'],
+        'message': f'{user["full_name"]}: {operation_text} {amount}{result["symbol"]}'
+    })
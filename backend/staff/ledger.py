@@ -0,0 +1,91 @@
+'''
+Business: Снимки балансов по журналу ledger и сверка журнала с таблицей balances
+Args: курсор БД, LEDGER_SNAPSHOT_LAG из окружения (секунды, по умолчанию 60)
+Returns: число новых снимков (заодно дописываются итоги ledger_totals) и расхождения баланса с суммой снимок + хвост журнала
+'''
+
+import os
+from typing import Any, Dict, List, Tuple
+
+SNAPSHOT_LAG = float(os.environ.get('LEDGER_SNAPSHOT_LAG', '60'))
+
+SNAPSHOT_SQL = """
+    WITH prev AS (
+        SELECT COALESCE(max(upto_ledger_id), 0) AS upto FROM ledger_snapshot_runs
+    ), horizon AS (
+        SELECT COALESCE(max(id), (SELECT upto FROM prev)) AS upto
+        FROM ledger
+        WHERE id > (SELECT upto FROM prev) AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %(lag)s)
+    ), tail AS (
+        SELECT user_id, currency, max(id) AS ledger_id, sum(delta) AS delta
+        FROM ledger
+        WHERE id > (SELECT upto FROM prev) AND id <= (SELECT upto FROM horizon)
+        GROUP BY user_id, currency
+    ), snapshots AS (
+        INSERT INTO balance_snapshots (user_id, currency, ledger_id, amount)
+        SELECT t.user_id, t.currency, t.ledger_id, t.delta + COALESCE((
+            SELECT s.amount FROM balance_snapshots s
+            WHERE s.user_id = t.user_id AND s.currency = t.currency
+            ORDER BY s.ledger_id DESC
+            LIMIT 1
+        ), 0)
+        FROM tail t
+        RETURNING 1
+    ), totals AS (
+        INSERT INTO ledger_totals AS t (currency, kind, entries, total_delta)
+        SELECT currency, kind, count(*), sum(delta)
+        FROM ledger
+        WHERE id > (SELECT upto FROM prev) AND id <= (SELECT upto FROM horizon)
+        GROUP BY currency, kind
+        ON CONFLICT (currency, kind) DO UPDATE SET
+            entries = t.entries + EXCLUDED.entries,
+            total_delta = t.total_delta + EXCLUDED.total_delta
+    ), run AS (
+        INSERT INTO ledger_snapshot_runs (upto_ledger_id, snapshots)
+        SELECT upto, (SELECT count(*) FROM snapshots) FROM horizon
+        WHERE upto > (SELECT upto FROM prev)
+    )
+    SELECT (SELECT upto FROM horizon) AS upto_ledger_id, (SELECT count(*) FROM snapshots) AS snapshots
+"""
+
+RECONCILE_SQL = """
+    WITH prev AS (
+        SELECT COALESCE(max(upto_ledger_id), 0) AS upto FROM ledger_snapshot_runs
+    ), latest AS (
+        SELECT DISTINCT ON (user_id, currency) user_id, currency, amount
+        FROM balance_snapshots
+        ORDER BY user_id, currency, ledger_id DESC
+    ), tail AS (
+        SELECT user_id, currency, sum(delta) AS delta
+        FROM ledger
+        WHERE id > (SELECT upto FROM prev)
+        GROUP BY user_id, currency
+    )
+    SELECT b.user_id, b.currency, b.amount AS balance,
+        COALESCE(s.amount, 0) + COALESCE(t.delta, 0) AS ledger_balance
+    FROM balances b
+    LEFT JOIN latest s ON s.user_id = b.user_id AND s.currency = b.currency
+    LEFT JOIN tail t ON t.user_id = b.user_id AND t.currency = b.currency
+    WHERE b.amount <> COALESCE(s.amount, 0) + COALESCE(t.delta, 0)
+    ORDER BY b.user_id, b.currency
+"""
+
+def take_snapshots(cur) -> Tuple[int, int]:
+    '''
+    Инкрементальный прогон: читаются только строки журнала после прошлого прогона.
+    Тот же хвост добавляется в итоги ledger_totals по валюте и виду движения.
+    Строки моложе SNAPSHOT_LAG секунд не берутся, чтобы не перепрыгнуть через еще не закоммиченную
+    запись с меньшим id: все записи в ledger делаются короткими одиночными запросами.
+    Параллельные прогоны сериализуются advisory-блокировкой. Коммит остается за вызывающим кодом.
+    '''
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('ledger_snapshot'))")
+    cur.execute(SNAPSHOT_SQL, {'lag': SNAPSHOT_LAG})
+    row = cur.fetchone()
+    return row['upto_ledger_id'], row['snapshots']
+
+
+def reconcile(cur) -> List[Dict[str, Any]]:
+    '''Балансы, у которых balances.amount не совпадает с последним снимком плюс хвостом журнала'''
+    cur.execute(RECONCILE_SQL)
+    return [dict(row) for row in cur.fetchall()]
+
@@ -0,0 +1,93 @@
+'''
+Business: Очередь заявок в статусе pending: keyset-пагинация по (created_at, id), фильтры и подсчет
+Args: параметры запроса (limit, cursor, currency, type, mode) — разбираются до соединения с БД; курсор БД
+Returns: страница заявок с курсором следующей страницы или их количество
+'''
+
+import base64
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+REQUEST_TYPES = ('deposit', 'withdraw')
+
+
+def encode_cursor(created_at: str, request_id: int) -> str:
+    return base64.urlsafe_b64encode(f'{created_at}|{request_id}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        created_at, request_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        # Время проверяется здесь: иначе мусор в курсоре дошел бы до ::timestamp в SQL и ответил бы 500
+        datetime.fromisoformat(created_at)
+        return created_at, int(request_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Некорректный курсор')
+
+
+def count_query(params: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+    '''Только фиксированные фрагменты SQL: значения фильтров всегда уходят параметрами. ValueError — 400'''
+    clauses = ["r.status = 'pending'"]
+    args: Dict[str, Any] = {}
+
+    currency = params.get('currency')
+    if currency:
+        if len(currency) != 3 or not currency.isascii() or not currency.isalpha() or not currency.isupper():
+            raise ValueError('Неизвестная валюта')
+        clauses.append('r.currency = %(currency)s')
+        args['currency'] = currency
+
+    request_type = params.get('type')
+    if request_type:
+        if request_type not in REQUEST_TYPES:
+            raise ValueError('Неизвестный тип заявки')
+        clauses.append('r.type = %(type)s')
+        args['type'] = request_type
+
+    return clauses, args
+
+
+def page_query(params: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+    '''Фильтры, limit и курсор страницы; ValueError — 400'''
+    clauses, args = count_query(params)
+
+    try:
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('Некорректный limit')
+    args['limit'] = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if params.get('cursor'):
+        args['cursor_created_at'], args['cursor_id'] = decode_cursor(params['cursor'])
+        clauses.append('(r.created_at, r.id) < (%(cursor_created_at)s::timestamp, %(cursor_id)s)')
+
+    return clauses, args
+
+
+def count_pending(cur, query: Tuple[List[str], Dict[str, Any]]) -> int:
+    '''query — из count_query. Считается index-only scan по частичному индексу idx_requests_pending_queue'''
+    clauses, args = query
+    cur.execute(f"SELECT count(*) AS count FROM requests r WHERE {' AND '.join(clauses)}", args)
+    return cur.fetchone()['count']
+
+
+def fetch_pending_page(cur, query: Tuple[List[str], Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    '''query — из page_query'''
+    clauses, args = query
+    cur.execute(f"""
+        SELECT r.id, r.user_id, r.type, r.amount, r.currency, r.status, r.created_at, u.full_name
+        FROM requests r
+        JOIN users u ON r.user_id = u.id
+        WHERE {' AND '.join(clauses)}
+        ORDER BY r.created_at DESC, r.id DESC
+        LIMIT %(limit)s + 1
+    """, args)
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > args['limit']:
+        rows = rows[:args['limit']]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return rows, next_cursor
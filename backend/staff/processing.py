@@ -0,0 +1,135 @@
+'''
+Business: Пакетная обработка заявок на пополнение/вывод: блокировка, изменение балансов и статусов за одну транзакцию
+Args: курсор БД, решения {request_id: 'approved' | 'rejected'}, id сотрудника (None для общего входа персонала)
+Returns: результат по каждой заявке
+'''
+
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from balances import write_through
+
+DECISIONS = ('approved', 'rejected')
+MAX_BATCH_REQUESTS = 500
+
+APPROVED = 'approved'
+REJECTED = 'rejected'
+INSUFFICIENT_FUNDS = 'insufficient_funds'
+SKIPPED = 'skipped'
+INVALID_DECISION = 'invalid_decision'
+
+ENSURE_BALANCES_SQL = """
+    INSERT INTO balances (user_id, currency)
+    SELECT DISTINCT user_id, currency FROM requests WHERE id = ANY(%(ids)s) AND status = 'pending'
+    ON CONFLICT (user_id, currency) DO NOTHING
+"""
+
+LOCK_SQL = """
+    SELECT r.id, r.user_id, r.type, r.amount, r.currency, b.amount AS balance
+    FROM requests r
+    JOIN balances b ON b.user_id = r.user_id AND b.currency = r.currency
+    WHERE r.id = ANY(%(ids)s) AND r.status = 'pending'
+    ORDER BY r.user_id, r.currency, r.created_at, r.id
+    FOR UPDATE OF r SKIP LOCKED
+    FOR UPDATE OF b
+"""
+
+APPLY_SQL = """
+    WITH changed_balances AS (
+        UPDATE balances b
+        SET amount = b.amount + d.delta
+        FROM unnest(%(user_ids)s::int[], %(currencies)s::varchar[], %(deltas)s::numeric[]) AS d(user_id, currency, delta)
+        WHERE b.user_id = d.user_id AND b.currency = d.currency
+        RETURNING b.user_id
+    ), statuses AS (
+        UPDATE requests r
+        SET status = d.status, processed_by = %(staff_id)s, processed_at = CURRENT_TIMESTAMP
+        FROM unnest(%(ids)s::int[], %(statuses)s::varchar[]) AS d(id, status)
+        WHERE r.id = d.id
+        RETURNING r.id
+    ), entries AS (
+        INSERT INTO ledger (user_id, currency, delta, balance_after, kind, reference_id)
+        SELECT * FROM unnest(
+            %(entry_user_ids)s::int[], %(entry_currencies)s::varchar[], %(entry_deltas)s::numeric[],
+            %(entry_balances)s::numeric[], %(entry_kinds)s::varchar[], %(entry_request_ids)s::bigint[]
+        )
+        RETURNING user_id, currency, id
+    )
+    SELECT (SELECT count(*) FROM changed_balances) AS balances_updated, (SELECT count(*) FROM statuses) AS requests_updated,
+        (SELECT jsonb_agg(jsonb_build_array(user_id, currency, id) ORDER BY id) FROM entries) AS entries
+"""
+
+
+def process_requests(cur, decisions: Dict[int, str], staff_id: Optional[int]) -> Dict[int, str]:
+    '''
+    Заявки блокируются с SKIP LOCKED: то, что сейчас обрабатывает другой сотрудник,
+    уже обработано или не существует, возвращается как skipped и не ждет блокировки.
+    Строки балансов блокируются тоже, чтобы ставки не списали деньги между проверкой и выводом;
+    недостающие строки балансов (валюта, в которой у клиента еще не было денег) создаются заранее с нулем.
+    Выводы проверяются по порядку создания на текущем балансе с учетом уже одобренных в пачке заявок;
+    изменения балансов применяются одним UPDATE, сгруппированным по пользователю и валюте, статусы — другим,
+    в журнал ledger пишется строка на каждую одобренную заявку с балансом после нее,
+    итоговые балансы уходят в кэш балансов с версией по id этих строк.
+    Коммит остается за вызывающим кодом.
+    '''
+    results: Dict[int, str] = {}
+    valid_ids = []
+    for request_id, decision in decisions.items():
+        if decision in DECISIONS:
+            valid_ids.append(request_id)
+        else:
+            results[request_id] = INVALID_DECISION
+
+    cur.execute(ENSURE_BALANCES_SQL, {'ids': valid_ids})
+    cur.execute(LOCK_SQL, {'ids': valid_ids})
+    rows = cur.fetchall()
+
+    balances: Dict[Tuple[int, str], Decimal] = {}
+    deltas: Dict[Tuple[int, str], Decimal] = {}
+    statuses: Dict[int, str] = {}
+    entries: List[Tuple[int, str, Decimal, Decimal, str, int]] = []
+
+    for row in rows:
+        request_id = row['id']
+        if decisions[request_id] == REJECTED:
+            statuses[request_id] = results[request_id] = REJECTED
+            continue
+
+        key = (row['user_id'], row['currency'])
+        if key not in balances:
+            balances[key] = Decimal(row['balance'])
+        amount = Decimal(row['amount'])
+        change = amount if row['type'] == 'deposit' else -amount
+
+        if balances[key] + change < 0:
+            statuses[request_id] = REJECTED
+            results[request_id] = INSUFFICIENT_FUNDS
+            continue
+
+        balances[key] += change
+        deltas[key] = deltas.get(key, Decimal(0)) + change
+        entries.append((row['user_id'], row['currency'], change, balances[key], row['type'], request_id))
+        statuses[request_id] = results[request_id] = APPROVED
+
+    for request_id in valid_ids:
+        results.setdefault(request_id, SKIPPED)
+
+    if statuses:
+        cur.execute(APPLY_SQL, {
+            'user_ids': [user_id for user_id, _ in deltas],
+            'currencies': [currency for _, currency in deltas],
+            'deltas': list(deltas.values()),
+            'ids': list(statuses),
+            'statuses': list(statuses.values()),
+            'staff_id': staff_id,
+            'entry_user_ids': [e[0] for e in entries],
+            'entry_currencies': [e[1] for e in entries],
+            'entry_deltas': [e[2] for e in entries],
+            'entry_balances': [e[3] for e in entries],
+            'entry_kinds': [e[4] for e in entries],
+            'entry_request_ids': [e[5] for e in entries],
+        })
+        for user_id, currency, ledger_id in cur.fetchone()['entries'] or []:
+            write_through(user_id, currency, balances[(user_id, currency)], ledger_id)
+
+    return results
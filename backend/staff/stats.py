@@ -0,0 +1,88 @@
+'''
+Business: Сводка для панели персонала: пополнения и выводы по валютам, GGR по играм, размер очереди заявок
+Args: курсор БД, STATS_REFRESH_AFTER из окружения (секунды, по умолчанию 300)
+Returns: словарь для ответа GET ?mode=stats; суммы строками, с отметкой, до какой записи журнала и истории они посчитаны
+'''
+
+import os
+from typing import Any, Dict
+
+from history import refresh_rollups
+from ledger import take_snapshots
+from pending import count_pending, count_query
+
+REFRESH_AFTER = float(os.environ.get('STATS_REFRESH_AFTER', '300'))
+
+# Прогон устарел, если последний был раньше REFRESH_AFTER секунд назад. Блокировка берется без ожидания:
+# если прогон уже идет (ledger_snapshot, maintain_history или соседний запрос сводки), отдаем итоги как есть
+STALE_SQL = """
+    WITH since AS (
+        SELECT (CURRENT_TIMESTAMP - make_interval(secs => %(after)s))::timestamp AS at
+    )
+    SELECT
+        CASE WHEN COALESCE((SELECT taken_at FROM ledger_snapshot_runs ORDER BY id DESC LIMIT 1), '-infinity'::timestamp)
+                < (SELECT at FROM since)
+            THEN pg_try_advisory_xact_lock(hashtext('ledger_snapshot')) ELSE false END AS ledger,
+        CASE WHEN COALESCE((SELECT taken_at FROM game_stats_runs ORDER BY id DESC LIMIT 1), '-infinity'::timestamp)
+                < (SELECT at FROM since)
+            THEN pg_try_advisory_xact_lock(hashtext('game_stats_rollup')) ELSE false END AS games
+"""
+
+# Только итоговые таблицы и последние строки прогонов по первичному ключу: время ответа не растет с историей.
+# Итоги отстают от живых данных на LAG прогонов и не больше чем на REFRESH_AFTER между ними
+STATS_SQL = """
+    SELECT
+        (
+            SELECT jsonb_object_agg(c.code, jsonb_build_object(
+                'deposits', COALESCE(d.total_delta, 0.00)::text,
+                'deposit_count', COALESCE(d.entries, 0),
+                'withdrawals', COALESCE(-w.total_delta, 0.00)::text,
+                'withdraw_count', COALESCE(w.entries, 0)
+            ))
+            FROM currencies c
+            LEFT JOIN ledger_totals d ON d.currency = c.code AND d.kind = 'deposit'
+            LEFT JOIN ledger_totals w ON w.currency = c.code AND w.kind = 'withdraw'
+        ) AS payments,
+        (
+            SELECT COALESCE(jsonb_object_agg(game_type, jsonb_build_object(
+                'rounds', rounds,
+                'wins', wins,
+                'total_bet', total_bet::text,
+                'total_win', total_win::text,
+                'ggr', (total_bet - total_win)::text
+            )), '{}'::jsonb)
+            FROM game_totals
+        ) AS games,
+        (SELECT jsonb_build_object('upto_id', upto_ledger_id, 'refreshed_at', taken_at)
+            FROM ledger_snapshot_runs ORDER BY id DESC LIMIT 1) AS ledger_run,
+        (SELECT jsonb_build_object('upto_id', upto_id, 'refreshed_at', taken_at)
+            FROM game_stats_runs ORDER BY id DESC LIMIT 1) AS games_run
+"""
+
+
+def refresh_stale_totals(cur) -> bool:
+    '''
+    Догоняет ledger_totals и game_totals, если их прогон давно не делался: итоги не должны зависеть от того,
+    вызывает ли кто-то ledger_snapshot и maintain_history. Читается только хвост после прошлого прогона.
+    Возвращает True, если что-то прогнали — тогда коммит за вызывающим кодом.
+    '''
+    cur.execute(STALE_SQL, {'after': REFRESH_AFTER})
+    row = cur.fetchone()
+    if row['ledger']:
+        take_snapshots(cur)
+    if row['games']:
+        refresh_rollups(cur)
+    return row['ledger'] or row['games']
+
+
+def dashboard_stats(cur) -> Dict[str, Any]:
+    '''Очередь считается живой: index-only scan по частичному индексу pending, его размер — сама очередь, а не история'''
+    cur.execute(STATS_SQL)
+    row = cur.fetchone()
+    return {
+        'payments': row['payments'],
+        'games': row['games'],
+        'pending_requests': count_pending(cur, count_query({})),
+        'ledger_upto': row['ledger_run'],
+        'games_upto': row['games_run'],
+    }
@@ -0,0 +1,261 @@
+'''
+Business: Пул соединений с БД, переиспользуемый тёплыми вызовами функции
+Args: DATABASE_URL, DB_POOL_MAX_SIZE, DB_POOL_ACQUIRE_TIMEOUT, DB_POOL_PING_AFTER из окружения; замеры вызова — см. timing.py
+Returns: get_db_connection/release_db_connection, курсор со строками-словарями и счетчики пула
+'''
+
+import os
+import select
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import timing
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '5'))
+POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+# Драйвер загружается при первом соединении: импорт psycopg2 — половина холодного старта,
+# а OPTIONS, 401 и отказы валидации обходятся без него
+psycopg2: Any = None
+_IDLE: Any = None
+NUMERIC_AS_TEXT: Any = None
+TIMESTAMP_AS_TEXT: Any = None
+_driver_lock = threading.Lock()
+
+
+def _cast_text(value: Optional[str], cur: Any) -> Optional[str]:
+    return value
+
+
+def load_driver() -> Any:
+    global psycopg2, _IDLE, NUMERIC_AS_TEXT, TIMESTAMP_AS_TEXT
+    if psycopg2 is None:
+        with _driver_lock:
+            if psycopg2 is None:
+                # Подмодули через as: голый import psycopg2.extensions присвоил бы глобальный psycopg2
+                # раньше типов ниже, и параллельный поток прошел бы мимо блокировки с NUMERIC_AS_TEXT = None
+                import psycopg2 as driver
+                import psycopg2.extensions as _extensions
+                import psycopg2.extras as _extras
+
+                _IDLE = driver.extensions.TRANSACTION_STATUS_IDLE
+                # NUMERIC и TIMESTAMP приходят из БД как есть, текстом: суммы остаются точными ('1000.00'),
+                # а ответ сериализуется без default-колбэка. Где нужна арифметика — Decimal(row['amount']).
+                NUMERIC_AS_TEXT = driver.extensions.new_type(driver.extensions.DECIMAL.values, 'NUMERIC_AS_TEXT', _cast_text)
+                TIMESTAMP_AS_TEXT = driver.extensions.new_type(driver.extensions.PYDATETIME.values, 'TIMESTAMP_AS_TEXT', _cast_text)
+                psycopg2 = driver
+    return psycopg2
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, dsn: str, max_size: int, acquire_timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.ping_after = ping_after
+        self._idle: List[Tuple[Any, float]] = []
+        self._open = 0
+        self._cond = threading.Condition()
+        # Счетчики меняются только под _cond: пул делят потоки dev-сервера, а += не атомарен
+        self.stats: Dict[str, int] = {
+            'hits': 0,
+            'misses': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'waits': 0,
+        }
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while not self._idle and self._open >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(f'Все {self.max_size} соединений заняты')
+                self.stats['waits'] += 1
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, released_at = self._idle.pop()
+            else:
+                self._open += 1
+                conn = None
+
+        if conn is None:
+            return self._connect(miss=True)
+
+        if self._is_healthy(conn, released_at):
+            with self._cond:
+                self.stats['hits'] += 1
+            return conn
+
+        self._close(conn)
+        with self._cond:
+            self.stats['reconnects'] += 1
+            self._open += 1
+        return self._connect(miss=False)
+
+    def release(self, conn) -> None:
+        if not conn.closed and conn.info.transaction_status != _IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+
+        if conn.closed or conn.info.transaction_status != _IDLE:
+            self._close(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self.stats, open=self._open, idle=len(self._idle), max_size=self.max_size)
+
+    def _connect(self, miss: bool):
+        started = time.perf_counter()
+        try:
+            load_driver()
+            if timing.ENABLED:
+                conn = psycopg2.connect(self.dsn, connection_factory=timing.connection_factory())
+            else:
+                conn = psycopg2.connect(self.dsn)
+            psycopg2.extensions.register_type(NUMERIC_AS_TEXT, conn)
+            psycopg2.extensions.register_type(TIMESTAMP_AS_TEXT, conn)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        if miss:
+            with self._cond:
+                self.stats['misses'] += 1
+        if timing.ENABLED:
+            timing.record_connect(time.perf_counter() - started)
+        return conn
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        try:
+            readable, _, _ = select.select([conn], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        if readable:
+            return False
+        if time.monotonic() - released_at < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self.stats['discarded'] += 1
+            self._open -= 1
+            self._cond.notify()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+_checked_out = threading.local()
+_request_end: List[Callable[[], None]] = []
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    os.environ['DATABASE_URL'],
+                    POOL_MAX_SIZE,
+                    POOL_ACQUIRE_TIMEOUT,
+                    POOL_PING_AFTER,
+                )
+    return _pool
+
+
+def get_db_connection():
+    if timing.ENABLED:
+        started = time.perf_counter()
+        conn = get_pool().acquire()
+        timing.record_acquire(time.perf_counter() - started)
+    else:
+        conn = get_pool().acquire()
+    held = getattr(_checked_out, 'conns', None)
+    if held is None:
+        held = _checked_out.conns = []
+    held.append(conn)
+    return conn
+
+
+def dict_cursor(conn) -> Any:
+    '''
+    Курсор, отдающий строки словарями (RealDictCursor). Драйвер берется через load_driver():
+    соединение могло прийти из чужого пула (общий пул dev-сервера), и этот модуль его еще не загружал.
+    '''
+    return conn.cursor(cursor_factory=load_driver().extras.RealDictCursor)
+
+
+def release_db_connection(conn) -> None:
+    held = getattr(_checked_out, 'conns', None)
+    if not held or conn not in held:
+        return
+    held.remove(conn)
+    get_pool().release(conn)
+
+
+def pool_stats() -> Dict[str, int]:
+    if _pool is None:
+        return {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0, 'waits': 0,
+                'open': 0, 'idle': 0, 'max_size': POOL_MAX_SIZE}
+    return _pool.snapshot()
+
+
+def on_request_end(callback: Callable[[], None]) -> None:
+    '''Колбэк в конце каждого вызова обработчика, после возврата соединений: сброс состояния вызова в потоке'''
+    _request_end.append(callback)
+
+
+def pooled(func: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+    '''Возвращает в пул соединения, которые обработчик не отпустил сам (ранний return, исключение)'''
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Dict[str, Any]:
+        trace = timing.begin() if timing.ENABLED else None
+        response = None
+        try:
+            response = func(*args, **kwargs)
+            return response
+        finally:
+            held = getattr(_checked_out, 'conns', None)
+            while held:
+                release_db_connection(held[-1])
+            for callback in _request_end:
+                callback()
+            if trace is not None:
+                timing.finish(trace, args[0] if args else None, response,
+                              pool_stats() if timing.LOG_ENABLED else None)
+    return wrapper
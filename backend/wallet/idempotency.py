@@ -0,0 +1,193 @@
+'''
+Business: Идемпотентность изменяющих запросов: повтор с тем же Idempotency-Key получает исходный ответ вместо второго списания
+Args: заголовки запроса, id игрока, имя функции и тело запроса; курсор транзакции, в которой выполняется само действие; IDEMPOTENCY_TTL, IDEMPOTENCY_CACHE_SIZE
+Returns: сохраненный ответ для повтора или None, если запрос выполняется впервые
+'''
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Dict, Optional, Tuple
+
+from money import JSON_HEADERS
+from router import failure, response
+
+TTL = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+PURGE_INTERVAL = 60.0
+PURGE_BATCH = 1000
+MAX_KEY_LENGTH = 128
+
+REPLAY_HEADERS = MappingProxyType(dict(JSON_HEADERS, **{'Idempotent-Replayed': 'true', 'Access-Control-Expose-Headers': 'Idempotent-Replayed'}))
+
+# Ключ занимается вставкой строки: параллельный повтор ждет на конфликте, пока первая транзакция
+# не завершится. Истекший ключ занимается заново. Если строка уже была, ответ читается тем же запросом
+CLAIM_SQL = """
+    WITH claimed AS (
+        INSERT INTO idempotency_keys AS k (user_id, idempotency_key, request_hash, expires_at)
+        VALUES (%(user_id)s, %(key)s, %(request_hash)s, CURRENT_TIMESTAMP + make_interval(secs => %(ttl)s))
+        ON CONFLICT (user_id, idempotency_key) DO UPDATE
+            SET request_hash = EXCLUDED.request_hash, status_code = NULL, response = NULL,
+                created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at
+            WHERE k.expires_at <= CURRENT_TIMESTAMP
+        RETURNING true AS claimed, request_hash, status_code, response
+    )
+    SELECT * FROM claimed
+    UNION ALL
+    SELECT false, request_hash, status_code, response FROM idempotency_keys
+    WHERE user_id = %(user_id)s AND idempotency_key = %(key)s AND NOT EXISTS (SELECT 1 FROM claimed)
+"""
+
+STORED_SQL = """
+    SELECT false AS claimed, request_hash, status_code, response FROM idempotency_keys
+    WHERE user_id = %(user_id)s AND idempotency_key = %(key)s
+"""
+
+PURGE_SQL = """
+    DELETE FROM idempotency_keys WHERE ctid IN (
+        SELECT ctid FROM idempotency_keys WHERE expires_at < CURRENT_TIMESTAMP
+        LIMIT %s FOR UPDATE SKIP LOCKED
+    )
+"""
+
+
+class IdempotentRequest:
+    __slots__ = ('user_id', 'key', 'request_hash', 'settled')
+
+    def __init__(self, user_id: Any, key: str, scope: str, body: Dict[str, Any]):
+        self.user_id = user_id
+        self.key = key
+        # False, если _replay ответил 409/422: такой ответ не окончательный и в кэш экземпляра не идет
+        self.settled = True
+        canonical = json.dumps([scope, body], sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        self.request_hash = hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    '''Ответы, сохраненные этим экземпляром: повтор, пришедший сюда же, не трогает БД вовсе'''
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: 'OrderedDict[Tuple[Any, str], Tuple[float, str, int, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Any, key: str) -> Optional[Tuple[str, int, str]]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get((user_id, key))
+            if item is None:
+                return None
+            if item[0] <= now:
+                del self._items[(user_id, key)]
+                return None
+            return item[1:]
+
+    def put(self, user_id: Any, key: str, request_hash: str, status_code: int, body: str) -> None:
+        with self._lock:
+            self._items[(user_id, key)] = (time.monotonic() + self.ttl, request_hash, status_code, body)
+            self._items.move_to_end((user_id, key))
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+responses = ResponseCache(TTL, CACHE_SIZE)
+_next_purge = 0.0
+
+
+def _replay(request: IdempotentRequest, request_hash: str, status_code: Optional[int], body: Optional[str]) -> Dict[str, Any]:
+    if request_hash != request.request_hash:
+        request.settled = False
+        return failure(422, 'Ключ идемпотентности уже использован для другого запроса')
+    if status_code is None:
+        # Строка без ответа видна только до коммита первой транзакции; сюда попадает лишь гонка с ней
+        request.settled = False
+        return failure(409, 'Запрос с этим ключом еще выполняется')
+    return response(status_code, headers=REPLAY_HEADERS, body=body)
+
+
+def begin(headers: Dict[str, Any], user_id: Any, scope: str, body: Dict[str, Any]) -> Tuple[Optional[IdempotentRequest], Optional[Dict[str, Any]]]:
+    '''
+    Читает Idempotency-Key до открытия соединения. Возвращает запрос для claim/save
+    и готовый ответ, если его можно отдать сразу: ключ некорректен или ответ есть в кэше экземпляра.
+    Без заголовка запрос выполняется как обычно.
+    '''
+    key = headers.get('Idempotency-Key') or headers.get('idempotency-key')
+    if key is None:
+        return None, None
+    if not isinstance(key, str) or not 0 < len(key) <= MAX_KEY_LENGTH or not key.isascii() or not key.isprintable():
+        return None, failure(400, 'Некорректный Idempotency-Key')
+    request = IdempotentRequest(user_id, key, scope, body)
+    cached = responses.get(user_id, key)
+    if cached is None:
+        return request, None
+    return request, _replay(request, *cached)
+
+
+def claim(cur, request: Optional[IdempotentRequest]) -> Optional[Dict[str, Any]]:
+    '''
+    Первый запрос в транзакции действия. None — ключ наш, действие выполняется; иначе — ответ повтора.
+    Если действие упадет, откат транзакции освободит ключ вместе с ним.
+    '''
+    if request is None:
+        return None
+    params = {'user_id': request.user_id, 'key': request.key, 'request_hash': request.request_hash, 'ttl': TTL}
+    cur.execute(CLAIM_SQL, params)
+    row = cur.fetchone()
+    if row is None:
+        # Ждали на конфликте транзакцию, которая заняла ключ; ее строка видна только новому снимку
+        cur.execute(STORED_SQL, params)
+        row = cur.fetchone()
+        if row is None:
+            return None if _claim_again(cur, params) else _replay(request, request.request_hash, None, None)
+    if row['claimed']:
+        return None
+    return _replay(request, row['request_hash'], row['status_code'], row['response'])
+
+
+def lookup(cur, request: Optional[IdempotentRequest]) -> Optional[Dict[str, Any]]:
+    '''Только чтение: сохраненный ответ, если ключ уже использован. Для путей, которые до действия могут и не дойти'''
+    if request is None:
+        return None
+    cur.execute(STORED_SQL, {'user_id': request.user_id, 'key': request.key})
+    row = cur.fetchone()
+    return _replay(request, row['request_hash'], row['status_code'], row['response']) if row else None
+
+
+def _claim_again(cur, params: Dict[str, Any]) -> bool:
+    '''Первая транзакция откатилась или ключ успели удалить как истекший — пробуем занять его еще раз'''
+    cur.execute(CLAIM_SQL, params)
+    row = cur.fetchone()
+    return bool(row and row['claimed'])
+
+
+def save(cur, request: Optional[IdempotentRequest], response: Dict[str, Any]) -> None:
+    '''Пишет ответ в строку ключа до коммита, вместе с результатом действия'''
+    global _next_purge
+    if request is None:
+        return
+    cur.execute(
+        "UPDATE idempotency_keys SET status_code = %s, response = %s WHERE user_id = %s AND idempotency_key = %s",
+        (response['statusCode'], response['body'], request.user_id, request.key)
+    )
+    now = time.monotonic()
+    if now >= _next_purge:
+        _next_purge = now + PURGE_INTERVAL
+        cur.execute(PURGE_SQL, (PURGE_BATCH,))
+
+
+def remember(request: Optional[IdempotentRequest], response: Dict[str, Any]) -> None:
+    '''
+    После коммита: следующий повтор на этом экземпляре ответится из памяти.
+    Кэшируется только сохраненный ответ или повтор сохраненного; 409 гонки и 422 чужого тела — нет:
+    первый залип бы на весь TTL, второй заменил бы хеш исходного запроса
+    '''
+    if request is not None and request.settled:
+        responses.put(request.user_id, request.key, request.request_hash, response['statusCode'], response['body'])
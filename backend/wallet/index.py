@@ -1,159 +1,263 @@
 '''
 Business: Управление кошельком, обмен валют, пополнение/вывод
-Args: event с httpMethod, headers (X-User-Id), body (action, amount, currency)
-Returns: HTTP response с балансом или результатом операции
+Args: event с httpMethod, headers (X-Auth-Token или X-User-Id, Idempotency-Key для exchange и request, If-None-Match для баланса), queryStringParameters (mode=rate), body (action, amount, currency, from_currency, to_currency)
+Returns: HTTP response с балансом (ETag, 304 если он не изменился) или результатом операции; повтор с тем же Idempotency-Key получает исходный ответ
 '''
 
-import json
-import os
-from typing import Dict, Any
+import time
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Tuple
 from decimal import Decimal
-import psycopg2
-from psycopg2.extras import RealDictCursor
-
-EXCHANGE_RATE = 95.0
-
-def decimal_default(obj):
-    if isinstance(obj, Decimal):
-        return float(obj)
-    raise TypeError
-
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    headers = event.get('headers', {})
-    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
-    
-    if not user_id:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Не авторизован'})
-        }
+
+from db import get_db_connection, release_db_connection, dict_cursor
+from money import JSON_HEADERS, money_str, to_money
+from router import Router, Request, response, error, failure
+from rates import rates
+from balances import (
+    balance_fields, balances_version_sql, cache_balances, cached_balances, commit_writes, user_balances_sql,
+    verify_balances, version_tag, write_through_balances,
+)
+from ratelimit import rate_limited, too_many_requests
+from idempotency import IdempotentRequest, begin, claim, save, remember
+
+ZERO = Decimal(0)
+INSUFFICIENT_FUNDS_ERRORS = {'RUB': 'Недостаточно рублей', 'USD': 'Недостаточно долларов'}
+BALANCE_HEADERS = MappingProxyType({
+    **JSON_HEADERS,
+    'Cache-Control': 'private, no-cache',
+    'Vary': 'X-Auth-Token, X-User-Id',
+    'Access-Control-Expose-Headers': 'ETag',
+})
+
+EXCHANGE_SQL = """
+    WITH debit AS (
+        UPDATE balances SET amount = amount - %(amount)s
+        WHERE user_id = %(user_id)s AND currency = %(from_currency)s AND amount >= %(amount)s
+        RETURNING user_id, currency, amount
+    ), credit AS (
+        INSERT INTO balances (user_id, currency, amount)
+        SELECT user_id, %(to_currency)s, %(converted)s FROM debit
+        ON CONFLICT (user_id, currency) DO UPDATE SET amount = balances.amount + EXCLUDED.amount
+        RETURNING user_id, currency, amount
+    ), exchange AS (
+        INSERT INTO exchanges (user_id, from_currency, to_currency, amount, converted_amount, rate_version)
+        SELECT user_id, %(from_currency)s, %(to_currency)s, %(amount)s, %(converted)s, %(rate_version)s FROM debit
+        RETURNING id
+    ), entries AS (
+        INSERT INTO ledger (user_id, currency, delta, balance_after, kind, reference_id)
+        SELECT user_id, currency, -%(amount)s, amount, 'exchange', (SELECT id FROM exchange) FROM debit
+        UNION ALL
+        SELECT user_id, currency, %(converted)s, amount, 'exchange', (SELECT id FROM exchange) FROM credit
+        RETURNING id, currency
+    )
+    SELECT jsonb_object_agg(c.code, COALESCE(changed.amount, b.amount, 0.00)::text) AS balances,
+        jsonb_object_agg(c.code, COALESCE(
+            (SELECT id FROM entries e WHERE e.currency = c.code),
+            (SELECT max(l.id) FROM ledger l WHERE l.user_id = %(user_id)s AND l.currency = c.code),
+            0
+        )) AS version
+    FROM currencies c
+    LEFT JOIN balances b ON b.user_id = %(user_id)s AND b.currency = c.code
+    LEFT JOIN (SELECT currency, amount FROM debit UNION ALL SELECT currency, amount FROM credit) changed
+        ON changed.currency = c.code
+    WHERE EXISTS (SELECT 1 FROM debit)
+    HAVING count(*) > 0
+"""
+
+
+def exchange(cur, user_id: Any, amount: Decimal, from_currency: str, to_currency: str, rate: Any) -> Dict[str, Any]:
+    '''Списание, зачисление, запись обмена и журнала одним запросом; коммит и commit_writes() остаются за вызывающим кодом'''
+    converted_amount = rate.convert(amount, from_currency)
+    cur.execute(EXCHANGE_SQL, {
+        'amount': amount,
+        'converted': converted_amount,
+        'user_id': user_id,
+        'from_currency': from_currency,
+        'to_currency': to_currency,
+        'rate_version': rate.version,
+    })
+    new_balance = cur.fetchone()
+    
+    if new_balance is not None:
+        write_through_balances(user_id, new_balance['balances'], new_balance['version'])
+    
+    if new_balance is None:
+        return response(400, {
+            'success': False,
+            'error': INSUFFICIENT_FUNDS_ERRORS.get(from_currency, 'Недостаточно средств')
+        })
+    
+    return response(200, {
+        'success': True,
+        'balance': balance_fields(new_balance['balances']),
+        'converted_amount': money_str(converted_amount),
+        'rate': str(rate.rate),
+        'rate_version': rate.version,
+        'message': 'Обмен выполнен успешно'
+    })
+
+def balance_response(user_id: Any, cached: Any, headers: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    ETag — id пользователя и версия балансов. Клиент, опрашивающий баланс с If-None-Match,
+    получает 304 без тела, пока версия не изменилась. Версия из кэша не старше BALANCE_CACHE_VERIFY_AFTER:
+    позже она сверяется с журналом (см. balance), так что изменения с других экземпляров не прячутся за 304.
+    '''
+    etag = f'"{user_id}.{version_tag(cached.version)}"'
+    if_none_match = headers.get('If-None-Match') or headers.get('if-none-match') or ''
+    if etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(',')):
+        return response(304, headers=dict(BALANCE_HEADERS, ETag=etag))
+    
+    return response(200, balance_fields(cached.balances), dict(BALANCE_HEADERS, ETag=etag))
+
+
+def limit(request: Request) -> Optional[Dict[str, Any]]:
+    if request.method == 'GET':
+        action = 'read'
+    else:
+        action = request.action if request.action in ('exchange', 'request') else 'write'
+    retry_after = rate_limited(request.user_id, action)
+    return too_many_requests(retry_after) if retry_after is not None else None
+
+
+router = Router(guard=limit)
+handler = router.handler
+
+
+@router.route('GET')
+def balance(request: Request) -> Dict[str, Any]:
+    user_id = request.user_id
+    cached = cached_balances(user_id)
+    if cached is not None and not cached.needs_verify(time.monotonic()):
+        return balance_response(user_id, cached, request.headers)
     
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = dict_cursor(conn)
     
-    if method == 'GET':
-        cur.execute("SELECT balance_rub, balance_usd FROM users WHERE id = %s", (user_id,))
-        balance = cur.fetchone()
-        cur.close()
-        conn.close()
-        
-        if not balance:
-            return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Пользователь не найден'})
-            }
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps(dict(balance), default=decimal_default)
-        }
-    
-    if method == 'POST':
-        body = json.loads(event.get('body', '{}'))
-        action = body.get('action')
-        amount = float(body.get('amount', 0))
-        currency = body.get('currency', 'RUB')
-        
-        if action == 'exchange':
-            from_currency = body.get('from_currency')
-            to_currency = body.get('to_currency')
-            
-            cur.execute("SELECT balance_rub, balance_usd FROM users WHERE id = %s", (user_id,))
-            balance = cur.fetchone()
-            
-            if from_currency == 'RUB' and to_currency == 'USD':
-                if float(balance['balance_rub']) < amount:
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'Недостаточно рублей'})
-                    }
-                
-                usd_amount = amount / EXCHANGE_RATE
-                cur.execute(
-                    "UPDATE users SET balance_rub = balance_rub - %s, balance_usd = balance_usd + %s WHERE id = %s RETURNING balance_rub, balance_usd",
-                    (amount, usd_amount, user_id)
-                )
-            
-            elif from_currency == 'USD' and to_currency == 'RUB':
-                if float(balance['balance_usd']) < amount:
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'Недостаточно долларов'})
-                    }
-                
-                rub_amount = amount * EXCHANGE_RATE
-                cur.execute(
-                    "UPDATE users SET balance_usd = balance_usd - %s, balance_rub = balance_rub + %s WHERE id = %s RETURNING balance_rub, balance_usd",
-                    (amount, rub_amount, user_id)
-                )
-            
-            conn.commit()
-            new_balance = cur.fetchone()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'balance': dict(new_balance),
-                    'message': 'Обмен выполнен успешно'
-                }, default=decimal_default)
-            }
-        
-        elif action == 'request':
-            request_type = body.get('type')
-            
-            cur.execute(
-                "INSERT INTO requests (user_id, type, amount, currency) VALUES (%s, %s, %s, %s) RETURNING id",
-                (user_id, request_type, amount, currency)
-            )
-            conn.commit()
-            request_id = cur.fetchone()['id']
+    if cached is not None:
+        # Ставки и операции персонала идут через другие экземпляры и в этот кэш не попадают.
+        # Сверка версии — по одной пробе индекса ledger на валюту; совпала — ответ (и 304) из кэша
+        cur.execute(f"SELECT {balances_version_sql('%s')} AS version", (user_id,))
+        if cur.fetchone()['version'] == cached.version:
             cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'request_id': request_id,
-                    'message': 'Заявка создана'
-                })
-            }
+            release_db_connection(conn)
+            verify_balances(user_id, cached)
+            return balance_response(user_id, cached, request.headers)
+    
+    cur.execute(
+        f"SELECT {user_balances_sql('users.id')} AS balances, {balances_version_sql('users.id')} AS version FROM users WHERE id = %s",
+        (user_id,)
+    )
+    row = cur.fetchone()
+    cur.close()
+    release_db_connection(conn)
+    
+    if not row:
+        return error(404, 'Пользователь не найден')
+    
+    cached = cache_balances(user_id, row['balances'], row['version'])
+    return balance_response(user_id, cached, request.headers)
+
+
+@router.route('GET', 'rate')
+def exchange_rate(request: Request) -> Dict[str, Any]:
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    rate = rates.get(cur, 'USD', 'RUB')
+    cur.close()
+    release_db_connection(conn)
+    
+    if rate is None:
+        return error(404, 'Курс не задан')
+    
+    return response(200, {
+        'base_currency': rate.base_currency,
+        'quote_currency': rate.quote_currency,
+        'rate': str(rate.rate),
+        'version': rate.version
+    })
+
+
+def operation(request: Request) -> Tuple[Optional[IdempotentRequest], Optional[Dict[str, Any]], Decimal]:
+    '''Общее начало обмена и заявки: ключ идемпотентности и сумма проверяются до соединения с БД'''
+    idempotent, reply = begin(request.headers, request.user_id, 'wallet', request.body)
+    if reply is not None:
+        return idempotent, reply, ZERO
+    
+    try:
+        amount = to_money(request.body.get('amount', 0))
+    except ValueError:
+        amount = ZERO
+    
+    if amount <= 0:
+        return idempotent, failure(400, 'Некорректная сумма'), amount
+    return idempotent, None, amount
+
+
+@router.route('POST', 'exchange')
+def exchange_currency(request: Request) -> Dict[str, Any]:
+    idempotent, reply, amount = operation(request)
+    if reply is not None:
+        return reply
+    
+    from_currency = request.body.get('from_currency')
+    to_currency = request.body.get('to_currency')
+    
+    # Список или объект вместо кода валюты уронил бы поиск курса с TypeError (500)
+    if not isinstance(from_currency, str) or not isinstance(to_currency, str):
+        return failure(400, 'Обмен для этой пары валют недоступен')
     
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    
+    rate = None
+    if from_currency != to_currency:
+        rate = rates.get(cur, from_currency, to_currency)
+    
+    if rate is None:
+        cur.close()
+        release_db_connection(conn)
+        return failure(400, 'Обмен для этой пары валют недоступен')
+    
+    # Меньше копейки после пересчета (0.94 RUB по 95) — списание без зачисления
+    if rate.convert(amount, from_currency) <= 0:
+        cur.close()
+        release_db_connection(conn)
+        return failure(400, 'Сумма слишком мала для обмена')
+    
+    reply = claim(cur, idempotent)
+    if reply is None:
+        reply = exchange(cur, request.user_id, amount, from_currency, to_currency, rate)
+        save(cur, idempotent, reply)
+    conn.commit()
+    commit_writes()
+    cur.close()
+    release_db_connection(conn)
+    remember(idempotent, reply)
+    return reply
+
+
+@router.route('POST', 'request')
+def create_request(request: Request) -> Dict[str, Any]:
+    idempotent, reply, amount = operation(request)
+    if reply is not None:
+        return reply
+    
+    conn = get_db_connection()
+    cur = dict_cursor(conn)
+    reply = claim(cur, idempotent)
+    if reply is None:
+        cur.execute(
+            "INSERT INTO requests (user_id, type, amount, currency) VALUES (%s, %s, %s, %s) RETURNING id",
+            (request.user_id, request.body.get('type'), amount, request.body.get('currency', 'RUB'))
+        )
+        reply = response(200, {
+            'success': True,
+            'request_id': cur.fetchone()['id'],
+            'message': 'Заявка создана'
+        })
+        save(cur, idempotent, reply)
+    conn.commit()
     cur.close()
-    conn.close()
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+    release_db_connection(conn)
+    remember(idempotent, reply)
+    return reply
@@ -0,0 +1,52 @@
+'''
+Business: Деньги и сериализация ответов: суммы в Decimal, JSON без per-object default, готовые заголовки
+Args: суммы из тела запроса, словари ответов
+Returns: Decimal с точностью до копейки, JSON-строки, общие заголовки ответа
+'''
+
+import json
+from decimal import Decimal, InvalidOperation, ROUND_DOWN
+from types import MappingProxyType
+from typing import Any
+
+CENT = Decimal('0.01')
+MAX_AMOUNT = Decimal(10) ** 10
+
+# Только для чтения: в ответ заголовки копирует router.response
+JSON_HEADERS = MappingProxyType({'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'})
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def to_money(value: Any) -> Decimal:
+    '''
+    Сумма из запроса сразу в Decimal, без промежуточного float: '0.1' остается ровно 0.10.
+    Лишние знаки отбрасываются вниз, чтобы округление не добавляло денег.
+    '''
+    if isinstance(value, bool):
+        raise ValueError(f'Некорректная сумма: {value!r}')
+    try:
+        amount = Decimal(value if isinstance(value, (str, int)) else str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f'Некорректная сумма: {value!r}')
+    # Суммы в БД — DECIMAL(12, 2): большее значение дало бы ошибку переполнения при INSERT, а quantize — InvalidOperation
+    if not amount.is_finite() or abs(amount) >= MAX_AMOUNT:
+        raise ValueError(f'Некорректная сумма: {value!r}')
+    try:
+        return amount.quantize(CENT, rounding=ROUND_DOWN)
+    except InvalidOperation:
+        raise ValueError(f'Некорректная сумма: {value!r}')
+
+
+def money_str(amount: Decimal) -> str:
+    '''Точное строковое представление суммы для ответа: Decimal('5') -> '5.00' '''
+    return str(amount.quantize(CENT))
+
+
+def dumps(payload: Any) -> str:
+    '''
+    Денежные значения приходят сюда уже строками: NUMERIC из БД отдается драйвером как текст
+    (см. NUMERIC_AS_TEXT в db.py), суммы из Python превращаются в строки через money_str.
+    Поэтому энкодер собирается один раз и работает без default-колбэка на каждый объект.
+    '''
+    return _encoder.encode(payload)
@@ -0,0 +1,180 @@
+'''
+Business: Ограничение частоты запросов игрока: token bucket на пару (игрок, действие) в памяти экземпляра
+Args: RATE_LIMIT_ENABLED, RATE_LIMIT_<ДЕЙСТВИЕ> (емкость/пополнение в секунду), RATE_LIMIT_MAX_KEYS, RATE_LIMIT_SYNC (1 — сводить расход экземпляров через rate_limit_counters), RATE_LIMIT_SYNC_INTERVAL
+Returns: None, если запрос можно выполнять, иначе через сколько секунд повторить, и готовый ответ 429; отказ не трогает БД
+'''
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import PoolExhausted, get_db_connection, load_driver, release_db_connection
+from money import JSON_HEADERS
+from router import response
+
+ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '50000'))
+SYNC_ENABLED = os.environ.get('RATE_LIMIT_SYNC', '0') == '1'
+SYNC_INTERVAL = float(os.environ.get('RATE_LIMIT_SYNC_INTERVAL', '5'))
+SYNC_WINDOW = 60
+SYNC_KEEP_WINDOWS = 5
+
+# Действие -> 'емкость/пополнение в секунду': емкость — сколько запросов можно сделать пачкой
+DEFAULT_LIMITS = {
+    'roulette': '10/5',
+    'mines': '30/10',
+    'exchange': '5/1',
+    'request': '3/0.2',
+    'write': '5/1',
+    'read': '30/10',
+}
+
+SYNC_SQL = """
+    INSERT INTO rate_limit_counters AS c (bucket, window_start, hits)
+    SELECT * FROM unnest(%(buckets)s::varchar[], %(windows)s::bigint[], %(hits)s::integer[])
+    ON CONFLICT (bucket, window_start) DO UPDATE SET hits = c.hits + EXCLUDED.hits
+    RETURNING bucket, hits
+"""
+
+
+def _parse_limit(value: str) -> Tuple[float, float]:
+    capacity, per_second = value.split('/', 1)
+    return float(capacity), float(per_second)
+
+
+LIMITS = {
+    action: _parse_limit(os.environ.get(f'RATE_LIMIT_{action.upper()}', default))
+    for action, default in DEFAULT_LIMITS.items()
+}
+
+
+class Bucket:
+    __slots__ = ('tokens', 'updated_at', 'window', 'local_hits', 'pending_hits', 'remote_hits')
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated_at = now
+        self.window = 0
+        self.local_hits = 0
+        self.pending_hits = 0
+        self.remote_hits = 0
+
+
+class RateLimiter:
+    '''
+    Ведра живут в OrderedDict с вытеснением самого давно не использованного — память ограничена max_keys.
+    С синхронизацией каждый экземпляр раз в sync_interval одним запросом добавляет свои попадания
+    в счетчик окна rate_limit_counters и получает общий итог: чужие попадания списываются из своего ведра,
+    так что лимит примерно общий на все экземпляры. Отказ в запросе в БД не ходит никогда.
+    '''
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], max_keys: int, sync_interval: float):
+        self.limits = limits
+        self.max_keys = max_keys
+        self.sync_interval = sync_interval
+        self._buckets: 'OrderedDict[str, Bucket]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_sync = time.monotonic() + sync_interval
+        self._syncing = False
+        self._cleaned_window = 0
+
+    def check(self, user_id: Any, action: str) -> Optional[int]:
+        capacity, per_second = self.limits[action]
+        key = f'{action}:{user_id}'
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = Bucket(capacity, now)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated_at) * per_second)
+                bucket.updated_at = now
+
+            if bucket.tokens < 1:
+                # Retry-After — целое число секунд, на каждом пути
+                return int(math.ceil((1 - bucket.tokens) / per_second)) if per_second > 0 else SYNC_WINDOW
+            bucket.tokens -= 1
+            bucket.pending_hits += 1
+            return None
+
+    def sync_due(self) -> bool:
+        return time.monotonic() >= self._next_sync and not self._syncing
+
+    def _collect(self, window: int) -> Tuple[List[str], List[int]]:
+        keys, hits = [], []
+        with self._lock:
+            for key, bucket in self._buckets.items():
+                if bucket.window != window:
+                    bucket.window, bucket.local_hits, bucket.remote_hits = window, 0, 0
+                if bucket.pending_hits:
+                    keys.append(key)
+                    hits.append(bucket.pending_hits)
+                    bucket.local_hits += bucket.pending_hits
+                    bucket.pending_hits = 0
+        return keys, hits
+
+    def sync(self) -> None:
+        '''
+        Один INSERT ... ON CONFLICT на все ведра, где были попадания с прошлой синхронизации.
+        Берет свое соединение из пула и сам коммитит; ошибки синхронизации не роняют запрос.
+        '''
+        with self._lock:
+            if self._syncing:
+                return
+            self._syncing = True
+            self._next_sync = time.monotonic() + self.sync_interval
+        driver = load_driver()
+        try:
+            window = int(time.time()) // SYNC_WINDOW * SYNC_WINDOW
+            keys, hits = self._collect(window)
+            if not keys:
+                return
+            conn = get_db_connection()
+            try:
+                cur = conn.cursor()
+                cur.execute(SYNC_SQL, {'buckets': keys, 'windows': [window] * len(keys), 'hits': hits})
+                totals = cur.fetchall()
+                if self._cleaned_window != window:
+                    cur.execute("DELETE FROM rate_limit_counters WHERE window_start < %s", (window - SYNC_KEEP_WINDOWS * SYNC_WINDOW,))
+                    self._cleaned_window = window
+                conn.commit()
+                cur.close()
+            finally:
+                release_db_connection(conn)
+
+            with self._lock:
+                for key, total in totals:
+                    bucket = self._buckets.get(key)
+                    if bucket is None or bucket.window != window:
+                        continue
+                    remote = max(total - bucket.local_hits, 0)
+                    bucket.tokens -= remote - bucket.remote_hits
+                    bucket.remote_hits = remote
+        except (driver.Error, PoolExhausted):
+            pass
+        finally:
+            self._syncing = False
+
+
+limiter = RateLimiter(LIMITS, MAX_KEYS, SYNC_INTERVAL)
+
+
+def rate_limited(user_id: Any, action: str) -> Optional[int]:
+    '''Проверка перед любой работой с БД: None — пропустить, число — секунды для Retry-After'''
+    if not ENABLED:
+        return None
+    retry_after = limiter.check(user_id, action)
+    if retry_after is None and SYNC_ENABLED and limiter.sync_due():
+        limiter.sync()
+    return retry_after
+
+
+def too_many_requests(retry_after: int) -> Dict[str, Any]:
+    headers = dict(JSON_HEADERS, **{'Retry-After': str(int(math.ceil(retry_after))), 'Access-Control-Expose-Headers': 'Retry-After'})
+    return response(429, {'success': False, 'error': 'Слишком много запросов, попробуйте позже'}, headers)
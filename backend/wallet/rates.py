@@ -0,0 +1,76 @@
+'''
+Business: Курсы валют из таблицы exchange_rates с кэшем в памяти теплого экземпляра
+Args: курсор БД (нужен только при устаревшем кэше), пара валют, EXCHANGE_RATE_TTL из окружения (секунды)
+Returns: текущий курс с номером версии и пересчет суммы по нему
+'''
+
+import os
+import threading
+import time
+from decimal import Decimal, ROUND_DOWN
+from typing import Any, Dict, Optional, Tuple
+
+CENT = Decimal('0.01')
+RATE_TTL = float(os.environ.get('EXCHANGE_RATE_TTL', '60'))
+
+CURRENT_RATES_SQL = """
+    SELECT DISTINCT ON (base_currency, quote_currency) id, base_currency, quote_currency, rate
+    FROM exchange_rates
+    ORDER BY base_currency, quote_currency, id DESC
+"""
+
+
+class Rate:
+    __slots__ = ('version', 'base_currency', 'quote_currency', 'rate')
+
+    def __init__(self, version: int, base_currency: str, quote_currency: str, rate: Decimal):
+        self.version = version
+        self.base_currency = base_currency
+        self.quote_currency = quote_currency
+        self.rate = rate
+
+    def convert(self, amount: Decimal, from_currency: str) -> Decimal:
+        '''Пересчет в обе стороны по одному курсу, остаток меньше копейки отбрасывается'''
+        if from_currency == self.base_currency:
+            converted = amount * self.rate
+        else:
+            converted = amount / self.rate
+        return converted.quantize(CENT, rounding=ROUND_DOWN)
+
+
+class RateCache:
+    '''
+    Все текущие курсы перечитываются одним запросом не чаще раза в ttl секунд.
+    Новый курс от персонала доходит до каждого экземпляра не позже чем через ttl, без передеплоя.
+    '''
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._rates: Dict[Tuple[str, str], Rate] = {}
+        self._expires_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def _load(self, cur: Any) -> None:
+        cur.execute(CURRENT_RATES_SQL)
+        rates = {
+            (row['base_currency'], row['quote_currency']): Rate(
+                row['id'], row['base_currency'], row['quote_currency'], Decimal(row['rate'])
+            )
+            for row in cur.fetchall()
+        }
+        with self._lock:
+            self._rates = rates
+            self._expires_at = time.monotonic() + self.ttl
+
+    def get(self, cur: Any, from_currency: str, to_currency: str) -> Optional[Rate]:
+        if time.monotonic() >= self._expires_at:
+            self._load(cur)
+        rates = self._rates
+        return rates.get((from_currency, to_currency)) or rates.get((to_currency, from_currency))
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._expires_at = float('-inf')
+
+
+rates = RateCache(RATE_TTL)
@@ -0,0 +1,188 @@
+'''
+Business: Замеры одного вызова функции: время запросов к БД, коммиты, подключения, холодный старт
+Args: REQUEST_TIMING (1 — писать строку лога на каждый вызов), SERVER_TIMING (1 — отдавать заголовок Server-Timing), FUNCTION_NAME
+Returns: JSON-строку в stdout и заголовок Server-Timing для ответа
+'''
+
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+LOG_ENABLED = os.environ.get('REQUEST_TIMING', '0') == '1'
+HEADER_ENABLED = os.environ.get('SERVER_TIMING', '0') == '1'
+ENABLED = LOG_ENABLED or HEADER_ENABLED
+FUNCTION_NAME = os.environ.get('FUNCTION_NAME') or os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+MAX_LOGGED_QUERIES = 20
+
+_current = threading.local()
+_cold = True
+_cold_lock = threading.Lock()
+
+
+class RequestTrace:
+    __slots__ = ('started', 'cold', 'acquire', 'connect', 'connects', 'queries', 'query_time',
+                 'commits', 'rollbacks', 'commit_time', 'statements')
+
+    def __init__(self, cold: bool):
+        self.started = time.perf_counter()
+        self.cold = cold
+        self.acquire = 0.0
+        self.connect = 0.0
+        self.connects = 0
+        self.queries = 0
+        self.query_time = 0.0
+        self.commits = 0
+        self.rollbacks = 0
+        self.commit_time = 0.0
+        self.statements: List[List[Any]] = []
+
+
+def current() -> Optional[RequestTrace]:
+    return getattr(_current, 'trace', None)
+
+
+def _statement_label(query: Any) -> str:
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    return ' '.join(str(query).split())[:80]
+
+
+class InstrumentedCursorMixin:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            trace = current()
+            if trace is not None:
+                elapsed = time.perf_counter() - started
+                trace.queries += 1
+                trace.query_time += elapsed
+                if len(trace.statements) < MAX_LOGGED_QUERIES:
+                    trace.statements.append([_statement_label(query), round(elapsed * 1000, 3)])
+
+
+_cursor_types: Dict[type, type] = {}
+_connection_factory: Optional[type] = None
+
+
+def connection_factory() -> type:
+    '''Класс соединения собирается при первом подключении: импорт timing не загружает psycopg2'''
+    global _connection_factory
+    if _connection_factory is None:
+        import psycopg2.extensions
+
+        class InstrumentedConnection(psycopg2.extensions.connection):
+            '''Соединение, чьи курсоры (включая RealDictCursor из обработчиков) засекают каждый execute'''
+
+            def cursor(self, *args: Any, **kwargs: Any) -> Any:
+                base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+                cursor_type = _cursor_types.get(base)
+                if cursor_type is None:
+                    cursor_type = _cursor_types[base] = type('Instrumented' + base.__name__, (InstrumentedCursorMixin, base), {})
+                kwargs['cursor_factory'] = cursor_type
+                return super().cursor(*args, **kwargs)
+
+            def commit(self) -> None:
+                started = time.perf_counter()
+                try:
+                    super().commit()
+                finally:
+                    trace = current()
+                    if trace is not None:
+                        trace.commits += 1
+                        trace.commit_time += time.perf_counter() - started
+
+            def rollback(self) -> None:
+                started = time.perf_counter()
+                try:
+                    super().rollback()
+                finally:
+                    trace = current()
+                    if trace is not None:
+                        trace.rollbacks += 1
+                        trace.commit_time += time.perf_counter() - started
+
+        _connection_factory = InstrumentedConnection
+    return _connection_factory
+
+
+def record_acquire(elapsed: float) -> None:
+    trace = current()
+    if trace is not None:
+        trace.acquire += elapsed
+
+
+def record_connect(elapsed: float) -> None:
+    trace = current()
+    if trace is not None:
+        trace.connects += 1
+        trace.connect += elapsed
+
+
+def begin() -> RequestTrace:
+    global _cold
+    with _cold_lock:
+        cold, _cold = _cold, False
+    trace = _current.trace = RequestTrace(cold)
+    return trace
+
+
+def finish(trace: RequestTrace, event: Any, response: Optional[Dict[str, Any]],
+           pool: Optional[Dict[str, int]] = None) -> None:
+    '''
+    Пишет строку лога и/или добавляет Server-Timing; время подключения входит в acquire.
+    pool — счетчики пула соединений (db.pool_stats()) на конец вызова, попадают в строку лога.
+    '''
+    _current.trace = None
+    total = time.perf_counter() - trace.started
+    app = max(total - trace.acquire - trace.query_time - trace.commit_time, 0.0)
+
+    if HEADER_ENABLED and response is not None:
+        server_timing = (
+            f'acquire;dur={trace.acquire * 1000:.2f}, '
+            f'db;dur={trace.query_time * 1000:.2f};desc="{trace.queries} queries", '
+            f'commit;dur={trace.commit_time * 1000:.2f}, '
+            f'app;dur={app * 1000:.2f}, '
+            f'total;dur={total * 1000:.2f}'
+        )
+        if trace.cold:
+            server_timing += ', cold'
+        headers = response.get('headers') or {}
+        # Дописываем, а не заменяем: ETag, Retry-After, X-Next-Cursor и прочие открытые заголовки должны остаться видны
+        exposed = headers.get('Access-Control-Expose-Headers')
+        response['headers'] = dict(
+            headers,
+            **{
+                'Server-Timing': server_timing,
+                'Timing-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': f'{exposed}, Server-Timing' if exposed else 'Server-Timing',
+            }
+        )
+
+    if LOG_ENABLED:
+        event = event if isinstance(event, dict) else {}
+        line = {
+            'type': 'request_timing',
+            'function': FUNCTION_NAME,
+            'method': event.get('httpMethod'),
+            'status': response.get('statusCode') if response else None,
+            'cold_start': trace.cold,
+            'total_ms': round(total * 1000, 3),
+            'acquire_ms': round(trace.acquire * 1000, 3),
+            'connects': trace.connects,
+            'connect_ms': round(trace.connect * 1000, 3),
+            'queries': trace.queries,
+            'query_ms': round(trace.query_time * 1000, 3),
+            'commits': trace.commits,
+            'rollbacks': trace.rollbacks,
+            'commit_ms': round(trace.commit_time * 1000, 3),
+            'app_ms': round(app * 1000, 3),
+            'statements': trace.statements,
+            'pool': pool,
+        }
+        sys.stdout.write(json.dumps(line, ensure_ascii=False) + '\n')
+        sys.stdout.flush()
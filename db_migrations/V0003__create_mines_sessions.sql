@@ -0,0 +1,15 @@
+-- Сессии игры в мины: поле хранится битовыми масками (бит i = клетка i из 25)
+CREATE TABLE IF NOT EXISTS mines_sessions (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    bet_amount DECIMAL(12, 2) NOT NULL,
+    mines_count SMALLINT NOT NULL CHECK (mines_count BETWEEN 1 AND 24),
+    mines_mask INTEGER NOT NULL,
+    revealed_mask INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(10) NOT NULL DEFAULT 'active' CHECK (status IN ('active', 'won', 'lost')),
+    win_amount DECIMAL(12, 2),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    settled_at TIMESTAMP
+);
+
+CREATE INDEX idx_mines_sessions_active ON mines_sessions(user_id) WHERE status = 'active';
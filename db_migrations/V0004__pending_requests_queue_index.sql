@@ -0,0 +1,5 @@
+-- Очередь необработанных заявок: keyset-пагинация по (created_at, id) и count(*) только по индексу
+CREATE INDEX IF NOT EXISTS idx_requests_pending_queue
+    ON requests (created_at DESC, id DESC)
+    INCLUDE (currency, type)
+    WHERE status = 'pending';
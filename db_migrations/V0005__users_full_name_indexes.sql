@@ -0,0 +1,17 @@
+-- Дубликаты ФИО, успевшие появиться до уникального индекса (гонка SELECT + INSERT при регистрации):
+-- первая учетная запись сохраняет имя, остальные получают суффикс с id
+UPDATE users u
+SET full_name = u.full_name || ' #' || u.id
+WHERE EXISTS (
+    SELECT 1 FROM users earlier
+    WHERE earlier.full_name = u.full_name AND earlier.id < u.id
+);
+
+-- Вход и проверка дубликата при регистрации: точное совпадение ФИО
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_full_name ON users (full_name);
+
+-- Поиск клиента персоналом без учета регистра
+CREATE INDEX IF NOT EXISTS idx_users_full_name_lower ON users (LOWER(full_name));
+
+-- PIN-код из 4 цифр почти не отсекает строки, индекс только замедлял запись
+DROP INDEX IF EXISTS idx_users_pin;
@@ -0,0 +1,9 @@
+-- Отозванные токены сессии (выход из аккаунта). Функции перечитывают список периодически,
+-- строки с истекшим expires_at больше не нужны и могут удаляться
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti VARCHAR(32) PRIMARY KEY,
+    expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON revoked_tokens(expires_at);
@@ -0,0 +1,30 @@
+-- Курсы валют с историей: новая строка = новая версия курса, текущий курс — последняя версия пары.
+-- rate: сколько единиц quote_currency стоит одна единица base_currency
+CREATE TABLE IF NOT EXISTS exchange_rates (
+    id SERIAL PRIMARY KEY,
+    base_currency VARCHAR(3) NOT NULL CHECK (base_currency IN ('RUB', 'USD')),
+    quote_currency VARCHAR(3) NOT NULL CHECK (quote_currency IN ('RUB', 'USD')),
+    rate DECIMAL(18, 6) NOT NULL CHECK (rate > 0),
+    created_by INTEGER REFERENCES users(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CHECK (base_currency <> quote_currency)
+);
+
+CREATE INDEX IF NOT EXISTS idx_exchange_rates_pair ON exchange_rates (base_currency, quote_currency, id DESC);
+
+-- Курс, который был зашит в wallet
+INSERT INTO exchange_rates (base_currency, quote_currency, rate) VALUES ('USD', 'RUB', 95.00);
+
+-- Выполненные обмены с версией курса, по которому они прошли
+CREATE TABLE IF NOT EXISTS exchanges (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    from_currency VARCHAR(3) NOT NULL,
+    to_currency VARCHAR(3) NOT NULL,
+    amount DECIMAL(12, 2) NOT NULL,
+    converted_amount DECIMAL(12, 2) NOT NULL,
+    rate_version INTEGER NOT NULL REFERENCES exchange_rates(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_exchanges_user ON exchanges (user_id, id DESC);
@@ -0,0 +1,40 @@
+-- Валюты справочником, а не CHECK в каждой таблице: новая валюта — новая строка, без новых колонок
+CREATE TABLE IF NOT EXISTS currencies (
+    code VARCHAR(3) PRIMARY KEY,
+    name VARCHAR(32) NOT NULL,
+    symbol VARCHAR(8) NOT NULL
+);
+
+INSERT INTO currencies (code, name, symbol) VALUES
+    ('RUB', 'Российский рубль', '₽'),
+    ('USD', 'Доллар США', '$')
+ON CONFLICT (code) DO NOTHING;
+
+-- Баланс: одна строка на пару (пользователь, валюта); нет строки — баланс 0
+CREATE TABLE IF NOT EXISTS balances (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    currency VARCHAR(3) NOT NULL REFERENCES currencies(code),
+    amount DECIMAL(12, 2) NOT NULL DEFAULT 0.00 CHECK (amount >= 0),
+    PRIMARY KEY (user_id, currency)
+);
+
+INSERT INTO balances (user_id, currency, amount)
+SELECT id, 'RUB', COALESCE(balance_rub, 0) FROM users
+UNION ALL
+SELECT id, 'USD', COALESCE(balance_usd, 0) FROM users
+ON CONFLICT (user_id, currency) DO NOTHING;
+
+ALTER TABLE users DROP COLUMN IF EXISTS balance_rub;
+ALTER TABLE users DROP COLUMN IF EXISTS balance_usd;
+
+-- Допустимые валюты заявок и курсов теперь определяет справочник
+ALTER TABLE requests DROP CONSTRAINT IF EXISTS requests_currency_check;
+ALTER TABLE requests ADD CONSTRAINT requests_currency_fkey FOREIGN KEY (currency) REFERENCES currencies(code);
+
+ALTER TABLE exchange_rates DROP CONSTRAINT IF EXISTS exchange_rates_base_currency_check;
+ALTER TABLE exchange_rates DROP CONSTRAINT IF EXISTS exchange_rates_quote_currency_check;
+ALTER TABLE exchange_rates ADD CONSTRAINT exchange_rates_base_currency_fkey FOREIGN KEY (base_currency) REFERENCES currencies(code);
+ALTER TABLE exchange_rates ADD CONSTRAINT exchange_rates_quote_currency_fkey FOREIGN KEY (quote_currency) REFERENCES currencies(code);
+
+ALTER TABLE exchanges ADD CONSTRAINT exchanges_from_currency_fkey FOREIGN KEY (from_currency) REFERENCES currencies(code);
+ALTER TABLE exchanges ADD CONSTRAINT exchanges_to_currency_fkey FOREIGN KEY (to_currency) REFERENCES currencies(code);
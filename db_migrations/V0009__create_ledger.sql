@@ -0,0 +1,50 @@
+-- Журнал движений по балансам: только добавление, каждая строка — изменение одного баланса.
+-- balance_after — баланс сразу после движения, для выписок без пересчета
+CREATE TABLE IF NOT EXISTS ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    currency VARCHAR(3) NOT NULL REFERENCES currencies(code),
+    delta DECIMAL(12, 2) NOT NULL,
+    balance_after DECIMAL(12, 2) NOT NULL,
+    kind VARCHAR(20) NOT NULL CHECK (kind IN ('opening', 'signup', 'game', 'mines_bet', 'mines_win', 'exchange', 'deposit', 'withdraw', 'adjustment')),
+    reference_id BIGINT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_ledger_user_currency ON ledger (user_id, currency, id);
+
+CREATE OR REPLACE FUNCTION ledger_append_only() RETURNS trigger AS $$
+BEGIN
+    RAISE EXCEPTION 'ledger is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER ledger_no_update_delete
+    BEFORE UPDATE OR DELETE ON ledger
+    FOR EACH ROW EXECUTE FUNCTION ledger_append_only();
+
+-- Снимки балансов: сумма всех движений пары (пользователь, валюта) до ledger_id включительно.
+-- Баланс по журналу = последний снимок + движения с id > ledger_id
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    currency VARCHAR(3) NOT NULL REFERENCES currencies(code),
+    ledger_id BIGINT NOT NULL,
+    amount DECIMAL(14, 2) NOT NULL,
+    taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, currency, ledger_id)
+);
+
+-- Текущие балансы становятся начальными записями журнала
+INSERT INTO ledger (user_id, currency, delta, balance_after, kind)
+SELECT user_id, currency, amount, amount, 'opening'
+FROM balances
+WHERE amount <> 0
+ORDER BY user_id, currency;
+
+-- Прогоны снимков: каждый следующий читает журнал только после upto_ledger_id предыдущего
+CREATE TABLE IF NOT EXISTS ledger_snapshot_runs (
+    id SERIAL PRIMARY KEY,
+    upto_ledger_id BIGINT NOT NULL,
+    snapshots INTEGER NOT NULL,
+    taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
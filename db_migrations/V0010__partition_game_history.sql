@@ -0,0 +1,82 @@
+-- История игр секционируется по дням (created_at): старые дни отсоединяются целиком, без DELETE и VACUUM
+ALTER TABLE game_history RENAME TO game_history_legacy;
+ALTER INDEX game_history_pkey RENAME TO game_history_legacy_pkey;
+ALTER INDEX idx_game_history_user RENAME TO idx_game_history_legacy_user;
+
+CREATE TABLE game_history (
+    id BIGINT NOT NULL DEFAULT nextval('game_history_id_seq'),
+    user_id INTEGER REFERENCES users(id),
+    game_type VARCHAR(20) NOT NULL CHECK (game_type IN ('roulette', 'mines')),
+    bet_amount DECIMAL(12, 2) NOT NULL,
+    result VARCHAR(10) NOT NULL CHECK (result IN ('win', 'loss')),
+    win_amount DECIMAL(12, 2) DEFAULT 0.00,
+    details JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX idx_game_history_user_time ON game_history (user_id, created_at DESC, id DESC);
+
+-- Все, что было до миграции, — одна архивная секция; дальше секции по дням на две недели вперед.
+-- Новые дни создает и старые отсоединяет обслуживание из staff (action maintain_history)
+DO $$
+DECLARE
+    today DATE := CURRENT_DATE;
+    day DATE;
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE game_history_archive PARTITION OF game_history FOR VALUES FROM (MINVALUE) TO (%L)',
+        today
+    );
+    FOR i IN 0..14 LOOP
+        day := today + i;
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF game_history FOR VALUES FROM (%L) TO (%L)',
+            'game_history_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+        );
+    END LOOP;
+END $$;
+
+-- Страховка на случай, если обслуживание давно не запускалось: строки вне созданных дней
+CREATE TABLE game_history_default PARTITION OF game_history DEFAULT;
+
+INSERT INTO game_history (id, user_id, game_type, bet_amount, result, win_amount, details, created_at)
+SELECT id, user_id, game_type, bet_amount, result, win_amount, details, COALESCE(created_at, 'epoch'::timestamp)
+FROM game_history_legacy;
+
+ALTER SEQUENCE game_history_id_seq AS BIGINT OWNED BY game_history.id;
+DROP TABLE game_history_legacy;
+
+-- Дневные сводки, которые обновляются инкрементально по новым строкам истории
+CREATE TABLE IF NOT EXISTS game_stats_user_daily (
+    day DATE NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    game_type VARCHAR(20) NOT NULL,
+    rounds BIGINT NOT NULL,
+    wins BIGINT NOT NULL,
+    total_bet DECIMAL(16, 2) NOT NULL,
+    total_win DECIMAL(16, 2) NOT NULL,
+    PRIMARY KEY (day, user_id, game_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_game_stats_user_daily_user ON game_stats_user_daily (user_id, day);
+
+CREATE TABLE IF NOT EXISTS game_stats_daily (
+    day DATE NOT NULL,
+    game_type VARCHAR(20) NOT NULL,
+    players BIGINT NOT NULL,
+    rounds BIGINT NOT NULL,
+    wins BIGINT NOT NULL,
+    total_bet DECIMAL(18, 2) NOT NULL,
+    total_win DECIMAL(18, 2) NOT NULL,
+    PRIMARY KEY (day, game_type)
+);
+
+-- Прогоны сводок: следующий читает только id после upto_id и created_at не раньше cutoff прошлого прогона
+CREATE TABLE IF NOT EXISTS game_stats_runs (
+    id SERIAL PRIMARY KEY,
+    upto_id BIGINT NOT NULL,
+    cutoff TIMESTAMP NOT NULL,
+    rounds BIGINT NOT NULL,
+    taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,19 @@
+-- Пары сидов для доказуемо честных исходов: хэш server_seed показывается игроку заранее,
+-- сам сид раскрывается при смене пары (revealed_at), nonce растет на каждый раунд
+CREATE TABLE IF NOT EXISTS fair_seeds (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    server_seed VARCHAR(64) NOT NULL,
+    server_seed_hash VARCHAR(64) NOT NULL,
+    client_seed VARCHAR(64) NOT NULL,
+    nonce BIGINT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    revealed_at TIMESTAMP
+);
+
+-- Не больше одной нераскрытой пары на игрока
+CREATE UNIQUE INDEX IF NOT EXISTS idx_fair_seeds_active ON fair_seeds (user_id) WHERE revealed_at IS NULL;
+
+-- Поле мин выводится из сида и nonce, по ним игру можно перепроверить после раскрытия сида
+ALTER TABLE mines_sessions ADD COLUMN IF NOT EXISTS seed_id BIGINT REFERENCES fair_seeds(id);
+ALTER TABLE mines_sessions ADD COLUMN IF NOT EXISTS nonce BIGINT;
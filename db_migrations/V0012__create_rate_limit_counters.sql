@@ -0,0 +1,10 @@
+-- Общие счетчики лимитов запросов: экземпляры функций пачками добавляют свои попадания за минутное окно
+-- (включается RATE_LIMIT_SYNC=1; без нее лимиты живут только в памяти экземпляра)
+CREATE TABLE IF NOT EXISTS rate_limit_counters (
+    bucket VARCHAR(64) NOT NULL,
+    window_start BIGINT NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (bucket, window_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_counters_window ON rate_limit_counters (window_start);
@@ -0,0 +1,14 @@
+-- Ответы на запросы с заголовком Idempotency-Key: повтор с тем же ключом получает сохраненный ответ,
+-- а не выполняет ставку, обмен или заявку еще раз. Строка пишется в той же транзакции, что и само действие
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INTEGER NOT NULL,
+    idempotency_key VARCHAR(128) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status_code INTEGER,
+    response TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at);
@@ -0,0 +1,32 @@
+-- Итоги для панели персонала: запрос статистики читает только эти таблицы, их размер не зависит от длины истории.
+-- Суммы движений журнала по валюте и виду (пополнения, выводы и т.д.) — дописываются прогоном снимков
+-- по тому же хвосту ledger, что и balance_snapshots, поэтому соответствуют upto_ledger_id последнего прогона
+CREATE TABLE IF NOT EXISTS ledger_totals (
+    currency VARCHAR(3) NOT NULL REFERENCES currencies(code),
+    kind VARCHAR(20) NOT NULL,
+    entries BIGINT NOT NULL,
+    total_delta DECIMAL(18, 2) NOT NULL,
+    PRIMARY KEY (currency, kind)
+);
+
+INSERT INTO ledger_totals (currency, kind, entries, total_delta)
+SELECT currency, kind, count(*), sum(delta)
+FROM ledger
+WHERE id <= (SELECT COALESCE(max(upto_ledger_id), 0) FROM ledger_snapshot_runs)
+GROUP BY currency, kind
+ON CONFLICT (currency, kind) DO NOTHING;
+
+-- Итоги игр за все время по типу игры — дописываются прогоном дневных сводок вместе с game_stats_daily
+CREATE TABLE IF NOT EXISTS game_totals (
+    game_type VARCHAR(20) PRIMARY KEY,
+    rounds BIGINT NOT NULL,
+    wins BIGINT NOT NULL,
+    total_bet DECIMAL(18, 2) NOT NULL,
+    total_win DECIMAL(18, 2) NOT NULL
+);
+
+INSERT INTO game_totals (game_type, rounds, wins, total_bet, total_win)
+SELECT game_type, sum(rounds), sum(wins), sum(total_bet), sum(total_win)
+FROM game_stats_daily
+GROUP BY game_type
+ON CONFLICT (game_type) DO NOTHING;
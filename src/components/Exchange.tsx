@@ -2,7 +2,8 @@ import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
-import { useState } from 'react';
+import { useState, useEffect } from 'react';
+import { authHeaders } from '@/lib/session';
 import Icon from '@/components/ui/icon';
 import { useToast } from '@/hooks/use-toast';
 
@@ -14,18 +15,29 @@ interface Props {
   apiUrl: string;
 }
 
-const EXCHANGE_RATE = 95;
+// Курс до первого ответа сервера; дальше — текущая версия из exchange_rates
+const DEFAULT_EXCHANGE_RATE = 95;
 
 export default function Exchange({ userId, balanceRub, balanceUsd, onBalanceUpdate, apiUrl }: Props) {
   const [amount, setAmount] = useState('');
   const [fromCurrency, setFromCurrency] = useState<'RUB' | 'USD'>('RUB');
+  const [exchangeRate, setExchangeRate] = useState(DEFAULT_EXCHANGE_RATE);
   const { toast } = useToast();
 
+  useEffect(() => {
+    fetch(`${apiUrl}?mode=rate`, { headers: authHeaders(userId) })
+      .then((response) => response.json())
+      .then((data) => {
+        if (data.rate) setExchangeRate(Number(data.rate));
+      })
+      .catch(() => undefined);
+  }, [apiUrl, userId]);
+
   const toCurrency = fromCurrency === 'RUB' ? 'USD' : 'RUB';
   const convertedAmount = parseFloat(amount) 
     ? fromCurrency === 'RUB' 
-      ? (parseFloat(amount) / EXCHANGE_RATE).toFixed(2)
-      : (parseFloat(amount) * EXCHANGE_RATE).toFixed(2)
+      ? (parseFloat(amount) / exchangeRate).toFixed(2)
+      : (parseFloat(amount) * exchangeRate).toFixed(2)
     : '0';
 
   const handleExchange = async () => {
@@ -48,7 +60,7 @@ export default function Exchange({ userId, balanceRub, balanceUsd, onBalanceUpda
     try {
       const response = await fetch(apiUrl, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json', 'X-User-Id': userId.toString() },
+        headers: { 'Content-Type': 'application/json', ...authHeaders(userId) },
         body: JSON.stringify({
           action: 'exchange',
           amount: value,
@@ -61,6 +73,7 @@ export default function Exchange({ userId, balanceRub, balanceUsd, onBalanceUpda
 
       if (data.success) {
         onBalanceUpdate(data.balance.balance_rub, data.balance.balance_usd);
+        if (data.rate) setExchangeRate(Number(data.rate));
         toast({ title: 'Успех!', description: data.message });
         setAmount('');
       } else {
@@ -81,7 +94,7 @@ export default function Exchange({ userId, balanceRub, balanceUsd, onBalanceUpda
       <h2 className="text-3xl font-bold text-[#f1c40f] mb-6">Обмен валют</h2>
 
       <div className="mb-6 p-4 bg-[#0f3460]/50 rounded-lg text-center">
-        <p className="text-gray-300">Курс обмена: <span className="text-[#f1c40f] font-bold">1 USD = {EXCHANGE_RATE} RUB</span></p>
+        <p className="text-gray-300">Курс обмена: <span className="text-[#f1c40f] font-bold">1 USD = {exchangeRate} RUB</span></p>
       </div>
 
       <div className="space-y-6">
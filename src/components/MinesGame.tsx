@@ -1,4 +1,5 @@
 import { useState } from 'react';
+import { authHeaders } from '@/lib/session';
 import { Button } from '@/components/ui/button';
 import { Card } from '@/components/ui/card';
 import { Input } from '@/components/ui/input';
@@ -19,11 +20,24 @@ export default function MinesGame({ userId, balance, onBalanceUpdate, apiUrl }:
   const [minesCount, setMinesCount] = useState([3]);
   const [grid, setGrid] = useState<boolean[]>(Array(25).fill(false));
   const [mines, setMines] = useState<number[]>([]);
+  const [sessionId, setSessionId] = useState<number | null>(null);
   const [gameActive, setGameActive] = useState(false);
   const [multiplier, setMultiplier] = useState(1.0);
   const [openedCells, setOpenedCells] = useState(0);
   const { toast } = useToast();
 
+  const postMines = async (payload: Record<string, unknown>) => {
+    const response = await fetch(apiUrl, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', ...authHeaders(userId) },
+      body: JSON.stringify({ game_type: 'mines', ...payload }),
+    });
+    return response.json();
+  };
+
+  const revealedCells = (cells: boolean[]) =>
+    cells.flatMap((opened, index) => (opened && !mines.includes(index) ? [index] : []));
+
   const startGame = async () => {
     const betAmount = parseFloat(bet);
     if (isNaN(betAmount) || betAmount <= 0 || betAmount > balance) {
@@ -32,53 +46,77 @@ export default function MinesGame({ userId, balance, onBalanceUpdate, apiUrl }:
     }
 
     try {
-      const response = await fetch(apiUrl, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json', 'X-User-Id': userId.toString() },
-        body: JSON.stringify({ game_type: 'mines', bet_amount: betAmount, mines_count: minesCount[0], opened_cells: 0 }),
-      });
-
-      const data = await response.json();
+      const data = await postMines({ action: 'start', bet_amount: betAmount, mines_count: minesCount[0] });
 
       if (data.success) {
-        setMines(data.mines);
+        setSessionId(data.session_id);
+        setMines([]);
         setGameActive(true);
         setGrid(Array(25).fill(false));
         setOpenedCells(0);
-        setMultiplier(1.0);
+        setMultiplier(Number(data.multiplier));
         onBalanceUpdate(data.balance, 0);
+      } else {
+        toast({ title: 'Ошибка', description: data.error, variant: 'destructive' });
       }
     } catch (error) {
       toast({ title: 'Ошибка', description: 'Не удалось начать игру', variant: 'destructive' });
     }
   };
 
-  const openCell = (index: number) => {
+  const finishGame = (data: { mines: number[]; balance: number }) => {
+    setMines(data.mines);
+    setGameActive(false);
+    setSessionId(null);
+    onBalanceUpdate(data.balance, 0);
+  };
+
+  const openCell = async (index: number) => {
     if (!gameActive || grid[index]) return;
 
-    const newGrid = [...grid];
-    newGrid[index] = true;
-    setGrid(newGrid);
+    try {
+      const data = await postMines({ action: 'reveal', session_id: sessionId, cell: index, revealed: revealedCells(grid) });
 
-    if (mines.includes(index)) {
-      setGameActive(false);
-      toast({ title: '💥 Взрыв!', description: 'Вы попали на мину!', variant: 'destructive' });
-      return;
-    }
+      if (!data.success) {
+        toast({ title: 'Ошибка', description: data.error, variant: 'destructive' });
+        return;
+      }
+
+      const newGrid = [...grid];
+      newGrid[index] = true;
+      setGrid(newGrid);
+      setOpenedCells(data.opened_cells);
+      setMultiplier(Number(data.multiplier));
 
-    const newOpened = openedCells + 1;
-    setOpenedCells(newOpened);
-    const newMultiplier = 1 + (newOpened * 0.3 * (minesCount[0] / 10));
-    setMultiplier(newMultiplier);
-    toast({ title: '✅ Безопасно!', description: `Множитель: x${newMultiplier.toFixed(2)}` });
+      if (data.mine) {
+        finishGame(data);
+        toast({ title: '💥 Взрыв!', description: 'Вы попали на мину!', variant: 'destructive' });
+      } else if (data.finished) {
+        finishGame(data);
+        toast({ title: '🎉 Выигрыш!', description: `Все клетки открыты! Вы выиграли ${data.win_amount}₽` });
+      } else {
+        toast({ title: '✅ Безопасно!', description: `Множитель: x${Number(data.multiplier).toFixed(2)}` });
+      }
+    } catch (error) {
+      toast({ title: 'Ошибка', description: 'Не удалось открыть клетку', variant: 'destructive' });
+    }
   };
 
-  const cashout = () => {
+  const cashout = async () => {
     if (!gameActive) return;
-    const winAmount = parseFloat(bet) * multiplier;
-    setGameActive(false);
-    onBalanceUpdate(balance + winAmount, 0);
-    toast({ title: '🎉 Выигрыш!', description: `Вы выиграли ${winAmount.toFixed(2)}₽` });
+
+    try {
+      const data = await postMines({ action: 'cashout', session_id: sessionId, revealed: revealedCells(grid) });
+
+      if (data.success) {
+        finishGame(data);
+        toast({ title: '🎉 Выигрыш!', description: `Вы выиграли ${data.win_amount}₽` });
+      } else {
+        toast({ title: 'Ошибка', description: data.error, variant: 'destructive' });
+      }
+    } catch (error) {
+      toast({ title: 'Ошибка', description: 'Не удалось забрать выигрыш', variant: 'destructive' });
+    }
   };
 
   return (
@@ -1,4 +1,5 @@
 import { useState } from 'react';
+import { authHeaders } from '@/lib/session';
 import { Button } from '@/components/ui/button';
 import { Card } from '@/components/ui/card';
 import { Input } from '@/components/ui/input';
@@ -32,7 +33,7 @@ export default function RouletteGame({ userId, balance, onBalanceUpdate, apiUrl
     try {
       const response = await fetch(apiUrl, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json', 'X-User-Id': userId.toString() },
+        headers: { 'Content-Type': 'application/json', ...authHeaders(userId) },
         body: JSON.stringify({ game_type: 'roulette', bet_amount: betAmount }),
       });
 
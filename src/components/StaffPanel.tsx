@@ -3,6 +3,7 @@ import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
 import { useState, useEffect } from 'react';
+import { authHeaders } from '@/lib/session';
 import Icon from '@/components/ui/icon';
 import { useToast } from '@/hooks/use-toast';
 
@@ -23,6 +24,8 @@ interface Request {
 
 export default function StaffPanel({ userId, apiUrl }: Props) {
   const [requests, setRequests] = useState<Request[]>([]);
+  const [pendingCount, setPendingCount] = useState(0);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [targetFullName, setTargetFullName] = useState('');
   const [manageAmount, setManageAmount] = useState('');
   const [manageCurrency, setManageCurrency] = useState('RUB');
@@ -34,15 +37,36 @@ export default function StaffPanel({ userId, apiUrl }: Props) {
     return () => clearInterval(interval);
   }, []);
 
+  const fetchPending = async (query: string) => {
+    const response = await fetch(`${apiUrl}?${query}`, {
+      method: 'GET',
+      headers: authHeaders(userId),
+    });
+    return response.json();
+  };
+
   const loadRequests = async () => {
     try {
-      const response = await fetch(apiUrl, {
-        method: 'GET',
-        headers: { 'X-User-Id': userId.toString() },
-      });
-      const data = await response.json();
-      if (Array.isArray(data)) {
-        setRequests(data);
+      const [page, total] = await Promise.all([fetchPending('limit=50'), fetchPending('mode=count')]);
+      if (Array.isArray(page.items)) {
+        setRequests(page.items);
+        setNextCursor(page.next_cursor);
+      }
+      if (typeof total.count === 'number') {
+        setPendingCount(total.count);
+      }
+    } catch (error) {
+      console.error('Ошибка загрузки заявок:', error);
+    }
+  };
+
+  const loadMoreRequests = async () => {
+    if (!nextCursor) return;
+    try {
+      const page = await fetchPending(`limit=50&cursor=${encodeURIComponent(nextCursor)}`);
+      if (Array.isArray(page.items)) {
+        setRequests((prev) => [...prev, ...page.items]);
+        setNextCursor(page.next_cursor);
       }
     } catch (error) {
       console.error('Ошибка загрузки заявок:', error);
@@ -53,7 +77,7 @@ export default function StaffPanel({ userId, apiUrl }: Props) {
     try {
       const response = await fetch(apiUrl, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json', 'X-User-Id': userId.toString() },
+        headers: { 'Content-Type': 'application/json', ...authHeaders(userId) },
         body: JSON.stringify({ action: 'process_request', request_id: requestId, decision }),
       });
 
@@ -70,6 +94,38 @@ export default function StaffPanel({ userId, apiUrl }: Props) {
     }
   };
 
+  const processAllRequests = async (decision: string) => {
+    if (requests.length === 0) return;
+    try {
+      const response = await fetch(apiUrl, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', ...authHeaders(userId) },
+        body: JSON.stringify({
+          action: 'process_requests',
+          decisions: requests.map((request) => ({ request_id: request.id, decision })),
+        }),
+      });
+
+      const data = await response.json();
+
+      if (data.success) {
+        const summary = data.summary || {};
+        const parts = [
+          `одобрено: ${summary.approved || 0}`,
+          `отклонено: ${summary.rejected || 0}`,
+          `недостаточно средств: ${summary.insufficient_funds || 0}`,
+          `пропущено: ${summary.skipped || 0}`,
+        ];
+        toast({ title: 'Заявки обработаны', description: parts.join(', ') });
+        loadRequests();
+      } else {
+        toast({ title: 'Ошибка', description: data.error, variant: 'destructive' });
+      }
+    } catch (error) {
+      toast({ title: 'Ошибка', description: 'Не удалось обработать заявки', variant: 'destructive' });
+    }
+  };
+
   const manageBalance = async (operation: string) => {
     const amount = parseFloat(manageAmount);
 
@@ -81,7 +137,7 @@ export default function StaffPanel({ userId, apiUrl }: Props) {
     try {
       const response = await fetch(apiUrl, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json', 'X-User-Id': userId.toString() },
+        headers: { 'Content-Type': 'application/json', ...authHeaders(userId) },
         body: JSON.stringify({ action: 'manage_balance', full_name: targetFullName, amount, operation, currency: manageCurrency }),
       });
 
@@ -156,7 +212,20 @@ export default function StaffPanel({ userId, apiUrl }: Props) {
       </Card>
 
       <Card className="p-8 bg-[#16213e]/80 border-[#f1c40f]/20">
-        <h3 className="text-2xl font-bold text-[#f1c40f] mb-6">Заявки на обработку ({requests.length})</h3>
+        <div className="flex justify-between items-center mb-6">
+          <h3 className="text-2xl font-bold text-[#f1c40f]">Заявки на обработку ({pendingCount})</h3>
+          {requests.length > 0 && (
+            <div className="flex gap-2">
+              <Button onClick={() => processAllRequests('approved')} className="bg-green-600 hover:bg-green-700">
+                <Icon name="CheckCheck" size={20} className="mr-2" />
+                Одобрить все ({requests.length})
+              </Button>
+              <Button onClick={() => processAllRequests('rejected')} variant="outline" className="border-red-600 text-red-600 hover:bg-red-600 hover:text-white">
+                Отклонить все
+              </Button>
+            </div>
+          )}
+        </div>
 
         {requests.length === 0 ? (
           <div className="text-center py-12">
@@ -191,6 +260,11 @@ export default function StaffPanel({ userId, apiUrl }: Props) {
                 </div>
               </div>
             ))}
+            {nextCursor && (
+              <Button onClick={loadMoreRequests} variant="outline" className="w-full border-[#f1c40f]/30 text-[#f1c40f]">
+                Показать ещё
+              </Button>
+            )}
           </div>
         )}
       </Card>
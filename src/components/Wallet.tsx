@@ -3,6 +3,7 @@ import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
 import { useState } from 'react';
+import { authHeaders } from '@/lib/session';
 import Icon from '@/components/ui/icon';
 import { useToast } from '@/hooks/use-toast';
 
@@ -28,7 +29,7 @@ export default function Wallet({ userId, balanceRub, balanceUsd, apiUrl }: Props
     try {
       const response = await fetch(apiUrl, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json', 'X-User-Id': userId.toString() },
+        headers: { 'Content-Type': 'application/json', ...authHeaders(userId) },
         body: JSON.stringify({ action: 'request', type: requestType, amount: value, currency: 'RUB' }),
       });
 
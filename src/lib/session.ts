@@ -0,0 +1,14 @@
+// Токен сессии выдается функцией auth при входе и хранится вместе с пользователем.
+// X-User-Id остается, пока бэкенд принимает старый заголовок (AUTH_ALLOW_USER_ID_HEADER).
+export function authHeaders(userId: number): Record<string, string> {
+  const headers: Record<string, string> = { 'X-User-Id': userId.toString() };
+  try {
+    const saved = JSON.parse(localStorage.getItem('casino_user') || 'null');
+    if (saved?.token) {
+      headers['X-Auth-Token'] = saved.token;
+    }
+  } catch {
+    // поврежденная запись в localStorage — идем без токена
+  }
+  return headers;
+}
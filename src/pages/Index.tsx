@@ -26,8 +26,16 @@ interface User {
   is_staff: boolean;
   balance_rub: number;
   balance_usd: number;
+  token?: string;
 }
 
+// Суммы приходят с сервера точными строками ('1000.00'), в интерфейсе работаем с числами
+const normalizeUser = (raw: User): User => ({
+  ...raw,
+  balance_rub: Number(raw.balance_rub),
+  balance_usd: Number(raw.balance_usd),
+});
+
 export default function Index() {
   const [user, setUser] = useState<User | null>(null);
   const [fullName, setFullName] = useState('');
@@ -40,7 +48,7 @@ export default function Index() {
   useEffect(() => {
     const savedUser = localStorage.getItem('casino_user');
     if (savedUser) {
-      setUser(JSON.parse(savedUser));
+      setUser(normalizeUser(JSON.parse(savedUser)));
     }
   }, []);
 
@@ -68,8 +76,9 @@ export default function Index() {
       const data = await response.json();
 
       if (response.ok && data.success) {
-        setUser(data.user);
-        localStorage.setItem('casino_user', JSON.stringify(data.user));
+        const loggedUser = normalizeUser({ ...data.user, token: data.token });
+        setUser(loggedUser);
+        localStorage.setItem('casino_user', JSON.stringify(loggedUser));
         toast({
           title: 'Успех!',
           description: data.message,
@@ -91,6 +100,13 @@ export default function Index() {
   };
 
   const handleLogout = () => {
+    if (user?.token) {
+      fetch(API_URL.auth, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-Auth-Token': user.token },
+        body: JSON.stringify({ action: 'logout' }),
+      }).catch(() => undefined);
+    }
     setUser(null);
     localStorage.removeItem('casino_user');
     setFullName('');
@@ -99,25 +115,35 @@ export default function Index() {
     setStaffPassword('');
   };
 
-  const handleStaffLogin = () => {
-    if (staffPassword === 'sidor123') {
-      const staffUser: User = {
-        id: 0,
-        full_name: 'Персонал',
-        is_staff: true,
-        balance_rub: 0,
-        balance_usd: 0,
-      };
-      setUser(staffUser);
-      localStorage.setItem('casino_user', JSON.stringify(staffUser));
-      toast({
-        title: 'Добро пожаловать!',
-        description: 'Вход в панель персонала выполнен',
+  const handleStaffLogin = async () => {
+    try {
+      const response = await fetch(API_URL.auth, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ action: 'staff_login', password: staffPassword }),
       });
-    } else {
+
+      const data = await response.json();
+
+      if (response.ok && data.success) {
+        const staffUser = normalizeUser({ ...data.user, token: data.token });
+        setUser(staffUser);
+        localStorage.setItem('casino_user', JSON.stringify(staffUser));
+        toast({
+          title: 'Добро пожаловать!',
+          description: data.message,
+        });
+      } else {
+        toast({
+          title: 'Ошибка',
+          description: data.error || 'Неверный пароль',
+          variant: 'destructive',
+        });
+      }
+    } catch (error) {
       toast({
         title: 'Ошибка',
-        description: 'Неверный пароль',
+        description: 'Не удалось подключиться к серверу',
         variant: 'destructive',
       });
     }
@@ -125,7 +151,7 @@ export default function Index() {
 
   const updateBalance = (balance_rub: number, balance_usd: number) => {
     if (user) {
-      const updatedUser = { ...user, balance_rub, balance_usd };
+      const updatedUser = { ...user, balance_rub: Number(balance_rub), balance_usd: Number(balance_usd) };
       setUser(updatedUser);
       localStorage.setItem('casino_user', JSON.stringify(updatedUser));
     }